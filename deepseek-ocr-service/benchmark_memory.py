@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark for the OCR request path.
+
+Compares peak RSS of building one vLLM request for a ~10 MB newspaper scan:
+  before: raw bytes -> base64 str -> data URL -> json.dumps of the whole body
+  after:  raw bytes -> prepare_image (downscale once) -> build_body_parts
+
+Each path runs in a fresh subprocess so the peaks do not contaminate each other.
+Peak RSS is read from /proc, so the benchmark is Linux-only.
+Usage: python benchmark_memory.py [path/to/scan.jpg]
+"""
+import os
+import sys
+import json
+import base64
+import subprocess
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def _status_mb(field: str) -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def current_rss_mb() -> float:
+    return _status_mb("VmRSS")
+
+
+def peak_rss_mb() -> float:
+    return _status_mb("VmHWM")
+
+
+def reset_peak_rss():
+    """
+    Resets the kernel's RSS high-water mark (Linux >= 4.0) so the measured
+    peak covers only the request path, not interpreter start-up and imports.
+    """
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def make_sample_scan(path: str, target_mb: int = 10):
+    """
+    Writes a synthetic broadsheet page (dense columns of small print on
+    slightly noisy paper) as a high-quality JPEG of roughly target_mb megabytes.
+    """
+    import random
+    from PIL import Image, ImageDraw
+
+    random.seed(0)
+    words = ["İFLAS", "İLANI", "İcra", "Dairesi", "Müdürlüğü", "dosya", "2024/123", "Esas",
+             "alacaklı", "borçlu", "ilan", "olunur", "Ankara", "İstanbul", "TCKN", "adres"]
+    width = 4000
+    while True:
+        height = int(width * 1.4)
+        img = Image.effect_noise((width, height), 12).point(lambda v: 215 + v // 8).convert("RGB")
+        draw = ImageDraw.Draw(img)
+        column_width = width // 6
+        for column in range(6):
+            for y in range(40, height - 40, 14):
+                line = " ".join(random.choice(words) for _ in range(8))
+                draw.text((column * column_width + 20, y), line, fill=(20, 20, 20))
+        img.save(path, format="JPEG", quality=95)
+        if os.path.getsize(path) >= target_mb * 1024 * 1024 or width > 12000:
+            return
+        width += 500
+
+
+def run_before(image_data: bytes) -> int:
+    from client import build_messages, build_request_kwargs
+
+    base64_image = base64.b64encode(image_data).decode("utf-8")
+    data_url = f"data:image/jpeg;base64,{base64_image}"
+    request_body = build_request_kwargs(build_messages(data_url))
+    request_body.update(request_body.pop("extra_body"))
+    body = json.dumps(request_body).encode("utf-8")
+    return len(body)
+
+
+def run_after(image_data: bytes) -> int:
+    from client import IMAGE_URL_PLACEHOLDER, build_messages, build_request_kwargs
+    from imageprep import build_body_parts, prepare_image
+
+    prepared_data, prepared_mime = prepare_image(image_data, "image/jpeg")
+    request_body = build_request_kwargs(build_messages(IMAGE_URL_PLACEHOLDER))
+    request_body.update(request_body.pop("extra_body"))
+    parts = build_body_parts(request_body, prepared_data, prepared_mime)
+    return sum(len(part) for part in parts)
+
+
+def child(mode: str, path: str):
+    # Import everything up front so the baseline includes module overhead
+    import client  # noqa: F401
+    import imageprep  # noqa: F401
+    from PIL import Image  # noqa: F401
+
+    with open(path, "rb") as f:
+        image_data = f.read()
+    reset_peak_rss()
+    baseline = current_rss_mb()
+
+    body_bytes = run_before(image_data) if mode == "before" else run_after(image_data)
+
+    print(json.dumps({
+        "mode": mode,
+        "input_mb": round(len(image_data) / 1024 / 1024, 2),
+        "body_mb": round(body_bytes / 1024 / 1024, 2),
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "delta_mb": round(peak_rss_mb() - baseline, 1),
+    }))
+
+
+def main():
+    if len(sys.argv) >= 3 and sys.argv[1] == "--child":
+        child(sys.argv[2], sys.argv[3])
+        return
+
+    if len(sys.argv) >= 2:
+        scan_path = sys.argv[1]
+    else:
+        scan_path = os.path.join(tempfile.gettempdir(), "mtm_benchmark_scan.jpg")
+        if not os.path.exists(scan_path):
+            print("Generating ~10 MB sample scan...")
+            make_sample_scan(scan_path)
+
+    print("=" * 60)
+    print("OCR REQUEST MEMORY BENCHMARK")
+    print(f"Scan: {scan_path} ({os.path.getsize(scan_path) / 1024 / 1024:.1f} MB)")
+    print("=" * 60)
+
+    for mode in ("before", "after"):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", mode, scan_path],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip().splitlines()[-1]
+        result = json.loads(output)
+        print(
+            f"{result['mode']:>6}: input {result['input_mb']} MB, request body {result['body_mb']} MB, "
+            f"peak RSS {result['peak_rss_mb']} MB (+{result['delta_mb']} MB over baseline)"
+        )
+
+
+if __name__ == "__main__":
+    main()
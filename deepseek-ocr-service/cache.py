@@ -0,0 +1,145 @@
+"""
+Persistent, content-addressed cache for OCR results.
+
+Entries are keyed by a SHA-256 of the image bytes plus every request setting
+that influences the output (model, prompt, max_tokens, sampling arguments), so
+re-uploading the same clip returns the stored text without touching the GPU.
+The cache lives in a SQLite file and is trimmed least-recently-used first once
+its total text size exceeds the configured cap.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import asyncio
+import threading
+from typing import Optional
+
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "1") == "1"
+OCR_CACHE_PATH = os.getenv("OCR_CACHE_PATH", "/data/ocr-cache/ocr_cache.sqlite3")
+OCR_CACHE_MAX_MB = int(os.getenv("OCR_CACHE_MAX_MB", "1024"))
+
+# After an eviction pass the cache is trimmed down to this fraction of the cap,
+# so a full cache does not evict on every single insert
+EVICTION_TARGET_RATIO = 0.9
+
+
+def make_cache_key(image_data: bytes, settings: dict) -> str:
+    """
+    Builds the cache key from the image bytes and the request settings.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(image_data)
+    return digest.hexdigest()
+
+
+class OCRCache:
+    def __init__(self, path: str = OCR_CACHE_PATH, max_bytes: int = OCR_CACHE_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ocr_cache (
+                key TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_access ON ocr_cache(last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE ocr_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, text: str):
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_cache (key, text, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, text, size, now, now),
+            )
+            self._total_bytes += size - (previous[0] if previous else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """
+        Drops least-recently-used entries until the cache is under the target size.
+        Caller must hold the lock.
+        """
+        target = int(self.max_bytes * EVICTION_TARGET_RATIO)
+        cursor = self._conn.execute("SELECT key, size FROM ocr_cache ORDER BY last_access ASC")
+        doomed = []
+        for key, size in cursor:
+            if self._total_bytes <= target:
+                break
+            doomed.append((key,))
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM ocr_cache WHERE key = ?", doomed)
+        self.evictions += len(doomed)
+        print(f"DEBUG: OCR cache evicted {len(doomed)} entries")
+
+    async def aget(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, text: str):
+        await asyncio.to_thread(self.put, key, text)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM ocr_cache").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "enabled": True,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "size_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+def create_cache() -> Optional[OCRCache]:
+    """
+    Returns the configured cache, or None when caching is disabled or the
+    cache file cannot be opened (the service then runs uncached).
+    """
+    if not OCR_CACHE_ENABLED:
+        return None
+    try:
+        return OCRCache()
+    except Exception as e:
+        print(f"Error opening OCR cache at {OCR_CACHE_PATH}: {e}")
+        return None
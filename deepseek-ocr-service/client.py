@@ -1,59 +1,150 @@
 import os
-from openai import OpenAI
-import base64
-from typing import Optional
-
-class OCRClient:
-    def __init__(self, base_url: str = "http://vllm:8000/v1", api_key: str = "EMPTY"):
-        self.client = OpenAI(
-            api_key=api_key,
+import asyncio
+import httpx
+from typing import AsyncIterator, List, Optional
+from cache import OCRCache, make_cache_key
+from imageprep import IMAGE_URL_PLACEHOLDER, build_body_parts, prep_settings, prepare_image
+
+MODEL_NAME = "deepseek-ai/DeepSeek-OCR"
+OCR_PROMPT = "Free OCR." # Standard prompt for DeepSeek-OCR
+
+# Number of OCR requests one AsyncOCRClient keeps in flight against vLLM at once
+OCR_MAX_CONCURRENCY = int(os.getenv("OCR_MAX_CONCURRENCY", "8"))
+# Seconds to wait for a single vLLM completion
+OCR_REQUEST_TIMEOUT = float(os.getenv("OCR_REQUEST_TIMEOUT", "600"))
+
+
+def build_messages(image_url: str) -> list:
+    """
+    Builds the chat messages payload for a single image URL (usually a data URL).
+    """
+    return [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image_url
+                    }
+                },
+                {
+                    "type": "text",
+                    "text": OCR_PROMPT
+                }
+            ]
+        }
+    ]
+
+
+def build_request_kwargs(messages: list) -> dict:
+    """
+    Builds the chat.completions.create arguments of an OCR request.
+    """
+    return dict(
+        model=MODEL_NAME,
+        messages=messages,
+        max_tokens=int(os.getenv("MAX_TOKENS", "4096")),
+        temperature=0.0,
+        extra_body={
+            "skip_special_tokens": False,
+            "vllm_xargs": {
+                "ngram_size": 30,
+                "window_size": 90,
+                "whitelist_token_ids": [128821, 128822], # <td>, </td>
+            },
+        },
+    )
+
+
+def cache_settings(request_kwargs: dict) -> dict:
+    """
+    Request settings that affect the OCR output, used alongside the image bytes as cache key.
+    """
+    settings = {key: value for key, value in request_kwargs.items() if key != "messages"}
+    settings["prompt"] = OCR_PROMPT
+    settings["prep"] = prep_settings()
+    return settings
+
+
+async def _iter_parts(parts: List[bytes]) -> AsyncIterator[bytes]:
+    for part in parts:
+        yield part
+
+
+class AsyncOCRClient:
+    """
+    Non-blocking OCR client. Callers may fire many process_image calls at once;
+    the semaphore caps how many are in flight so vLLM can batch them without
+    being flooded.
+
+    Requests are posted straight to vLLM's OpenAI-compatible endpoint with a
+    body streamed from pre-rendered chunks (see imageprep.build_body_parts)
+    instead of going through the openai SDK, which would need the image as a
+    base64 str and serialise the whole body again.
+    """
+
+    def __init__(
+        self,
+        base_url: str = "http://vllm:8000/v1",
+        api_key: str = "EMPTY",
+        max_concurrency: Optional[int] = None,
+        cache: Optional[OCRCache] = None,
+    ):
+        self.model = MODEL_NAME
+        self.max_concurrency = max_concurrency or OCR_MAX_CONCURRENCY
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.cache = cache
+        self.http = httpx.AsyncClient(
             base_url=base_url,
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=httpx.Timeout(OCR_REQUEST_TIMEOUT, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+            ),
         )
-        self.model = "deepseek-ai/DeepSeek-OCR"
 
-    def process_image(self, image_data: bytes, mime_type: str = "image/jpeg") -> str:
+    async def process_image(self, image_data: bytes, mime_type: str = "image/jpeg") -> str:
         """
         Process an image (bytes) and return the OCR text.
         """
-        base64_image = base64.b64encode(image_data).decode('utf-8')
-        data_url = f"data:{mime_type};base64,{base64_image}"
-
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": data_url
-                        }
-                    },
-                    {
-                        "type": "text",
-                        "text": "Free OCR." # Standard prompt for DeepSeek-OCR
-                    }
-                ]
-            }
-        ]
-
-        try:
-            max_tokens = int(os.getenv("MAX_TOKENS", "4096"))
-            print(f"DEBUG: Sending request to vLLM with max_tokens={max_tokens}")
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=int(os.getenv("MAX_TOKENS", "4096")),
-                temperature=0.0,
-                extra_body={
-                    "skip_special_tokens": False,
-                    "vllm_xargs": {
-                        "ngram_size": 30,
-                        "window_size": 90,
-                        "whitelist_token_ids": [128821, 128822], # <td>, </td>
+        request_kwargs = build_request_kwargs(build_messages(IMAGE_URL_PLACEHOLDER))
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = make_cache_key(image_data, cache_settings(request_kwargs))
+            cached_text = await self.cache.aget(cache_key)
+            if cached_text is not None:
+                print(f"DEBUG: OCR cache hit {cache_key[:12]}")
+                return cached_text
+
+        # The OpenAI SDK sends extra_body fields at the top level of the JSON body
+        request_body = dict(request_kwargs)
+        request_body.update(request_body.pop("extra_body"))
+
+        async with self.semaphore:
+            try:
+                # Decode/resize inside the semaphore so at most max_concurrency scans are in memory at once
+                prepared_data, prepared_mime = await asyncio.to_thread(prepare_image, image_data, mime_type)
+                body_parts = build_body_parts(request_body, prepared_data, prepared_mime)
+                del prepared_data
+
+                print(f"DEBUG: Sending async request to vLLM with max_tokens={request_kwargs['max_tokens']}")
+                response = await self.http.post(
+                    "chat/completions",
+                    content=_iter_parts(body_parts),
+                    headers={
+                        "Content-Type": "application/json",
+                        "Content-Length": str(sum(len(part) for part in body_parts)),
                     },
-                },
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            print(f"Error calling vLLM: {e}")
-            raise e
+                )
+                response.raise_for_status()
+                result_text = response.json()["choices"][0]["message"]["content"]
+            except Exception as e:
+                print(f"Error calling vLLM: {e}")
+                raise e
+
+        if cache_key is not None and result_text:
+            await self.cache.aput(cache_key, result_text)
+        return result_text
@@ -0,0 +1,81 @@
+"""
+Image preparation for the OCR request path.
+
+Oversized scans are downscaled and re-encoded exactly once before they are sent
+to vLLM, and the request body is assembled from pre-rendered JSON pieces around
+the base64 bytes so the image never exists as a Python str or inside a second,
+fully serialised JSON copy.
+"""
+import os
+import json
+import base64
+from io import BytesIO
+from typing import List, Tuple
+
+from PIL import Image
+
+# Longest allowed image edge in pixels; larger scans are downscaled. 0 disables resizing.
+OCR_MAX_LONG_EDGE = int(os.getenv("OCR_MAX_LONG_EDGE", "2048"))
+# JPEG quality used when a scan has to be re-encoded
+OCR_JPEG_QUALITY = int(os.getenv("OCR_JPEG_QUALITY", "90"))
+
+IMAGE_URL_PLACEHOLDER = "__MTM_IMAGE_DATA_URL__"
+
+
+def prep_settings() -> dict:
+    """
+    Preparation settings that change the bytes sent to vLLM (part of the cache key).
+    """
+    return {"max_long_edge": OCR_MAX_LONG_EDGE, "jpeg_quality": OCR_JPEG_QUALITY}
+
+
+def prepare_image(image_data: bytes, mime_type: str) -> Tuple[bytes, str]:
+    """
+    Downscales an oversized scan once and re-encodes it as JPEG.
+
+    Images already within OCR_MAX_LONG_EDGE are returned untouched without
+    being decoded.
+
+    Returns:
+        (image bytes, mime type) to send to vLLM
+    """
+    if OCR_MAX_LONG_EDGE <= 0:
+        return image_data, mime_type
+
+    with Image.open(BytesIO(image_data)) as img:
+        width, height = img.size
+        long_edge = max(width, height)
+        if long_edge <= OCR_MAX_LONG_EDGE:
+            return image_data, mime_type
+
+        # For JPEG input, let the decoder skip straight to the smallest DCT scale
+        # that is still at least the target size instead of materialising the
+        # full-resolution bitmap; thumbnail() then finishes the resize in place
+        scale = OCR_MAX_LONG_EDGE / long_edge
+        img.draft(img.mode, (int(width * scale), int(height * scale)))
+        img.thumbnail((OCR_MAX_LONG_EDGE, OCR_MAX_LONG_EDGE), Image.LANCZOS)
+        resized = img if img.mode in ("RGB", "L") else img.convert("RGB")
+
+        output = BytesIO()
+        resized.save(output, format="JPEG", quality=OCR_JPEG_QUALITY)
+
+    print(f"DEBUG: Downscaled {width}x{height} ({len(image_data)} bytes) to {resized.size[0]}x{resized.size[1]} ({output.tell()} bytes)")
+    return output.getvalue(), "image/jpeg"
+
+
+def build_body_parts(request_body: dict, image_data: bytes, mime_type: str) -> List[bytes]:
+    """
+    Renders a JSON request body containing IMAGE_URL_PLACEHOLDER and splices the
+    image in as base64 bytes.
+
+    The returned chunks are sent as-is, so the body is never joined into one buffer.
+    The base64 alphabet needs no JSON escaping.
+    """
+    envelope = json.dumps(request_body).encode("utf-8")
+    prefix, suffix = envelope.split(IMAGE_URL_PLACEHOLDER.encode("utf-8"), 1)
+    return [
+        prefix,
+        f"data:{mime_type};base64,".encode("utf-8"),
+        base64.b64encode(image_data),
+        suffix,
+    ]
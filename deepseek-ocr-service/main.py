@@ -1,10 +1,14 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import uvicorn
-from client import OCRClient
+from client import AsyncOCRClient
+from cache import create_cache
+from tiling import TILING_MODES, process_image_tiled
 import io
+import json
 import asyncio
 
 app = FastAPI(title="MTM OCR Service", version="1.0.0")
@@ -22,8 +26,11 @@ import os
 
 # Initialize OCR Client
 # Note: Ensure vLLM is running on port 8000
+# Concurrency is capped by OCR_MAX_CONCURRENCY (see client.py)
+# Results are cached on disk by image hash (see cache.py)
 vllm_url = os.getenv("VLLM_URL", "http://localhost:8000/v1")
-ocr_client = OCRClient(base_url=vllm_url)
+ocr_cache = create_cache()
+ocr_client = AsyncOCRClient(base_url=vllm_url, cache=ocr_cache)
 
 class OCRResponse(BaseModel):
     text: str
@@ -32,45 +39,120 @@ class OCRResponse(BaseModel):
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "cache": ocr_cache.stats() if ocr_cache else {"enabled": False},
+    }
+
+def validate_tiling(tiling: str) -> str:
+    tiling = tiling.lower()
+    if tiling not in TILING_MODES:
+        raise HTTPException(status_code=400, detail=f"tiling must be one of: {', '.join(TILING_MODES)}")
+    return tiling
+
+async def ocr_contents(contents: bytes, filename: str, content_type: str, response_format: str, tiling: str = "off") -> OCRResponse:
+    """
+    Runs OCR on one uploaded image. Errors are returned as a result with format "error".
+    """
+    try:
+        # Process image using the async OCR client (bounded by its semaphore),
+        # splitting large pages into tiles when tiling allows it (see tiling.py)
+        result_text = await process_image_tiled(ocr_client, contents, content_type, tiling)
+        
+        return OCRResponse(
+            text=result_text, 
+            filename=filename,
+            format=response_format
+        )
+    except Exception as e:
+        print(f"Error processing {filename}: {e}")
+        return OCRResponse(
+            text=f"Error: {str(e)}", 
+            filename=filename,
+            format="error"
+        )
 
 @app.post("/api/v1/ocr", response_model=List[OCRResponse])
 async def perform_ocr(
     files: List[UploadFile] = File(...),
-    response_format: str = Form("json")  # "json" or "text"
+    response_format: str = Form("json"),  # "json" or "text"
+    tiling: str = Form("off")  # "auto", "on" or "off"
 ):
     """
     Upload multiple image files to perform OCR.
+    All images are sent to vLLM concurrently; results keep the upload order.
+    """
+    tiling = validate_tiling(tiling)
+
+    async def process_file(file: UploadFile) -> OCRResponse:
+        contents = await file.read()
+        return await ocr_contents(contents, file.filename, file.content_type, response_format, tiling)
+
+    # Skip non-image files
+    image_files = [file for file in files if file.content_type.startswith("image/")]
+
+    # gather() preserves input order
+    results = await asyncio.gather(*(process_file(file) for file in image_files))
+    return list(results)
+
+@app.post("/api/v1/ocr/stream")
+async def perform_ocr_stream(
+    files: List[UploadFile] = File(...),
+    response_format: str = Form("json"),  # "json" or "text"
+    tiling: str = Form("off")  # "auto", "on" or "off"
+):
+    """
+    Streaming variant of /api/v1/ocr using Server-Sent Events.
+    Each OCRResponse is emitted as soon as its image finishes, tagged with the
+    index of the file in the upload, so callers can start downstream work early.
     """
-    results = []
-    
-    for file in files:
-        if not file.content_type.startswith("image/"):
-            # Skip non-image files or handle error
-            continue
+    tiling = validate_tiling(tiling)
+
+    # Read uploads before streaming; the request body is not available once the response has started
+    uploads = []
+    for index, file in enumerate(files):
+        contents = await file.read() if file.content_type.startswith("image/") else None
+        uploads.append((index, file.filename, file.content_type, contents))
+
+    async def indexed_ocr(index: int, filename: str, content_type: str, contents: bytes):
+        result = await ocr_contents(contents, filename, content_type, response_format, tiling)
+        return index, result
 
+    async def event_generator():
+        yield f"data: {json.dumps({'type': 'init', 'total': len(uploads)})}\n\n"
+
+        tasks = []
+        for index, filename, content_type, contents in uploads:
+            if contents is None:
+                # Non-image files are skipped, as in /api/v1/ocr
+                yield f"data: {json.dumps({'type': 'skipped', 'index': index, 'filename': filename})}\n\n"
+                continue
+            tasks.append(asyncio.create_task(indexed_ocr(index, filename, content_type, contents)))
+
+        completed = 0
+        failed = 0
         try:
-            contents = await file.read()
-            
-            # Process image using the OCR client
-            # Note: For true parallelism with vLLM, we might need async client or thread pool
-            # But for now, sequential processing is safer to avoid OOM
-            result_text = ocr_client.process_image(contents, mime_type=file.content_type)
-            
-            results.append(OCRResponse(
-                text=result_text, 
-                filename=file.filename,
-                format=response_format
-            ))
-        except Exception as e:
-            print(f"Error processing {file.filename}: {e}")
-            results.append(OCRResponse(
-                text=f"Error: {str(e)}", 
-                filename=file.filename,
-                format="error"
-            ))
-            
-    return results
+            for next_done in asyncio.as_completed(tasks):
+                index, result = await next_done
+                completed += 1
+                if result.format == "error":
+                    failed += 1
+                yield f"data: {json.dumps({'type': 'result', 'index': index, **result.dict()})}\n\n"
+
+            yield f"data: {json.dumps({'type': 'complete', 'total': len(uploads), 'processed': completed, 'failed': failed})}\n\n"
+        finally:
+            # Client went away: do not keep the GPU busy for nobody
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8001, reload=True)
@@ -0,0 +1,167 @@
+"""
+Page tiling for full broadsheet scans.
+
+Large pages are cut into vertical strips and each strip into overlapping
+tiles; every tile is OCR'd concurrently, and the tile texts are stitched back
+in newspaper reading order (down each strip, strips left to right).
+
+Strips do not overlap: each vertical cut is placed on the column with the
+least ink inside the overlap band (a column gutter when there is one), so no
+text is read twice side by side. Vertically adjacent tiles do overlap; lines
+they both read are dropped while stitching, but only when a run of at least
+OCR_TILE_MIN_OVERLAP_LINES lines matches exactly (apart from whitespace), so
+similar but different lines such as "Madde 2" / "Madde 3" are never merged.
+
+Tiling is opt-in: callers ask for it with tiling="on" or "auto".
+"""
+import os
+import re
+import math
+import asyncio
+from io import BytesIO
+from typing import List, Tuple
+
+from PIL import Image
+
+# Tile edge in pixels; DeepSeek-OCR's "Large" mode works natively at 1280x1280
+OCR_TILE_SIZE = int(os.getenv("OCR_TILE_SIZE", "1280"))
+# Minimum overlap between neighbouring tiles in pixels, so no line is lost at a cut
+OCR_TILE_OVERLAP = int(os.getenv("OCR_TILE_OVERLAP", "160"))
+# In "auto" mode, tile only pages whose long edge is at least this many pixels
+OCR_TILING_AUTO_MIN_EDGE = int(os.getenv("OCR_TILING_AUTO_MIN_EDGE", "3000"))
+# How many trailing/leading lines are compared when removing overlap duplicates
+OCR_TILE_MAX_OVERLAP_LINES = int(os.getenv("OCR_TILE_MAX_OVERLAP_LINES", "15"))
+# Shortest run of identical lines treated as overlap; a single repeated line may be genuine text
+OCR_TILE_MIN_OVERLAP_LINES = int(os.getenv("OCR_TILE_MIN_OVERLAP_LINES", "2"))
+
+TILING_MODES = ("auto", "on", "off")
+
+
+def tile_starts(length: int, tile: int, overlap: int) -> List[int]:
+    """
+    Evenly spaced tile offsets covering [0, length) with at least `overlap` pixels shared.
+    """
+    if length <= tile:
+        return [0]
+    count = math.ceil((length - overlap) / (tile - overlap))
+    step = (length - tile) / (count - 1)
+    return [round(i * step) for i in range(count)]
+
+
+def should_tile(width: int, height: int, mode: str) -> bool:
+    if mode == "off":
+        return False
+    if max(width, height) <= OCR_TILE_SIZE:
+        return False
+    if mode == "on":
+        return True
+    return max(width, height) >= OCR_TILING_AUTO_MIN_EDGE
+
+
+def find_cut(gray: Image.Image, lo: int, hi: int) -> int:
+    """x in [lo, hi) where the page has the least ink, so a vertical cut runs through a gutter if there is one."""
+    if hi - lo <= 1:
+        return lo
+    profile = list(gray.crop((lo, 0, hi, gray.height)).resize((hi - lo, 1), Image.BOX).getdata())
+    return lo + max(range(len(profile)), key=profile.__getitem__)
+
+
+def strip_bounds(gray: Image.Image) -> List[Tuple[int, int]]:
+    """Non-overlapping (left, right) bounds of the vertical strips, each at most OCR_TILE_SIZE wide."""
+    starts = tile_starts(gray.width, OCR_TILE_SIZE, OCR_TILE_OVERLAP)
+    cuts = [0]
+    for start, next_start in zip(starts, starts[1:]):
+        # Cut inside the band both neighbouring tiles would have covered
+        cuts.append(find_cut(gray, next_start, start + OCR_TILE_SIZE))
+    cuts.append(gray.width)
+    return list(zip(cuts, cuts[1:]))
+
+
+def split_tiles(image_data: bytes, mode: str) -> List[List[bytes]]:
+    """
+    Cuts an image into JPEG tiles: non-overlapping vertical strips, each cut
+    into vertically overlapping tiles.
+
+    Returns:
+        Tiles grouped per vertical strip (left to right), each strip ordered
+        top to bottom; a single [[image_data]] when the image is not tiled.
+    """
+    with Image.open(BytesIO(image_data)) as img:
+        width, height = img.size
+        if not should_tile(width, height, mode):
+            return [[image_data]]
+
+        page = img if img.mode in ("RGB", "L") else img.convert("RGB")
+        strips = []
+        for left, right in strip_bounds(page.convert("L")):
+            strip = []
+            for top in tile_starts(height, OCR_TILE_SIZE, OCR_TILE_OVERLAP):
+                box = (left, top, right, min(top + OCR_TILE_SIZE, height))
+                output = BytesIO()
+                page.crop(box).save(output, format="JPEG", quality=95)
+                strip.append(output.getvalue())
+            strips.append(strip)
+
+    print(f"DEBUG: Split {width}x{height} page into {len(strips)}x{len(strips[0])} tiles")
+    return strips
+
+
+def _normalize_line(line: str) -> str:
+    return re.sub(r"\s+", " ", line).strip()
+
+
+def merge_overlap(upper: str, lower: str) -> str:
+    """
+    Joins the texts of two vertically adjacent tiles, dropping the leading
+    lines of `lower` that repeat the trailing lines of `upper`. Only a run of
+    at least OCR_TILE_MIN_OVERLAP_LINES lines that are identical apart from
+    whitespace counts as repeated; blank lines are kept but not compared.
+    """
+    upper_lines = upper.rstrip().splitlines()
+    lower_lines = lower.strip("\n").splitlines()
+    upper_text = [_normalize_line(line) for line in upper_lines if line.strip()]
+    # Positions of the non-blank lines of `lower`
+    lower_content = [i for i, line in enumerate(lower_lines) if line.strip()]
+    lower_text = [_normalize_line(lower_lines[i]) for i in lower_content]
+    max_overlap = min(len(upper_text), len(lower_text), OCR_TILE_MAX_OVERLAP_LINES)
+
+    # Prefer the longest run of repeated lines
+    for size in range(max_overlap, max(OCR_TILE_MIN_OVERLAP_LINES, 1) - 1, -1):
+        if upper_text[-size:] == lower_text[:size]:
+            lower_lines = lower_lines[lower_content[size - 1] + 1:]
+            break
+
+    return "\n".join(upper_lines + lower_lines).strip("\n")
+
+
+def stitch_tiles(strip_texts: List[List[str]]) -> str:
+    """
+    Stitches OCR texts of tiles (grouped per strip, top to bottom) in reading order.
+    """
+    stitched_strips = []
+    for texts in strip_texts:
+        merged = ""
+        for text in texts:
+            merged = merge_overlap(merged, text) if merged else text.strip("\n")
+        stitched_strips.append(merged)
+    return "\n\n".join(strip for strip in stitched_strips if strip.strip())
+
+
+async def process_image_tiled(ocr_client, image_data: bytes, mime_type: str, mode: str = "off") -> str:
+    """
+    OCRs an image, tiling it first when `mode` asks for it. All tiles are sent
+    concurrently; the client's semaphore bounds the load on vLLM.
+    """
+    if mode == "off":
+        return await ocr_client.process_image(image_data, mime_type=mime_type)
+
+    strips = await asyncio.to_thread(split_tiles, image_data, mode)
+    if len(strips) == 1 and len(strips[0]) == 1:
+        return await ocr_client.process_image(image_data, mime_type=mime_type)
+
+    tile_tasks = [
+        [ocr_client.process_image(tile, mime_type="image/jpeg") for tile in strip]
+        for strip in strips
+    ]
+    strip_texts = await asyncio.gather(*(asyncio.gather(*tasks) for tasks in tile_tasks))
+    return stitch_tiles(strip_texts)
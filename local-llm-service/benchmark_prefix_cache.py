@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Prefill latency benchmark for the prompt-prefix KV cache.
+
+Loads the model in-process (like main.py) and times single-token generations
+of short chat prompts with and without the cached MTM system message, so the
+difference is the prefill work the cache saves.
+
+Usage: python benchmark_prefix_cache.py [--runs 10] [--batch-size 1]
+"""
+import sys
+import time
+import argparse
+import statistics
+
+PROMPTS = [
+    "Merhaba!",
+    "Bugünün gündem başlıklarını özetler misin?",
+    "Bu haberin duygu tonunu tek kelimeyle söyle: Belediye yeni parkı hizmete açtı.",
+    "Yerel basında en çok hangi konular işleniyor?",
+]
+
+
+def time_generate(scheduler, prompts, runs: int) -> list:
+    from scheduler import SamplingParams
+
+    greedy = SamplingParams(do_sample=False)
+    # Warm-up so CUDA kernel selection does not skew the first timing
+    scheduler._generate(prompts, [1] * len(prompts), greedy)
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        scheduler._generate(prompts, [1] * len(prompts), greedy)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=1)
+    args = parser.parse_args()
+
+    # Loads the model and registers the MTM system prefix, as the service does on startup
+    import main as app
+
+    scheduler = app.load_model()
+    prefix_cache = scheduler.prefix_cache
+    if prefix_cache is None:
+        print("Prefix cache is disabled (LLM_PREFIX_CACHE=0), nothing to compare")
+        return 1
+
+    prompts = [
+        app.build_prompt([{"role": "user", "content": PROMPTS[i % len(PROMPTS)]}])
+        for i in range(args.batch_size)
+    ]
+
+    print("=" * 60)
+    print("PREFIX CACHE PREFILL BENCHMARK")
+    print(f"Batch size {args.batch_size}, {args.runs} runs each, prefix stats: {prefix_cache.stats()}")
+    print("=" * 60)
+
+    scheduler.prefix_cache = None
+    without_cache = time_generate(scheduler, prompts, args.runs)
+    scheduler.prefix_cache = prefix_cache
+    with_cache = time_generate(scheduler, prompts, args.runs)
+
+    before = statistics.median(without_cache) * 1000
+    after = statistics.median(with_cache) * 1000
+    print(f"Without prefix cache: median {before:.1f} ms")
+    print(f"With prefix cache:    median {after:.1f} ms")
+    print(f"Speed-up: {before / after:.2f}x")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for the local LLM chat endpoint.
+
+Fires the same short chat request from 1, 4 and 16 concurrent clients and
+reports requests/sec, latency percentiles and output characters/sec. Run it
+against a service started with LLM_MAX_BATCH_SIZE=1 (no batching) and again
+with the default to compare.
+
+Usage: python benchmark_throughput.py [--url http://localhost:8004] [--requests 32] [--max-tokens 128]
+"""
+import sys
+import json
+import time
+import argparse
+import statistics
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+PROMPT = "Türkiye'de yerel gazetelerin dijital dönüşümünü üç maddede özetle."
+
+
+def send_chat(url: str, max_tokens: int) -> tuple:
+    body = json.dumps({
+        "messages": [{"role": "user", "content": PROMPT}],
+        "max_tokens": max_tokens,
+    }).encode("utf-8")
+    request = urllib.request.Request(
+        f"{url}/api/v1/chat",
+        data=body,
+        headers={"Content-Type": "application/json"},
+    )
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=600) as response:
+        text = json.loads(response.read())["response"]
+    return time.perf_counter() - start, len(text)
+
+
+def run_level(url: str, concurrency: int, total_requests: int, max_tokens: int) -> dict:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: send_chat(url, max_tokens), range(total_requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "elapsed_s": round(elapsed, 2),
+        "req_per_s": round(total_requests / elapsed, 3),
+        "chars_per_s": round(sum(chars for _, chars in results) / elapsed, 1),
+        "p50_s": round(statistics.median(latencies), 2),
+        "p95_s": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8004")
+    parser.add_argument("--requests", type=int, default=32, help="requests per concurrency level")
+    parser.add_argument("--max-tokens", type=int, default=128)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("LOCAL LLM THROUGHPUT BENCHMARK")
+    print(f"Target: {args.url}, {args.requests} requests per level, max_tokens={args.max_tokens}")
+    print("=" * 60)
+
+    # One warm request so CUDA kernel compilation does not skew the first level
+    send_chat(args.url, 8)
+
+    for concurrency in (1, 4, 16):
+        result = run_level(args.url, concurrency, args.requests, args.max_tokens)
+        print(
+            f"clients={result['concurrency']:>2}: {result['req_per_s']} req/s, "
+            f"{result['chars_per_s']} chars/s, p50 {result['p50_s']}s, p95 {result['p95_s']}s "
+            f"({result['elapsed_s']}s total)"
+        )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
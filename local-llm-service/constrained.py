@@ -0,0 +1,98 @@
+"""
+Constrained JSON decoding for the local LLM.
+
+Backs OpenAI's response_format (json_object / json_schema): at every step only
+tokens that keep the output a valid prefix of a JSON document matching the
+schema are allowed, so the pipelines can json.loads() the answer just like with
+gpt-4o-mini. The character-level parsing is done by lm-format-enforcer; the
+vocabulary index it needs is built once, on the first constrained request.
+"""
+import threading
+from typing import Callable, List, Optional
+
+import torch
+from lmformatenforcer import JsonSchemaParser, TokenEnforcer, TokenEnforcerTokenizerData
+
+# Schema used for response_format={"type": "json_object"}: any JSON object
+JSON_OBJECT_SCHEMA = {"type": "object"}
+
+
+def schema_from_response_format(response_format: Optional[dict]) -> Optional[dict]:
+    """
+    Maps an OpenAI response_format to the JSON schema to enforce, or None for plain text.
+
+    Raises:
+        ValueError: for formats that cannot be enforced
+    """
+    if not response_format:
+        return None
+    format_type = response_format.get("type", "text")
+    if format_type == "text":
+        return None
+    if format_type == "json_object":
+        return JSON_OBJECT_SCHEMA
+    if format_type == "json_schema":
+        schema = (response_format.get("json_schema") or {}).get("schema")
+        if not isinstance(schema, dict):
+            raise ValueError("response_format.json_schema.schema is required")
+        return schema
+    raise ValueError(f"Unsupported response_format type: {format_type}")
+
+
+class JsonDecoding:
+    def __init__(self, tokenizer, eos_token_ids: List[int]):
+        self.tokenizer = tokenizer
+        self.eos_token_ids = eos_token_ids
+        self._tokenizer_data: Optional[TokenEnforcerTokenizerData] = None
+        self._lock = threading.Lock()
+
+    def tokenizer_data(self) -> TokenEnforcerTokenizerData:
+        """Index of every regular token's text; takes a while on a large vocabulary, so it is built once."""
+        with self._lock:
+            if self._tokenizer_data is None:
+                print("DEBUG: Building token index for constrained JSON decoding...")
+                self._tokenizer_data = self._build_tokenizer_data()
+                print("DEBUG: Token index ready")
+            return self._tokenizer_data
+
+    def _build_tokenizer_data(self) -> TokenEnforcerTokenizerData:
+        tokenizer = self.tokenizer
+        vocab_size = len(tokenizer)
+        special_ids = set(tokenizer.all_special_ids)
+        # Decoding after a "0" keeps the leading space of word-start tokens
+        token_0 = tokenizer.encode("0", add_special_tokens=False)[-1]
+
+        regular_tokens = []
+        for token_id in range(vocab_size):
+            if token_id in special_ids:
+                continue
+            decoded_after_0 = tokenizer.decode([token_0, token_id])[1:]
+            decoded = tokenizer.decode([token_id])
+            regular_tokens.append((token_id, decoded_after_0, len(decoded_after_0) > len(decoded)))
+
+        def decode(token_ids: List[int]) -> str:
+            return tokenizer.decode(token_ids).rstrip("�")
+
+        return TokenEnforcerTokenizerData(
+            regular_tokens, decode, self.eos_token_ids, use_bitmask=False, vocab_size=vocab_size
+        )
+
+    def prefix_allowed_tokens_fn(self, schemas: List[Optional[dict]]) -> Callable[[int, torch.Tensor], List[int]]:
+        """
+        Builds generate()'s prefix_allowed_tokens_fn for a batch; row i follows
+        schemas[i] and rows with no schema are left unconstrained.
+        """
+        tokenizer_data = self.tokenizer_data()
+        enforcers = [
+            TokenEnforcer(tokenizer_data, JsonSchemaParser(schema)) if schema is not None else None
+            for schema in schemas
+        ]
+        all_tokens = list(range(tokenizer_data.vocab_size))
+
+        def allowed_tokens(batch_id: int, sent: torch.Tensor) -> List[int]:
+            enforcer = enforcers[batch_id]
+            if enforcer is None:
+                return all_tokens
+            return enforcer.get_allowed_tokens(sent.tolist()).allowed_tokens
+
+        return allowed_tokens
@@ -0,0 +1,104 @@
+"""
+Model lifecycle for the local LLM service.
+
+Loading the 4-bit model takes minutes, so it runs in a background thread after
+the app has started: /health answers immediately while /ready (and the chat
+endpoints) wait until the model is loaded and warmed up. The warmup runs a few
+short generations at different prompt lengths (and one padded batch) so CUDA
+kernels are selected before the first real request. Load and warmup timings
+are kept for monitoring.
+"""
+import os
+import time
+import asyncio
+import traceback
+from typing import Callable, List, Optional
+
+from scheduler import BatchScheduler, SamplingParams
+
+LLM_WARMUP = os.getenv("LLM_WARMUP", "1") == "1"
+# Approximate user-turn lengths (tokens) of the warmup prompts
+LLM_WARMUP_LENGTHS = [int(n) for n in os.getenv("LLM_WARMUP_LENGTHS", "32,512,2048").split(",") if n.strip()]
+WARMUP_NEW_TOKENS = 8
+WARMUP_FILLER = "Medya Takip Merkezi yerel ve ulusal basındaki haberleri izler. "
+
+
+class ModelLifecycle:
+    def __init__(self):
+        self.status = "starting"  # starting -> loading -> warming_up -> ready | failed
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.warmup_runs: List[dict] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def start(self, load: Callable[[], BatchScheduler], build_prompt: Callable[[list], str]):
+        """Starts loading in the background; must be called from the running event loop."""
+        self._task = asyncio.create_task(self._run(load, build_prompt))
+
+    def snapshot(self) -> dict:
+        return {
+            "status": self.status,
+            "error": self.error,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "warmup_runs": self.warmup_runs,
+        }
+
+    async def _run(self, load: Callable[[], BatchScheduler], build_prompt: Callable[[list], str]):
+        try:
+            self.status = "loading"
+            start = time.perf_counter()
+            scheduler = await asyncio.to_thread(load)
+            self.load_seconds = round(time.perf_counter() - start, 2)
+            print(f"DEBUG: Model loaded in {self.load_seconds}s")
+
+            scheduler.start()
+
+            if LLM_WARMUP:
+                self.status = "warming_up"
+                start = time.perf_counter()
+                await asyncio.to_thread(self._warmup, scheduler, build_prompt)
+                self.warmup_seconds = round(time.perf_counter() - start, 2)
+                print(f"DEBUG: Warmup finished in {self.warmup_seconds}s")
+
+            self.status = "ready"
+        except Exception as e:
+            print(f"[ERROR] Model startup failed: {e}")
+            traceback.print_exc()
+            self.status = "failed"
+            self.error = str(e)
+
+    def _warmup(self, scheduler: BatchScheduler, build_prompt: Callable[[list], str]):
+        tokenizer = scheduler.tokenizer
+        filler_ids = tokenizer(WARMUP_FILLER, add_special_tokens=False).input_ids
+
+        def prompt_of(length: int) -> str:
+            repeats = length // max(len(filler_ids), 1) + 1
+            content = tokenizer.decode((filler_ids * repeats)[:length])
+            return build_prompt([{"role": "user", "content": content}])
+
+        lengths = sorted(LLM_WARMUP_LENGTHS)
+        runs = [[length] for length in lengths]
+        if scheduler.max_batch_size > 1 and len(lengths) > 1:
+            # A padded batch exercises the batched attention path too
+            runs.append(lengths[:2] * (min(scheduler.max_batch_size, 4) // 2))
+
+        for run in runs:
+            start = time.perf_counter()
+            results = scheduler._generate(
+                [prompt_of(length) for length in run],
+                [WARMUP_NEW_TOKENS] * len(run),
+                SamplingParams(),
+            )
+            self.warmup_runs.append({
+                "batch_size": len(run),
+                "prompt_tokens": max(result.prompt_tokens for result in results),
+                "seconds": round(time.perf_counter() - start, 3),
+            })
@@ -1,10 +1,19 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
 import torch
 import uvicorn
 from typing import List, Dict
+import json
+import time
+from scheduler import BatchScheduler, SamplingParams
+from streaming import stream_generate
+from prefix_cache import LLM_PREFIX_CACHE, LLM_PREFIX_FILE, PrefixCache
+from constrained import schema_from_response_format
+from lifecycle import ModelLifecycle
+import openai_compat
 
 app = FastAPI(title="MTM LLM Service", version="1.0.0")
 
@@ -17,28 +26,72 @@ app.add_middleware(
 )
 
 MODEL_ID = "ytu-ce-cosmos/Turkish-Gemma-9b-T1"
-print(f"Loading model: {MODEL_ID} with 4-bit quantization...")
-
-try:
-    # 4-bit quantization configuration
-    quantization_config = BitsAndBytesConfig(
-        load_in_4bit=True,
-        bnb_4bit_compute_dtype=torch.bfloat16,  # Use bfloat16 as recommended
-        bnb_4bit_use_double_quant=True,
-        bnb_4bit_quant_type="nf4"
-    )
-    
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_ID)
-    model = AutoModelForCausalLM.from_pretrained(
-        MODEL_ID,
-        quantization_config=quantization_config,
-        device_map="auto",
-        trust_remote_code=True
-    )
-    print("Model loaded successfully with 4-bit quantization.")
-except Exception as e:
-    print(f"Error loading model: {e}")
-    raise e
+
+SYSTEM_MESSAGE = "Sen MTM (Medya Takip Merkezi) yapay zeka asistanısın. Akıllı, yardımsever ve profesyonel bir şekilde cevap verirsin. Her zaman kullanıcının dilinde yanıt verirsin."
+
+# Set by load_model(); the model loads in the background after startup (see lifecycle.py)
+model = None
+tokenizer = None
+scheduler = None
+lifecycle = ModelLifecycle()
+
+def load_model() -> BatchScheduler:
+    """
+    Loads the model and tokenizer and builds the batch scheduler around them.
+    """
+    global model, tokenizer, scheduler
+    print(f"Loading model: {MODEL_ID} with 4-bit quantization...")
+
+    try:
+        # 4-bit quantization configuration
+        quantization_config = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_compute_dtype=torch.bfloat16,  # Use bfloat16 as recommended
+            bnb_4bit_use_double_quant=True,
+            bnb_4bit_quant_type="nf4"
+        )
+        
+        tokenizer = AutoTokenizer.from_pretrained(MODEL_ID)
+        model = AutoModelForCausalLM.from_pretrained(
+            MODEL_ID,
+            quantization_config=quantization_config,
+            device_map="auto",
+            trust_remote_code=True
+        )
+        print("Model loaded successfully with 4-bit quantization.")
+    except Exception as e:
+        print(f"Error loading model: {e}")
+        raise e
+
+    # Batches concurrent requests into shared generate calls (see scheduler.py)
+    new_scheduler = BatchScheduler(model, tokenizer)
+
+    # Keep the KV cache of the fixed system message so requests only prefill their own turns
+    if LLM_PREFIX_CACHE:
+        new_scheduler.prefix_cache = PrefixCache(model, tokenizer)
+        new_scheduler.prefix_cache.register_system_message("mtm-system", SYSTEM_MESSAGE)
+        if LLM_PREFIX_FILE:
+            new_scheduler.prefix_cache.load_prefix_file(LLM_PREFIX_FILE)
+
+    scheduler = new_scheduler
+    return scheduler
+
+@app.on_event("startup")
+async def start_model():
+    lifecycle.start(load_model, build_prompt)
+
+@app.on_event("shutdown")
+async def stop_scheduler():
+    if scheduler:
+        await scheduler.stop()
+
+def require_ready():
+    """Rejects requests until the model is loaded and warmed up."""
+    if not lifecycle.ready:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Model henüz hazır değil (durum: {lifecycle.status}), lütfen daha sonra tekrar deneyin"
+        )
 
 class ChatRequest(BaseModel):
     messages: List[Dict[str, str]]
@@ -50,56 +103,63 @@ class ChatResponse(BaseModel):
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "model": MODEL_ID}
+    """
+    Liveness: the process is up. Use /ready to know whether it can serve requests.
+    """
+    return {
+        "status": "healthy",
+        "model": MODEL_ID,
+        "lifecycle": lifecycle.snapshot(),
+        "scheduler": scheduler.stats() if scheduler else None,
+        "prefix_cache": scheduler.prefix_cache.stats() if scheduler and scheduler.prefix_cache else {"enabled": False},
+    }
+
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness: 200 once the model is loaded and warmed up, 503 before that (or if loading failed).
+    """
+    body = {"ready": lifecycle.ready, "model": MODEL_ID, **lifecycle.snapshot()}
+    return JSONResponse(status_code=200 if lifecycle.ready else 503, content=body)
+
+def build_prompt(messages: List[Dict[str, str]]) -> str:
+    """
+    Adds the MTM system message if missing and applies the chat template.
+    """
+    # Add system message if not present
+    if not messages or messages[0].get("role") != "system":
+        system_message = {
+            "role": "system",
+            "content": SYSTEM_MESSAGE
+        }
+        messages.insert(0, system_message)
+    
+    print(f"DEBUG: Processing {len(messages)} messages")
+    
+    # Apply chat template
+    return tokenizer.apply_chat_template(
+        messages,
+        tokenize=False,
+        add_generation_prompt=True
+    )
 
 @app.post("/api/v1/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """
     Chat with Turkish-Gemma-9b-T1 LLM.
     """
+    require_ready()
     try:
-        # Add system message if not present
-        if not request.messages or request.messages[0].get("role") != "system":
-            system_message = {
-                "role": "system",
-                "content": "Sen MTM (Medya Takip Merkezi) yapay zeka asistanısın. Akıllı, yardımsever ve profesyonel bir şekilde cevap verirsin. Her zaman kullanıcının dilinde yanıt verirsin."
-            }
-            request.messages.insert(0, system_message)
-        
-        print(f"DEBUG: Processing {len(request.messages)} messages")
+        text = build_prompt(request.messages)
         
-        # Apply chat template
-        text = tokenizer.apply_chat_template(
-            request.messages,
-            tokenize=False,
-            add_generation_prompt=True
-        )
-        
-        inputs = tokenizer([text], return_tensors="pt").to(model.device)
-        
-        # Get terminators
-        terminators = [
-            tokenizer.eos_token_id,
-            tokenizer.convert_tokens_to_ids("<end_of_turn>")
-        ]
-        
-        # Generate response with recommended parameters for Turkish-Gemma
-        outputs = model.generate(
-            **inputs,
+        # Generate response with recommended parameters for Turkish-Gemma;
+        # the scheduler merges this request with concurrent ones into one batch
+        result = await scheduler.submit(
+            text,
             max_new_tokens=request.max_tokens,
-            temperature=0.6,  # Recommended setting
-            do_sample=True,  # DO NOT use greedy decoding
-            top_p=0.95,  # Recommended
-            top_k=20,  # Recommended
-            eos_token_id=terminators,
-            pad_token_id=tokenizer.eos_token_id
-        )
-        
-        # Decode only the new tokens
-        response_text = tokenizer.decode(
-            outputs[0][inputs.input_ids.shape[-1]:],
-            skip_special_tokens=True
+            sampling=SamplingParams(temperature=0.6),  # Recommended setting
         )
+        response_text = result.text
         
         print(f"DEBUG: Generated response: {response_text[:200]}...")  # Log first 200 chars
         
@@ -110,5 +170,106 @@ async def chat(request: ChatRequest):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/v1/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Streaming chat with Turkish-Gemma-9b-T1 over Server-Sent Events.
+    Emits 'token' events as text is generated and a final 'done' event with
+    time-to-first-token and tokens/sec. Disconnecting stops generation.
+    """
+    require_ready()
+    text = build_prompt(request.messages)
+
+    async def event_generator():
+        async for event in stream_generate(
+            scheduler,
+            text,
+            max_new_tokens=request.max_tokens,
+            sampling=SamplingParams(temperature=0.6),  # Recommended setting
+        ):
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+# --- OpenAI-compatible API (base_url=http://<host>:8003/v1) ---
+
+@app.get("/v1/models")
+async def list_models():
+    return {
+        "object": "list",
+        "data": [{"id": MODEL_ID, "object": "model", "created": 0, "owned_by": "mtm"}],
+    }
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: openai_compat.ChatCompletionRequest):
+    """
+    OpenAI Chat Completions endpoint backed by the local model. Whatever model
+    name the client asks for, the local model answers. response_format
+    json_object / json_schema is enforced with constrained decoding.
+    """
+    require_ready()
+    if request.n != 1:
+        raise HTTPException(status_code=400, detail="Only n=1 is supported")
+    try:
+        json_schema = schema_from_response_format(request.response_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    text = build_prompt(openai_compat.chat_messages(request))
+    max_new_tokens = openai_compat.max_new_tokens(request)
+    sampling = openai_compat.sampling_params(request)
+    completion_id = openai_compat.new_completion_id()
+
+    if request.stream:
+        return StreamingResponse(
+            openai_stream(request, completion_id, text, max_new_tokens, sampling, json_schema),
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no"
+            }
+        )
+
+    try:
+        result = await scheduler.submit(text, max_new_tokens=max_new_tokens, sampling=sampling, json_schema=json_schema)
+    except Exception as e:
+        print(f"Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return openai_compat.completion_response(completion_id, MODEL_ID, result)
+
+async def openai_stream(request, completion_id, text, max_new_tokens, sampling, json_schema):
+    """
+    Re-emits stream_generate events as OpenAI chat.completion.chunk events.
+    """
+    created = int(time.time())
+
+    def chunk(delta, finish_reason=None):
+        event = openai_compat.completion_chunk(completion_id, MODEL_ID, created, delta, finish_reason)
+        return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    yield chunk({"role": "assistant", "content": ""})
+    async for event in stream_generate(scheduler, text, max_new_tokens=max_new_tokens, sampling=sampling, json_schema=json_schema):
+        if event["type"] == "token":
+            yield chunk({"content": event["content"]})
+        elif event["type"] == "error":
+            yield f"data: {json.dumps({'error': {'message': event['message']}}, ensure_ascii=False)}\n\n"
+        elif event["type"] == "done":
+            finish_reason = "length" if event["completion_tokens"] >= max_new_tokens else "stop"
+            yield chunk({}, finish_reason)
+            if (request.stream_options or {}).get("include_usage"):
+                usage_event = openai_compat.completion_chunk(completion_id, MODEL_ID, created, {})
+                usage_event["choices"] = []
+                usage_event["usage"] = openai_compat.usage(event["prompt_tokens"], event["completion_tokens"])
+                yield f"data: {json.dumps(usage_event)}\n\n"
+    yield "data: [DONE]\n\n"
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8003, reload=False)
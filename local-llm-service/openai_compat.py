@@ -0,0 +1,107 @@
+"""
+OpenAI Chat Completions request/response shapes for the local LLM.
+
+Lets the pipelines that call openai.OpenAI(...).chat.completions.create point
+base_url at this service (e.g. http://local-llm-api:8003/v1) without code
+changes. Only the fields the pipelines use are interpreted; the rest of the
+OpenAI request body is accepted and ignored.
+"""
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Union
+
+from pydantic import BaseModel
+
+from scheduler import GenerationResult, SamplingParams
+
+DEFAULT_MAX_TOKENS = 512
+
+
+class ChatCompletionRequest(BaseModel):
+    model: str = ""
+    messages: List[Dict[str, Any]]
+    temperature: Optional[float] = None
+    top_p: Optional[float] = None
+    max_tokens: Optional[int] = None
+    max_completion_tokens: Optional[int] = None
+    n: int = 1
+    stream: bool = False
+    stream_options: Optional[Dict[str, Any]] = None
+    response_format: Optional[Dict[str, Any]] = None
+
+
+def message_text(content: Union[str, List[Dict[str, Any]], None]) -> str:
+    """Flattens OpenAI message content (a string or a list of parts) to text."""
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content if part.get("type") == "text")
+
+
+def chat_messages(request: ChatCompletionRequest) -> List[Dict[str, str]]:
+    return [
+        {"role": message.get("role", "user"), "content": message_text(message.get("content"))}
+        for message in request.messages
+    ]
+
+
+def max_new_tokens(request: ChatCompletionRequest) -> int:
+    return request.max_completion_tokens or request.max_tokens or DEFAULT_MAX_TOKENS
+
+
+def sampling_params(request: ChatCompletionRequest) -> SamplingParams:
+    """Maps OpenAI sampling settings; unset values keep the Turkish-Gemma defaults."""
+    defaults = SamplingParams()
+    if request.temperature == 0:
+        # OpenAI's temperature=0 means deterministic output
+        return SamplingParams(do_sample=False)
+    return SamplingParams(
+        temperature=request.temperature if request.temperature is not None else defaults.temperature,
+        top_p=request.top_p if request.top_p is not None else defaults.top_p,
+    )
+
+
+def new_completion_id() -> str:
+    return f"chatcmpl-{uuid.uuid4().hex}"
+
+
+def usage(prompt_tokens: int, completion_tokens: int) -> dict:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def completion_response(completion_id: str, model: str, result: GenerationResult) -> dict:
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": result.text},
+                "finish_reason": result.finish_reason,
+            }
+        ],
+        "usage": usage(result.prompt_tokens, result.completion_tokens),
+    }
+
+
+def completion_chunk(
+    completion_id: str,
+    model: str,
+    created: int,
+    delta: dict,
+    finish_reason: Optional[str] = None,
+) -> dict:
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
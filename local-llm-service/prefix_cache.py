@@ -0,0 +1,167 @@
+"""
+Prompt-prefix KV cache for the local LLM.
+
+Every request starts with the same long MTM system message, so its key/value
+cache is computed once at startup and reused: generate() then only prefills
+the tokens after the prefix. Other static prefixes (e.g. pipeline-specific
+system prompts) can be registered the same way.
+
+For a batch, all rows must share the same cached prefix. Rows are laid out as
+[prefix][padding][own tokens]; the attention mask hides the padding and the
+position ids generate() derives from it continue right after the prefix, so
+one copy of the prefix cache can be expanded to the whole batch. Sliding-window
+layers count cache slots rather than real tokens, so a padded batch longer than
+the window is not served from the cache.
+"""
+import os
+import copy
+import json
+import threading
+from dataclasses import dataclass
+from typing import Any, List, Optional, Tuple
+
+import torch
+from transformers import DynamicCache
+
+LLM_PREFIX_CACHE = os.getenv("LLM_PREFIX_CACHE", "1") == "1"
+# Optional JSON file of {"name": "system message", ...} to cache besides the MTM default
+LLM_PREFIX_FILE = os.getenv("LLM_PREFIX_FILE", "")
+
+# Prefixes shorter than this are not worth caching
+MIN_PREFIX_TOKENS = 8
+
+
+@dataclass
+class CachedPrefix:
+    name: str
+    token_ids: List[int]
+    past_key_values: Any
+    hits: int = 0
+
+
+class PrefixCache:
+    def __init__(self, model, tokenizer):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.prefixes: List[CachedPrefix] = []
+        self.misses = 0
+        self.sliding_window = getattr(model.config, "sliding_window", None)
+        self._lock = threading.Lock()
+
+    def register(self, name: str, prefix_text: str) -> Optional[CachedPrefix]:
+        """
+        Computes and keeps the KV cache for a prompt prefix given as text.
+        """
+        token_ids = self.tokenizer(prefix_text).input_ids
+        # The last token may merge differently with whatever follows the prefix,
+        # so it is left to the normal prefill
+        token_ids = token_ids[:-1]
+        if len(token_ids) < MIN_PREFIX_TOKENS:
+            print(f"DEBUG: Prefix '{name}' too short to cache ({len(token_ids)} tokens)")
+            return None
+
+        input_ids = torch.tensor([token_ids], device=self.model.device)
+        past_key_values = self._new_cache()
+        with torch.inference_mode():
+            self.model(input_ids=input_ids, past_key_values=past_key_values, use_cache=True)
+
+        prefix = CachedPrefix(name=name, token_ids=token_ids, past_key_values=past_key_values)
+        with self._lock:
+            self.prefixes = [p for p in self.prefixes if p.name != name] + [prefix]
+            # Longest first, so the most specific prefix wins
+            self.prefixes.sort(key=lambda p: len(p.token_ids), reverse=True)
+        print(f"DEBUG: Cached prompt prefix '{name}' ({len(token_ids)} tokens)")
+        return prefix
+
+    def register_system_message(self, name: str, system_message: str) -> Optional[CachedPrefix]:
+        """
+        Caches everything the chat template renders before the first user message
+        when the conversation starts with `system_message`.
+        """
+        probes = [
+            self.tokenizer.apply_chat_template(
+                [{"role": "system", "content": system_message}, {"role": "user", "content": probe}],
+                tokenize=False,
+                add_generation_prompt=True,
+            )
+            for probe in ("a", "b")
+        ]
+        prefix_text = os.path.commonprefix(probes)
+        return self.register(name, prefix_text)
+
+    def load_prefix_file(self, path: str):
+        """Registers the system messages from a JSON file of {name: system message}."""
+        with open(path, encoding="utf-8") as f:
+            for name, system_message in json.load(f).items():
+                self.register_system_message(name, system_message)
+
+    def match(self, sequences: List[List[int]]) -> Optional[CachedPrefix]:
+        """
+        Returns the longest cached prefix that every sequence starts with (and extends).
+        """
+        with self._lock:
+            for prefix in self.prefixes:
+                length = len(prefix.token_ids)
+                if all(len(seq) > length and seq[:length] == prefix.token_ids for seq in sequences):
+                    if not self._fits_window(length, sequences):
+                        break
+                    prefix.hits += 1
+                    return prefix
+            self.misses += 1
+        return None
+
+    def _fits_window(self, prefix_length: int, sequences: List[List[int]]) -> bool:
+        lengths = [len(seq) for seq in sequences]
+        if not self.sliding_window or min(lengths) == max(lengths):
+            # No padding between prefix and suffix
+            return True
+        return max(lengths) <= self.sliding_window
+
+    def build_inputs(
+        self,
+        prefix: CachedPrefix,
+        sequences: List[List[int]],
+        pad_token_id: int,
+    ) -> Tuple[torch.Tensor, torch.Tensor, Any]:
+        """
+        Lays the batch out as [prefix][padding][suffix] and returns
+        (input_ids, attention_mask, past_key_values) for generate().
+        """
+        prefix_length = len(prefix.token_ids)
+        suffixes = [seq[prefix_length:] for seq in sequences]
+        longest = max(len(suffix) for suffix in suffixes)
+
+        rows, masks = [], []
+        for suffix in suffixes:
+            padding = longest - len(suffix)
+            rows.append(prefix.token_ids + [pad_token_id] * padding + suffix)
+            masks.append([1] * prefix_length + [0] * padding + [1] * len(suffix))
+
+        # generate() extends the cache in place, so every call gets its own copy
+        past_key_values = copy.deepcopy(prefix.past_key_values)
+        if len(sequences) > 1:
+            past_key_values.batch_repeat_interleave(len(sequences))
+
+        device = self.model.device
+        return (
+            torch.tensor(rows, device=device),
+            torch.tensor(masks, device=device),
+            past_key_values,
+        )
+
+    def stats(self) -> dict:
+        return {
+            "enabled": True,
+            "misses": self.misses,
+            "prefixes": [
+                {"name": p.name, "tokens": len(p.token_ids), "hits": p.hits}
+                for p in self.prefixes
+            ],
+        }
+
+    def _new_cache(self):
+        try:
+            # Lets sliding-window layers (Gemma-2) use their own cache layout
+            return DynamicCache(config=self.model.config)
+        except TypeError:
+            return DynamicCache()
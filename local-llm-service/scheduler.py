@@ -0,0 +1,246 @@
+"""
+Batching request scheduler for the local LLM.
+
+Concurrent chat requests are queued instead of each calling model.generate on
+the event loop. A background task collects whatever arrives within a short
+window (up to a maximum batch size), left-pads the prompts into one batch,
+runs a single generate call in a worker thread and resolves every caller's
+future with its own completion.
+"""
+import os
+import time
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import torch
+
+from constrained import JsonDecoding
+
+# Largest number of requests merged into one generate call
+LLM_MAX_BATCH_SIZE = int(os.getenv("LLM_MAX_BATCH_SIZE", "8"))
+# How long the first request of a batch waits for others to join (milliseconds)
+LLM_MAX_WAIT_MS = int(os.getenv("LLM_MAX_WAIT_MS", "20"))
+
+
+@dataclass(frozen=True)
+class SamplingParams:
+    """Sampling settings; only requests with identical settings share a batch."""
+    temperature: float = 0.6  # Recommended for Turkish-Gemma
+    top_p: float = 0.95
+    top_k: int = 20
+    do_sample: bool = True  # DO NOT use greedy decoding
+
+
+@dataclass
+class GenerationRequest:
+    prompt: str
+    max_new_tokens: int
+    sampling: SamplingParams
+    future: asyncio.Future
+    json_schema: Optional[dict] = None  # Constrains the output to JSON matching this schema
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+@dataclass
+class GenerationResult:
+    text: str
+    prompt_tokens: int
+    completion_tokens: int
+    finish_reason: str  # "stop" or "length"
+
+
+class BatchScheduler:
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        max_batch_size: int = LLM_MAX_BATCH_SIZE,
+        max_wait_ms: int = LLM_MAX_WAIT_MS,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        # Optional PrefixCache (see prefix_cache.py); set by the app after startup
+        self.prefix_cache = None
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self.terminators = [
+            tokenizer.eos_token_id,
+            tokenizer.convert_tokens_to_ids("<end_of_turn>")
+        ]
+
+        # Held for every generate call on the model, batched or streamed,
+        # so at most one forward pass competes for GPU memory at a time
+        self.generate_lock = threading.Lock()
+        self.json_decoding = JsonDecoding(tokenizer, self.terminators)
+
+        self.batches_run = 0
+        self.requests_served = 0
+
+    def start(self):
+        """Starts the background batching loop; must be called from the running event loop."""
+        self.queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(
+        self,
+        prompt: str,
+        max_new_tokens: int,
+        sampling: SamplingParams = SamplingParams(),
+        json_schema: Optional[dict] = None,
+    ) -> GenerationResult:
+        """Queues a prompt and waits for its completion."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(GenerationRequest(prompt, max_new_tokens, sampling, future, json_schema))
+        return await future
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": int(self.max_wait * 1000),
+            "queued": self.queue.qsize() if self.queue else 0,
+            "batches_run": self.batches_run,
+            "requests_served": self.requests_served,
+            "avg_batch_size": round(self.requests_served / self.batches_run, 2) if self.batches_run else 0.0,
+        }
+
+    async def _collect_batch(self) -> List[GenerationRequest]:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Anything that is already waiting joins too, up to the cap
+        while len(batch) < self.max_batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect_batch()
+
+            # Constrained rows pay for a token mask at every step, so they run apart from plain ones
+            groups: Dict[Tuple[SamplingParams, bool], List[GenerationRequest]] = {}
+            for request in batch:
+                if not request.future.cancelled():
+                    key = (request.sampling, request.json_schema is not None)
+                    groups.setdefault(key, []).append(request)
+
+            for (sampling, _), group in groups.items():
+                await self._run_group(sampling, group)
+
+    async def _run_group(self, sampling: SamplingParams, group: List[GenerationRequest]):
+        json_schemas = [request.json_schema for request in group]
+        try:
+            results = await asyncio.to_thread(
+                self._generate,
+                [request.prompt for request in group],
+                [request.max_new_tokens for request in group],
+                sampling,
+                json_schemas if any(json_schemas) else None,
+            )
+        except Exception as e:
+            print(f"Error in batched generation: {e}")
+            for request in group:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+
+        self.batches_run += 1
+        self.requests_served += len(group)
+        for request, result in zip(group, results):
+            if not request.future.done():
+                request.future.set_result(result)
+
+    def prepare_inputs(self, prompts: List[str]) -> dict:
+        """
+        Tokenizes prompts into generate() keyword arguments, reusing a cached
+        prompt prefix when every prompt starts with the same one.
+        """
+        sequences = [self.tokenizer(prompt).input_ids for prompt in prompts]
+
+        prefix = self.prefix_cache.match(sequences) if self.prefix_cache else None
+        if prefix is not None:
+            input_ids, attention_mask, past_key_values = self.prefix_cache.build_inputs(
+                prefix, sequences, self.pad_token_id
+            )
+            return {"input_ids": input_ids, "attention_mask": attention_mask, "past_key_values": past_key_values}
+
+        # Left padding so every prompt ends right before its new tokens
+        longest = max(len(seq) for seq in sequences)
+        input_ids = [[self.pad_token_id] * (longest - len(seq)) + seq for seq in sequences]
+        attention_mask = [[0] * (longest - len(seq)) + [1] * len(seq) for seq in sequences]
+        device = self.model.device
+        return {
+            "input_ids": torch.tensor(input_ids, device=device),
+            "attention_mask": torch.tensor(attention_mask, device=device),
+        }
+
+    def _generate(
+        self,
+        prompts: List[str],
+        max_new_tokens: List[int],
+        sampling: SamplingParams,
+        json_schemas: Optional[List[Optional[dict]]] = None,
+    ) -> List[GenerationResult]:
+        print(f"DEBUG: Generating batch of {len(prompts)}")
+
+        # Built outside the lock; the first call indexes the whole vocabulary
+        prefix_allowed_tokens_fn = self.json_decoding.prefix_allowed_tokens_fn(json_schemas) if json_schemas else None
+
+        with self.generate_lock, torch.inference_mode():
+            inputs = self.prepare_inputs(prompts)
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=max(max_new_tokens),
+                temperature=sampling.temperature,
+                do_sample=sampling.do_sample,
+                top_p=sampling.top_p,
+                top_k=sampling.top_k,
+                eos_token_id=self.terminators,
+                pad_token_id=self.pad_token_id,
+                prefix_allowed_tokens_fn=prefix_allowed_tokens_fn,
+            )
+
+        prompt_length = inputs["input_ids"].shape[-1]
+        prompt_tokens = inputs["attention_mask"].sum(dim=-1).tolist()
+        return [
+            self._decode(outputs[i][prompt_length:], max_new_tokens[i], prompt_tokens[i])
+            for i in range(len(prompts))
+        ]
+
+    def _decode(self, new_tokens: torch.Tensor, max_new_tokens: int, prompt_tokens: int) -> GenerationResult:
+        """Cuts one sequence at its first terminator (or its own token budget) and decodes it."""
+        token_ids = new_tokens.tolist()[:max_new_tokens]
+        finish_reason = "length"
+        for position, token_id in enumerate(token_ids):
+            if token_id in self.terminators:
+                token_ids = token_ids[:position]
+                finish_reason = "stop"
+                break
+        text = self.tokenizer.decode(token_ids, skip_special_tokens=True)
+        return GenerationResult(
+            text=text.strip(),
+            prompt_tokens=prompt_tokens,
+            completion_tokens=len(token_ids),
+            finish_reason=finish_reason,
+        )
@@ -0,0 +1,129 @@
+"""
+Token streaming for the local LLM.
+
+generate() runs in a worker thread and pushes text into a TextIteratorStreamer;
+the async side pulls chunks off it without blocking the event loop. If the
+consumer stops iterating (e.g. the HTTP client disconnected) a stopping
+criterion ends generation at the next step so the GPU is freed.
+"""
+import time
+import asyncio
+import threading
+from typing import AsyncIterator, Optional
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+from scheduler import BatchScheduler, SamplingParams
+
+
+class CancelledCriteria(StoppingCriteria):
+    """Stops generation as soon as the event is set."""
+
+    def __init__(self, cancelled: threading.Event):
+        self.cancelled = cancelled
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.cancelled.is_set()
+
+
+class TimedTextStreamer(TextIteratorStreamer):
+    """TextIteratorStreamer that also counts generated tokens and records when the first one arrived."""
+
+    def __init__(self, tokenizer, **kwargs):
+        super().__init__(tokenizer, **kwargs)
+        self.generated_tokens = 0
+        self.first_token_at = None
+
+    def put(self, value):
+        if not (self.skip_prompt and self.next_tokens_are_prompt):
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self.generated_tokens += value.numel()
+        super().put(value)
+
+
+async def stream_generate(
+    scheduler: BatchScheduler,
+    prompt: str,
+    max_new_tokens: int,
+    sampling: SamplingParams = SamplingParams(),
+    json_schema: Optional[dict] = None,
+) -> AsyncIterator[dict]:
+    """
+    Yields {"type": "token", "content": ...} events while generating, then a
+    final {"type": "done", ...} event with time-to-first-token and tokens/sec.
+
+    Shares the scheduler's model and generate lock, so a stream waits for any
+    running batch to finish before starting.
+    """
+    model, tokenizer = scheduler.model, scheduler.tokenizer
+    started_at = time.perf_counter()
+
+    streamer = TimedTextStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    cancelled = threading.Event()
+    errors = []
+    prompt_tokens = []
+
+    def run_generate():
+        try:
+            prefix_allowed_tokens_fn = (
+                scheduler.json_decoding.prefix_allowed_tokens_fn([json_schema]) if json_schema is not None else None
+            )
+            with scheduler.generate_lock, torch.inference_mode():
+                if cancelled.is_set():
+                    # Client left while we were waiting for the GPU
+                    streamer.end()
+                    return
+                inputs = scheduler.prepare_inputs([prompt])
+                prompt_tokens.append(int(inputs["attention_mask"].sum()))
+                model.generate(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    temperature=sampling.temperature,
+                    do_sample=sampling.do_sample,
+                    top_p=sampling.top_p,
+                    top_k=sampling.top_k,
+                    eos_token_id=scheduler.terminators,
+                    pad_token_id=scheduler.pad_token_id,
+                    prefix_allowed_tokens_fn=prefix_allowed_tokens_fn,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([CancelledCriteria(cancelled)]),
+                )
+        except Exception as e:
+            print(f"Error in streamed generation: {e}")
+            errors.append(e)
+            # Unblock the consumer waiting on the streamer queue
+            streamer.end()
+
+    generation = asyncio.get_running_loop().run_in_executor(None, run_generate)
+    chunks = iter(streamer)
+
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                yield {"type": "token", "content": chunk}
+
+        await generation
+        if errors:
+            yield {"type": "error", "message": str(errors[0])}
+            return
+
+        finished_at = time.perf_counter()
+        first_token_at = streamer.first_token_at or finished_at
+        decode_seconds = finished_at - first_token_at
+        yield {
+            "type": "done",
+            "prompt_tokens": prompt_tokens[0] if prompt_tokens else 0,
+            "completion_tokens": streamer.generated_tokens,
+            "time_to_first_token_ms": round((first_token_at - started_at) * 1000, 1),
+            "total_time_ms": round((finished_at - started_at) * 1000, 1),
+            # Decode rate after the first token, so queueing and prefill do not dilute it
+            "tokens_per_sec": round((streamer.generated_tokens - 1) / decode_seconds, 2) if decode_seconds > 0 else 0.0,
+        }
+    finally:
+        # Reached on normal completion and when the consumer goes away mid-stream
+        cancelled.set()
@@ -14,6 +14,7 @@ from bs4 import BeautifulSoup
 import openai
 
 from prompts import BRAND_EXTRACTION_PROMPT, SENTIMENT_ANALYSIS_PROMPT
+from page_loading import block_resources, wait_for_content
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -22,6 +23,7 @@ logger = logging.getLogger(__name__)
 # Constants
 TIMEOUT = 60  # 60 seconds timeout per GNO 
 MAX_RETRIES = 3
+TEXT_WAIT_MS = 5000  # Longest wait for the clip text to render after clicking "Metin"
 
 
 class NewsAnalyzer:
@@ -101,20 +103,23 @@ class NewsAnalyzer:
                     page = await browser.new_page(
                         user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
                     )
+                    # Skip images, fonts, ads and trackers - only the text is needed
+                    await block_resources(page)
                     
                     try:
                         # Short timeout - fail fast
                         await page.goto(url, wait_until='domcontentloaded', timeout=20000)
-                        await page.wait_for_timeout(1500)
                         
-                        # Try Metin button
-                        try:
-                            metin_btn = await page.query_selector('button:has-text("Metin")')
-                            if metin_btn:
-                                await metin_btn.click()
-                                await page.wait_for_timeout(1500)
-                        except:
-                            pass
+                        # Stop waiting as soon as the text wrapper is filled (at most the old fixed 1.5 s pause)
+                        if not await wait_for_content(page, selector='div.text-wrapper', min_chars=100, timeout=1500):
+                            # Try Metin button
+                            try:
+                                metin_btn = await page.query_selector('button:has-text("Metin")')
+                                if metin_btn:
+                                    await metin_btn.click()
+                                    await wait_for_content(page, selector='div.text-wrapper', min_chars=100, timeout=TEXT_WAIT_MS)
+                            except:
+                                pass
                         
                         # Get content
                         html = await page.content()
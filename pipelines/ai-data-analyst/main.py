@@ -15,6 +15,7 @@ from fastapi.middleware.cors import CORSMiddleware
 import logging
 
 from analyzer import NewsAnalyzer
+from excel_ingest import normalize_id, read_sheet
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -171,23 +172,11 @@ async def process_excel_task(task_id: str, input_file: Path, api_key: str, model
         TASKS[task_id]["status"] = "processing"
         TASKS[task_id]["message"] = "Reading file..."
         
-        # Read Excel/CSV
-        if input_file.suffix == '.csv':
-            df = pd.read_csv(input_file)
-        else:
-            df = pd.read_excel(input_file)
-        
-        logger.info(f"Read file with {len(df)} rows and columns: {list(df.columns)}")
-        
-        # Find GNO column (case-insensitive)
-        gno_column = None
-        for col in df.columns:
-            if col.lower() in ['gno', 'GNO']:
-                gno_column = col
-                break
+        # Read only the GNO and GrupId columns (Excel or CSV); GNOs come back
+        # normalized (no '.0' from float columns) and deduplicated
+        sheet = await asyncio.to_thread(read_sheet, str(input_file), "GNO", optional_columns=["GrupId"])
         
-        if gno_column is None:
-            raise ValueError("Could not find 'Gno' or 'GNO' column in file")
+        logger.info(f"Read file with {sheet.total} rows ({sheet.duplicates} duplicate GNOs)")
         
         # Extract hyperlinks from Excel cells using openpyxl
         gno_to_url = {}
@@ -205,18 +194,11 @@ async def process_excel_task(task_id: str, input_file: Path, api_key: str, model
                         break
                 
                 if gno_col_idx:
-                    # Helper to normalize GNO - remove .0 suffix from floats
-                    def normalize_gno(val):
-                        s = str(val)
-                        if s.endswith('.0'):
-                            s = s[:-2]
-                        return s
-                    
                     # Extract hyperlinks from GNO column
                     for row_idx, row in enumerate(ws.iter_rows(min_row=2, min_col=gno_col_idx, max_col=gno_col_idx), 2):
                         cell = row[0]
                         if cell.value and cell.hyperlink:
-                            gno_value = normalize_gno(cell.value)
+                            gno_value = normalize_id(cell.value)
                             hyperlink_url = cell.hyperlink.target
                             gno_to_url[gno_value] = hyperlink_url
                             logger.info(f"Found hyperlink for GNO {gno_value}: {hyperlink_url}")
@@ -225,20 +207,8 @@ async def process_excel_task(task_id: str, input_file: Path, api_key: str, model
             except Exception as e:
                 logger.warning(f"Could not extract hyperlinks: {str(e)}")
         
-        # Find GrupId column (case-insensitive)
-        grupid_column = None
-        for col in df.columns:
-            if col.lower() == 'grupid':
-                grupid_column = col
-                break
-        
-        if grupid_column:
-            logger.info(f"Found GrupId column: {grupid_column}")
-        else:
-            logger.info("No GrupId column found, processing all GNOs individually")
-        
         # Get unique GNOs
-        unique_gnos = df[gno_column].dropna().unique()
+        unique_gnos = [row.id for row in sheet.rows]
         total_gnos = len(unique_gnos)
         
         TASKS[task_id]["total"] = total_gnos
@@ -246,19 +216,12 @@ async def process_excel_task(task_id: str, input_file: Path, api_key: str, model
         
         logger.info(f"Found {total_gnos} unique GNOs")
         
-        # Build GNO to GrupId mapping if GrupId column exists
-        gno_to_grupid = {}
-        if grupid_column:
-            for _, row in df.iterrows():
-                gno_val = row[gno_column]
-                grupid_val = row[grupid_column]
-                if pd.notna(gno_val) and pd.notna(grupid_val):
-                    # Normalize GNO
-                    gno_key = str(gno_val)
-                    if gno_key.endswith('.0'):
-                        gno_key = gno_key[:-2]
-                    gno_to_grupid[gno_key] = grupid_val
+        # Build GNO to GrupId mapping (empty when the file has no GrupId column)
+        gno_to_grupid = {row.id: row.values["GrupId"] for row in sheet.rows if row.values["GrupId"]}
+        if gno_to_grupid:
             logger.info(f"Built GNO to GrupId mapping with {len(gno_to_grupid)} entries")
+        else:
+            logger.info("No GrupId column found, processing all GNOs individually")
         
         # Process each GNO with GrupId caching
         all_results = []
@@ -270,13 +233,8 @@ async def process_excel_task(task_id: str, input_file: Path, api_key: str, model
                     TASKS[task_id]["progress"] = idx
                     TASKS[task_id]["message"] = f"Processing GNO {idx + 1}/{total_gnos}: {gno}"
                     
-                    # Normalize GNO - remove .0 suffix from floats
-                    gno_str = str(gno)
-                    if gno_str.endswith('.0'):
-                        gno_str = gno_str[:-2]
-                    
                     # Check if this GNO's GrupId was already processed
-                    grupid = gno_to_grupid.get(gno_str)
+                    grupid = gno_to_grupid.get(gno)
                     
                     if grupid and grupid in grupid_results_cache:
                         # Reuse cached results for same GrupId
@@ -286,20 +244,20 @@ async def process_excel_task(task_id: str, input_file: Path, api_key: str, model
                         # Copy results with current GNO
                         for cached_result in cached_results:
                             result_copy = cached_result.copy()
-                            result_copy["gno"] = gno_str
+                            result_copy["gno"] = gno
                             all_results.append(result_copy)
                         continue
                     
                     logger.info(f"Processing GNO {idx + 1}/{total_gnos}: {gno}")
                     
                     # Use hyperlink if available, otherwise use GNO value directly
-                    gno_url = gno_to_url.get(gno_str, gno_str)
+                    gno_url = gno_to_url.get(gno, gno)
                     
-                    if gno_url != gno_str:
+                    if gno_url != gno:
                         logger.info(f"Using hyperlink URL: {gno_url}")
                     
                     # Process GNO
-                    results = await analyzer.process_gno(gno=gno_str, gno_url=gno_url)
+                    results = await analyzer.process_gno(gno=gno, gno_url=gno_url)
                     all_results.extend(results)
                     
                     # Cache results by GrupId
@@ -0,0 +1,152 @@
+"""
+Background poller for submitted OpenAI batches.
+
+Clients used to poll /mbr-kunye-batch-status themselves, each call doing a
+fresh batches.retrieve, and every /mbr-kunye-batch-results call downloaded and
+parsed the whole output file again. The poller now checks all open batches every
+BATCH_POLL_INTERVAL seconds and stores their progress in the job store. When a
+batch finishes, its output (and error) file is downloaded once, read line by
+line and written to the job store in chunks, and results are served from there.
+
+With several uvicorn workers only the worker holding the poller lease polls.
+Batches whose API key that worker cannot read (see job_store) are left to
+the status/results endpoints, which take the key from the request.
+"""
+import os
+import json
+import uuid
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+import openai
+
+from job_store import TERMINAL_STATUSES, job_store
+
+BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", "30"))
+# Parsed result lines written to the job store per transaction
+BATCH_INGEST_CHUNK = int(os.getenv("BATCH_INGEST_CHUNK", "500"))
+
+POLLER_LEASE = "batch-poller"
+
+
+def parse_output_line(line: str) -> Optional[Tuple[str, str, Optional[str], Optional[str]]]:
+    """
+    Turns one line of a batch output/error file into a
+    (custom_id, status, data_json, error) row, or None for blank lines.
+    """
+    if not line.strip():
+        return None
+    try:
+        result_data = json.loads(line)
+    except json.JSONDecodeError as e:
+        print(f"[WARNING] Skipping unreadable batch output line: {e}")
+        return None
+
+    custom_id = result_data.get("custom_id")
+    if result_data.get("error"):
+        return custom_id, "failed", None, str(result_data["error"])
+
+    response = result_data.get("response") or {}
+    if response.get("status_code", 200) >= 400:
+        return custom_id, "failed", None, json.dumps(response.get("body"), ensure_ascii=False)
+
+    try:
+        extracted_text = response["body"]["choices"][0]["message"]["content"]
+        extracted_data = json.loads(extracted_text)
+    except (KeyError, IndexError, TypeError, json.JSONDecodeError) as e:
+        return custom_id, "failed", None, f"Yanıt çözümlenemedi: {e}"
+    return custom_id, "success", json.dumps(extracted_data, ensure_ascii=False), None
+
+
+def ingest_file(client: openai.OpenAI, batch_id: str, file_id: str) -> int:
+    """Streams a batch output/error file into the job store; returns the number of rows stored."""
+    stored = 0
+    chunk: List[Tuple[str, str, Optional[str], Optional[str]]] = []
+    with client.files.with_streaming_response.content(file_id) as response:
+        for line in response.iter_lines():
+            row = parse_output_line(line)
+            if row is None:
+                continue
+            chunk.append(row)
+            if len(chunk) >= BATCH_INGEST_CHUNK:
+                job_store.add_results(batch_id, chunk)
+                stored += len(chunk)
+                chunk = []
+    if chunk:
+        job_store.add_results(batch_id, chunk)
+        stored += len(chunk)
+    return stored
+
+
+class BatchPoller:
+    def __init__(self, interval: float = BATCH_POLL_INTERVAL):
+        self.interval = interval
+        self.holder = uuid.uuid4().hex
+        self._task: Optional[asyncio.Task] = None
+        self._batch_locks: Dict[str, asyncio.Lock] = {}
+
+    def start(self):
+        if job_store is None:
+            print("[WARNING] Job store unavailable, batch poller not started")
+            return
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                # The lease outlives a few missed polls, so a crashed worker is replaced quickly
+                if await asyncio.to_thread(job_store.try_acquire_lease, POLLER_LEASE, self.holder, self.interval * 3):
+                    await self.poll_all()
+            except Exception as e:
+                print(f"[ERROR] Batch poller error: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def poll_all(self):
+        for batch_info in await asyncio.to_thread(job_store.batches_to_poll):
+            if not batch_info["openai_api_key"]:
+                continue
+            try:
+                await self.poll_batch(batch_info["batch_id"], batch_info["openai_api_key"])
+            except Exception as e:
+                print(f"[ERROR] Polling batch {batch_info['batch_id']} failed: {e}")
+
+    async def poll_batch(self, batch_id: str, openai_api_key: str):
+        """
+        Refreshes one batch from OpenAI and, once it has finished, stores its
+        results. Also called by the endpoints when a batch was never polled.
+        """
+        lock = self._batch_locks.setdefault(batch_id, asyncio.Lock())
+        async with lock:
+            client = openai.OpenAI(api_key=openai_api_key)
+            batch = await asyncio.to_thread(client.batches.retrieve, batch_id)
+            await asyncio.to_thread(job_store.update_progress, batch_id, batch)
+            if batch.status not in TERMINAL_STATUSES:
+                return
+
+            batch_info = await asyncio.to_thread(job_store.get_batch, batch_id, False)
+            if batch_info["results_ingested"]:
+                return
+            stored = 0
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    stored += await asyncio.to_thread(ingest_file, client, batch_id, file_id)
+            # Requests the batch never answered (expired, cancelled, failed validation)
+            missing = await asyncio.to_thread(
+                job_store.fail_unanswered, batch_id, f"Batch {batch.status}: yanıt alınamadı"
+            )
+            await asyncio.to_thread(job_store.mark_ingested, batch_id)
+            self._batch_locks.pop(batch_id, None)
+            print(f"[DEBUG] Batch {batch_id} {batch.status}: stored {stored} results, {missing} unanswered")
+
+
+batch_poller = BatchPoller()
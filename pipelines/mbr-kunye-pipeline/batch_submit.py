@@ -0,0 +1,234 @@
+"""
+Submission of hybrid-mode requests to the OpenAI Batch API.
+
+A single batch is limited in request count and input file size, and one
+rejected file used to fail the whole upload. Requests are therefore split into
+shards of at most BATCH_MAX_REQUESTS requests / BATCH_MAX_FILE_MB megabytes,
+each shard is uploaded and created as its own batch (in parallel), and all
+shards are stored under one job_id so the endpoints can treat them as one job.
+A shard that cannot be submitted is stored as a failed shard, so its rows show
+up as failed results while the other shards carry on.
+
+Shards are submitted while OCR is still running (RollingSubmitter): every
+BATCH_ROLLING_SIZE successful OCRs, or once the oldest waiting request is
+BATCH_ROLLING_SECONDS old (checked by a timer, so a slow row does not hold
+them back), so OpenAI starts on the first rows long before the last row of a
+large sheet has been read. If the upload ends early (client disconnect or
+error), the requests gathered so far are still submitted and the job closed.
+"""
+import os
+import json
+import uuid
+import time
+import asyncio
+import tempfile
+from typing import Any, Dict, List, Optional, Set
+
+import openai
+
+from job_store import job_store
+
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "5000"))
+BATCH_MAX_FILE_MB = int(os.getenv("BATCH_MAX_FILE_MB", "150"))
+BATCH_ROLLING_SIZE = int(os.getenv("BATCH_ROLLING_SIZE", "500"))
+BATCH_ROLLING_SECONDS = float(os.getenv("BATCH_ROLLING_SECONDS", "600"))
+
+# Jobs finished in the background after their upload ended early (asyncio keeps only weak references)
+_finishing_jobs: Set[asyncio.Task] = set()
+
+
+def new_job_id() -> str:
+    return f"kunyejob_{uuid.uuid4().hex}"
+
+
+def shard_requests(
+    batch_requests: List[Dict[str, Any]],
+    max_requests: int = BATCH_MAX_REQUESTS,
+    max_bytes: int = BATCH_MAX_FILE_MB * 1024 * 1024,
+) -> List[List[Dict[str, Any]]]:
+    """Splits batch requests (in order) into shards within the count and JSONL size limits."""
+    shards = []
+    current: List[Dict[str, Any]] = []
+    current_bytes = 0
+    for request in batch_requests:
+        size = len(json.dumps(request, ensure_ascii=False).encode("utf-8")) + 1
+        if current and (len(current) >= max_requests or current_bytes + size > max_bytes):
+            shards.append(current)
+            current = []
+            current_bytes = 0
+        current.append(request)
+        current_bytes += size
+    if current:
+        shards.append(current)
+    return shards
+
+
+def create_batch(client: openai.OpenAI, batch_requests: List[Dict[str, Any]]):
+    """Writes the requests to a JSONL file, uploads it and creates the batch."""
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.jsonl', delete=False, encoding='utf-8') as f:
+        for request in batch_requests:
+            f.write(json.dumps(request, ensure_ascii=False) + '\n')
+        batch_file_path = f.name
+    try:
+        with open(batch_file_path, 'rb') as f:
+            batch_input_file = client.files.create(file=f, purpose="batch")
+        return client.batches.create(
+            input_file_id=batch_input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+    finally:
+        os.unlink(batch_file_path)
+
+
+async def submit_shard(
+    client: openai.OpenAI,
+    job_id: str,
+    shard_index: int,
+    batch_requests: List[Dict[str, Any]],
+    ocr_results: List[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """
+    Submits one shard and stores it under the job together with its OCR
+    results. Never raises: a failed submission is stored as a failed shard.
+    """
+    try:
+        batch_job = await asyncio.to_thread(create_batch, client, batch_requests)
+    except Exception as e:
+        print(f"[ERROR] Submitting shard {shard_index} of {job_id} failed: {e}")
+        batch_id = f"{job_id}-shard{shard_index}-failed"
+        try:
+            await asyncio.to_thread(job_store.create_batch, batch_id, client.api_key, ocr_results, "failed", None, job_id)
+            await asyncio.to_thread(job_store.fail_unanswered, batch_id, f"Batch gönderilemedi: {e}")
+            await asyncio.to_thread(job_store.set_request_counts, batch_id, len(batch_requests), 0, len(batch_requests))
+            await asyncio.to_thread(job_store.mark_ingested, batch_id)
+        except Exception as store_error:
+            print(f"[ERROR] Storing failed shard {shard_index} of {job_id}: {store_error}")
+        return {"batch_id": batch_id, "status": "failed", "requests": len(batch_requests), "error": str(e)}
+
+    await asyncio.to_thread(
+        job_store.create_batch,
+        batch_job.id,
+        client.api_key,
+        ocr_results,
+        batch_job.status,
+        batch_job.created_at,
+        job_id,
+    )
+    print(f"[DEBUG] Shard {shard_index} of {job_id} submitted as {batch_job.id} ({len(batch_requests)} requests)")
+    return {"batch_id": batch_job.id, "status": batch_job.status, "requests": len(batch_requests), "error": None}
+
+
+class RollingSubmitter:
+    """
+    Collects batch requests as OCR produces them and submits them as shards
+    of one job in the background. The job stays open (never "completed")
+    until finish() has submitted the last shard; open() must be awaited first.
+    """
+
+    def __init__(
+        self,
+        client: openai.OpenAI,
+        job_id: str,
+        shard_size: int = BATCH_ROLLING_SIZE,
+        max_wait: float = BATCH_ROLLING_SECONDS,
+    ):
+        self.client = client
+        self.job_id = job_id
+        self.shard_size = max(1, min(shard_size, BATCH_MAX_REQUESTS))
+        self.max_wait = max_wait
+        self._requests: List[Dict[str, Any]] = []
+        self._ocr_results: Dict[str, Dict[str, Any]] = {}
+        self._unsubmitted: List[Dict[str, Any]] = []  # Failed OCR rows, stored with the next shard
+        self._oldest: Optional[float] = None
+        self._tasks: List[asyncio.Task] = []
+        self._reported = 0
+        self._timer: Optional[asyncio.Task] = None
+        self._finishing: Optional[asyncio.Task] = None
+
+    async def open(self):
+        """Registers the job as still submitting and starts the time-based flush."""
+        await asyncio.to_thread(job_store.open_job, self.job_id)
+        self._timer = asyncio.create_task(self._flush_timer())
+
+    async def _flush_timer(self):
+        """Submits waiting requests once the oldest is max_wait old, even while OCR is stuck on a row."""
+        while True:
+            due = self.max_wait if self._oldest is None else self._oldest + self.max_wait - time.monotonic()
+            await asyncio.sleep(max(due, 0.1))
+            self.flush_if_due()
+
+    def add(self, batch_request: Dict[str, Any], ocr_result: Dict[str, Any]):
+        """Queues a request; submits a shard when enough requests waited long enough."""
+        self._requests.append(batch_request)
+        self._ocr_results[batch_request["custom_id"]] = ocr_result
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        self.flush_if_due()
+
+    def add_unsubmitted(self, ocr_result: Dict[str, Any]):
+        """Keeps a row without a request (failed OCR) so it is stored with the job."""
+        self._unsubmitted.append(ocr_result)
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        if not self._requests:
+            return
+        if len(self._requests) >= self.shard_size or time.monotonic() - self._oldest >= self.max_wait:
+            self.flush()
+
+    def flush(self):
+        """Submits all waiting requests (split by the batch limits) in the background."""
+        for shard in shard_requests(self._requests):
+            shard_ocr = [self._ocr_results.pop(request["custom_id"]) for request in shard]
+            shard_ocr += self._unsubmitted
+            self._unsubmitted = []
+            index = len(self._tasks)
+            self._tasks.append(asyncio.create_task(submit_shard(self.client, self.job_id, index, shard, shard_ocr)))
+        self._requests = []
+        self._oldest = None
+
+    @property
+    def shard_count(self) -> int:
+        return len(self._tasks)
+
+    def submitted(self) -> List[Dict[str, Any]]:
+        """Shards whose submission finished since the last call, in submission order."""
+        done = []
+        while self._reported < len(self._tasks) and self._tasks[self._reported].done():
+            done.append(self._tasks[self._reported].result())
+            self._reported += 1
+        return done
+
+    async def finish(self) -> List[Dict[str, Any]]:
+        """
+        Submits what is left and waits for every shard; returns all shard
+        results. Cancelling the caller does not stop the submission.
+        """
+        self.finish_in_background()
+        return await asyncio.shield(self._finishing)
+
+    def finish_in_background(self):
+        """Starts finish() without waiting for it, e.g. when the client went away; no-op once started."""
+        if self._finishing is None:
+            self._finishing = asyncio.create_task(self._finish())
+            _finishing_jobs.add(self._finishing)
+            self._finishing.add_done_callback(_finishing_jobs.discard)
+
+    async def _finish(self) -> List[Dict[str, Any]]:
+        try:
+            if self._timer is not None:
+                self._timer.cancel()
+            self.flush()
+            shards = await asyncio.gather(*self._tasks)
+            if self._unsubmitted and shards:
+                # Failed OCR rows after the last request: keep them with the first shard
+                await asyncio.to_thread(job_store.add_ocr_results, shards[0]["batch_id"], self._unsubmitted)
+                self._unsubmitted = []
+            return shards
+        except Exception as e:
+            print(f"[ERROR] Finishing job {self.job_id} failed: {e}")
+            raise
+        finally:
+            # Submitted shards stay tracked either way; the job just takes no more
+            await asyncio.to_thread(job_store.close_job, self.job_id)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Excel ingestion benchmark for the batch endpoints.
+
+Compares reading the Clip ID column of a large upload:
+  before: pd.read_excel of every column -> df.iterrows() -> str(row.iloc[col]).strip()
+  after:  excel_ingest.read_sheet (usecols, vectorized normalization, dedupe),
+          with openpyxl and, when python-calamine is installed, with calamine
+
+The generated sheet has a float-typed GNO column (so IDs read as "123.0"),
+blank and duplicate IDs, and the filler columns a real clipping export has.
+Usage: python benchmark_excel_ingest.py [rows] [path/to/sheet.xlsx]
+"""
+import os
+import sys
+import time
+import random
+from io import BytesIO
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import excel_ingest  # noqa: E402
+
+
+def make_sample_sheet(rows: int) -> bytes:
+    """Writes a clipping export with rows data rows; about 2% blank and 5% duplicate GNOs."""
+    random.seed(0)
+    gnos = []
+    for i in range(rows):
+        roll = random.random()
+        if roll < 0.02:
+            gnos.append(None)
+        elif roll < 0.07 and gnos:
+            gnos.append(random.choice([g for g in gnos[-50:] if g is not None] or [None]))
+        else:
+            gnos.append(float(100_000_000 + i))
+    df = pd.DataFrame({
+        "GNO": gnos,  # None makes the column float, as in real exports
+        "Yayın Adı": [random.choice(["HÜRRİYET", "SABAH", "MİLLİYET", "DÜNYA"]) for _ in range(rows)],
+        "Sayfa": [random.randint(1, 32) for _ in range(rows)],
+        "Tarih": pd.date_range("2024-01-01", periods=rows, freq="min"),
+        "Başlık": [f"Haber başlığı {i} " * 3 for i in range(rows)],
+        "Özet": [f"Uzun haber özeti metni {i} " * 8 for i in range(rows)],
+        "GrupId": [i // 3 for i in range(rows)],
+    })
+    buffer = BytesIO()
+    df.to_excel(buffer, index=False, engine="openpyxl")
+    return buffer.getvalue()
+
+
+def legacy_ingest(contents: bytes, col_idx: int = 0) -> list:
+    """The removed endpoint code: full read, iterrows, per-cell conversion."""
+    df = pd.read_excel(BytesIO(contents))
+    ids = []
+    for idx, row in df.iterrows():
+        try:
+            clip_id = str(row.iloc[col_idx]).strip()
+            if pd.isna(row.iloc[col_idx]) or not clip_id:
+                continue
+        except Exception:
+            continue
+        ids.append((idx, clip_id))
+    return ids
+
+
+def timed(label: str, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36} {elapsed:8.2f} s")
+    return result, elapsed
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], "rb") as f:
+            contents = f.read()
+        print(f"Sheet: {sys.argv[2]} ({len(contents) / 1024 / 1024:.1f} MB)")
+    else:
+        print(f"Generating a {rows}-row sheet...")
+        contents = make_sample_sheet(rows)
+        print(f"Sheet: {len(contents) / 1024 / 1024:.1f} MB")
+    print()
+
+    legacy, legacy_s = timed("before: read_excel + iterrows", lambda: legacy_ingest(contents))
+
+    calamine = excel_ingest.CALAMINE_AVAILABLE
+    excel_ingest.CALAMINE_AVAILABLE = False
+    sheet, openpyxl_s = timed("after:  read_sheet (openpyxl)", lambda: excel_ingest.read_sheet(contents, "A"))
+    excel_ingest.CALAMINE_AVAILABLE = calamine
+
+    calamine_s = None
+    if calamine:
+        _, calamine_s = timed("after:  read_sheet (calamine)", lambda: excel_ingest.read_sheet(contents, "A"))
+    else:
+        print("after:  read_sheet (calamine)        skipped (python-calamine / pandas >= 2.2 not available)")
+
+    print()
+    float_ids = sum(1 for _, clip_id in legacy if clip_id.endswith(".0"))
+    print(f"before: {len(legacy)} rows queued, {float_ids} IDs with a '.0' suffix")
+    print(f"after:  {len(sheet.rows)} rows queued, {sheet.duplicates} duplicates dropped, of {sheet.total} rows")
+    print(f"speed-up (openpyxl): {legacy_s / openpyxl_s:.1f}x")
+    if calamine_s:
+        print(f"speed-up (calamine): {legacy_s / calamine_s:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
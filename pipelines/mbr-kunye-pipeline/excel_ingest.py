@@ -0,0 +1,149 @@
+"""
+Shared Excel ingestion for the batch endpoints.
+
+The endpoints used to load every column of the workbook, walk it with
+df.iterrows() and convert IDs cell by cell. read_sheet() reads only the
+columns it is asked for (usecols), normalizes the ID column in one vectorized
+pass (trimming, dropping blanks and the ".0" that float-typed GNO columns
+get), drops duplicate IDs and returns small SheetRow records.
+
+Columns are given as header names ("GNO", "Yayın Adı", matched
+case-insensitively) or as Excel letters ("A", "AB"); a header that matches
+the spec wins, so short headers such as "ID" or "No" are not read as
+letters. The calamine engine is used when python-calamine is installed and
+pandas supports it, which is much faster than openpyxl on large sheets.
+"""
+import re
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Dict, List, Optional, Sequence, Union
+
+import pandas as pd
+
+try:
+    import python_calamine  # noqa: F401
+    CALAMINE_AVAILABLE = tuple(int(part) for part in pd.__version__.split(".")[:2]) >= (2, 2)
+except ImportError:
+    CALAMINE_AVAILABLE = False
+
+ExcelSource = Union[bytes, str]
+
+# Integral numbers read from float-typed columns: '12345.0' -> '12345'
+INTEGRAL_FLOAT = re.compile(r"^(\d+)\.0+$")
+
+
+@dataclass
+class SheetRow:
+    index: int  # 0-based data row; the Excel row number is index + 2 (row 1 is the header)
+    id: str
+    values: Dict[str, Optional[str]]  # Extra columns, keyed by the spec they were requested with
+
+
+@dataclass
+class Sheet:
+    rows: List[SheetRow]
+    total: int  # Data rows in the sheet, including rows without an ID
+    duplicates: int  # Rows dropped because their ID appeared earlier
+
+
+def column_index(column: str) -> Optional[int]:
+    """0-based index of an Excel column letter ("A" -> 0, "AB" -> 27); None if it is not one."""
+    column = column.strip().upper()
+    if not (1 <= len(column) <= 2 and column.isascii() and column.isalpha()):
+        return None
+    index = 0
+    for char in column:
+        index = index * 26 + ord(char) - ord("A") + 1
+    return index - 1
+
+
+def normalize_cells(series: pd.Series) -> pd.Series:
+    """
+    Cells as trimmed strings, blanks as NA, and without the '.0' integral
+    numbers get in float-typed columns (GNO 12345.0 -> '12345').
+    """
+    cells = series.astype("string").str.strip()
+    cells = cells.str.replace(INTEGRAL_FLOAT.pattern, r"\1", regex=True)
+    return cells.mask(cells == "")
+
+
+def normalize_id(value) -> Optional[str]:
+    """normalize_cells() for a single cell (None for blanks), without building a Series."""
+    if value is None:
+        return None
+    text = INTEGRAL_FLOAT.sub(r"\1", str(value).strip())
+    return text or None
+
+
+def read_excel(source: ExcelSource, **kwargs) -> pd.DataFrame:
+    """pd.read_excel on bytes or a path, with the fastest available engine (.csv paths go to pd.read_csv)."""
+    if isinstance(source, str) and source.lower().endswith(".csv"):
+        return pd.read_csv(source, **kwargs)
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    if CALAMINE_AVAILABLE:
+        kwargs.setdefault("engine", "calamine")
+    return pd.read_excel(source, **kwargs)
+
+
+def read_sheet(
+    source: ExcelSource,
+    id_column: str,
+    extra_columns: Sequence[str] = (),
+    optional_columns: Sequence[str] = (),
+    dedupe: bool = True,
+) -> Sheet:
+    """
+    Reads the ID column plus extra columns of the first sheet.
+
+    Rows without an ID are skipped; with dedupe only the first row of each ID
+    is kept. Columns in optional_columns come back as None when the sheet
+    does not have them.
+
+    Raises:
+        ValueError: if the ID column or one of extra_columns does not exist
+    """
+    specs = [id_column, *extra_columns, *optional_columns]
+
+    # Read just the header row: an exact header match comes before the letter reading
+    header = [str(name).strip().lower() for name in read_excel(source, nrows=0).columns]
+    positions: Dict[str, Optional[int]] = {}
+    for spec in specs:
+        if spec.strip().lower() in header:
+            positions[spec] = header.index(spec.strip().lower())
+        else:
+            position = column_index(spec)
+            positions[spec] = position if position is not None and position < len(header) else None
+
+    for spec in [id_column, *extra_columns]:
+        if positions[spec] is None:
+            raise ValueError(f"Kolon {spec} Excel dosyasında bulunamadı.")
+
+    usecols = sorted({position for position in positions.values() if position is not None})
+    try:
+        df = read_excel(source, usecols=usecols, dtype=object)
+    except ValueError as e:
+        # usecols beyond the last column of the sheet
+        raise ValueError(f"Kolon {id_column} Excel dosyasında bulunamadı. ({e})")
+    columns = {position: df.iloc[:, i] for i, position in enumerate(usecols)}
+
+    ids = normalize_cells(columns[positions[id_column]])
+    keep = ids.notna()
+    with_id = int(keep.sum())
+    if dedupe:
+        keep &= ~ids.duplicated()
+
+    kept_ids = ids[keep]
+    values = {}
+    for spec in [*extra_columns, *optional_columns]:
+        if positions[spec] is None:
+            values[spec] = [None] * len(kept_ids)
+        else:
+            cells = normalize_cells(columns[positions[spec]])[keep]
+            values[spec] = cells.astype(object).where(cells.notna(), None).tolist()
+
+    rows = [
+        SheetRow(index=index, id=row_id, values={spec: column[i] for spec, column in values.items()})
+        for i, (index, row_id) in enumerate(zip(kept_ids.index.tolist(), kept_ids.tolist()))
+    ]
+    return Sheet(rows=rows, total=len(df), duplicates=with_id - len(rows))
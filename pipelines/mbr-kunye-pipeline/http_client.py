@@ -0,0 +1,110 @@
+"""
+Shared async HTTP client used by image_cache for clip image downloads.
+
+One httpx.AsyncClient is reused by every batch endpoint of the service, so
+connections to imgsrv.medyatakip.com are kept alive (and multiplexed over
+HTTP/2 when the h2 package is installed and the server supports it) instead of
+paying a TCP+TLS handshake per clip. Each host gets its own concurrency limit,
+and 5xx responses, timeouts and connection errors are retried with
+exponential backoff. fetch() returns the raw response; verify_image()
+checks that its body is an image.
+"""
+import os
+import random
+import asyncio
+from io import BytesIO
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from PIL import Image
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "64"))
+HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", "16"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+# First retry waits about this long (seconds); each further retry doubles it
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_client: Optional[httpx.AsyncClient] = None
+_host_limits: Dict[str, asyncio.Semaphore] = {}
+
+
+def get_client() -> httpx.AsyncClient:
+    """Returns the process-wide client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            headers=DEFAULT_HEADERS,
+            timeout=HTTP_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _host_limit(url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).netloc
+    if host not in _host_limits:
+        _host_limits[host] = asyncio.Semaphore(HTTP_MAX_PER_HOST)
+    return _host_limits[host]
+
+
+async def fetch(url: str, **kwargs) -> httpx.Response:
+    """
+    GETs a URL through the shared client, retrying 5xx responses, timeouts and
+    connection errors. Returns the last response (which may still be a 5xx).
+
+    Raises:
+        httpx.TransportError: if the last attempt failed without a response
+    """
+    client = get_client()
+    async with _host_limit(url):
+        for attempt in range(HTTP_RETRIES + 1):
+            try:
+                response = await client.get(url, **kwargs)
+                if response.status_code < 500 or attempt == HTTP_RETRIES:
+                    return response
+                reason = f"HTTP {response.status_code}"
+            except httpx.TransportError as e:  # Includes timeouts
+                if attempt == HTTP_RETRIES:
+                    raise
+                reason = type(e).__name__
+
+            delay = HTTP_BACKOFF_BASE * (2 ** attempt) * (1 + random.random())
+            print(f"[WARNING] GET {url} failed ({reason}), retry {attempt + 1}/{HTTP_RETRIES} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+def verify_image(response: httpx.Response) -> Optional[bytes]:
+    """Returns the response body if it is an image, otherwise None."""
+    try:
+        img = Image.open(BytesIO(response.content))
+        img.verify()
+    except Exception as e:
+        print(f"[WARNING] Image verification failed: {e}")
+        if 'image' not in response.headers.get('content-type', ''):
+            return None
+    return response.content
+
@@ -0,0 +1,462 @@
+"""
+Persistent store for OpenAI Batch API jobs.
+
+The hybrid endpoint submits a batch and returns; status and results are
+fetched later, possibly after a restart or by another uvicorn worker. Batch
+metadata and the OCR results needed to map answers back to rows are kept in a
+SQLite file (WAL mode, so several processes can read while one writes) on a
+mounted volume. Once a batch finishes, the background poller (batch_poller.py)
+stores its parsed answers here too, and results are served from this table.
+
+Large sheets are split across several OpenAI batches ("shards"); the shards of
+one upload share a job_id, and the endpoints report status and results per job.
+
+The user's OpenAI API key is never written in plaintext: it is stored
+encrypted with JOB_STORE_SECRET. Without that secret the key is only kept in
+the memory of the process that submitted the batch, and after a restart (or
+on another worker) the status/results endpoints take it from the request.
+"""
+import os
+import json
+import time
+import base64
+import hashlib
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from cryptography.fernet import Fernet, InvalidToken
+
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "/data/jobs/mbr_kunye_jobs.sqlite3")
+# Secret the stored API keys are encrypted with; set it so polling survives restarts and works on every worker
+JOB_STORE_SECRET = os.getenv("JOB_STORE_SECRET", "")
+
+# OpenAI batch statuses after which nothing changes any more
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+def aggregate_status(statuses: List[str]) -> str:
+    """
+    Status of a job from the statuses of its shards: the common status while
+    they agree, in_progress while any shard is still running, and once all
+    have finished, completed if any shard produced results.
+    """
+    if len(set(statuses)) == 1:
+        return statuses[0]
+    if any(status not in TERMINAL_STATUSES for status in statuses):
+        return "in_progress"
+    if "completed" in statuses:
+        return "completed"
+    return next(status for status in statuses if status != "completed")
+
+
+class JobStore:
+    def __init__(self, path: str = JOB_STORE_PATH, secret: str = JOB_STORE_SECRET):
+        self.path = path
+        self._lock = threading.Lock()
+        # Any secret string works: the Fernet key is derived from its hash
+        self._fernet = Fernet(base64.urlsafe_b64encode(hashlib.sha256(secret.encode("utf-8")).digest())) if secret else None
+        self._api_keys: Dict[str, str] = {}  # batch_id -> API key, for this process only
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS batches (
+                batch_id TEXT PRIMARY KEY,
+                api_key_encrypted TEXT,
+                job_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                total_requests INTEGER NOT NULL DEFAULT 0,
+                completed_requests INTEGER NOT NULL DEFAULT 0,
+                failed_requests INTEGER NOT NULL DEFAULT 0,
+                completed_at INTEGER,
+                output_file_id TEXT,
+                error_file_id TEXT,
+                results_ingested INTEGER NOT NULL DEFAULT 0,
+                last_polled_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_batches_created_at ON batches(created_at);
+            CREATE INDEX IF NOT EXISTS idx_batches_job_id ON batches(job_id);
+
+            CREATE TABLE IF NOT EXISTS batch_ocr_results (
+                batch_id TEXT NOT NULL,
+                custom_id TEXT NOT NULL,
+                clip_id TEXT NOT NULL,
+                row INTEGER NOT NULL,
+                ocr_text TEXT,
+                error TEXT,
+                PRIMARY KEY (batch_id, custom_id)
+            );
+
+            CREATE TABLE IF NOT EXISTS batch_results (
+                batch_id TEXT NOT NULL,
+                custom_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                data TEXT,
+                error TEXT,
+                PRIMARY KEY (batch_id, custom_id)
+            );
+
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                submitting INTEGER NOT NULL,
+                created_at INTEGER NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    def _encrypt_api_key(self, api_key: str) -> Optional[str]:
+        return self._fernet.encrypt(api_key.encode("utf-8")).decode("ascii") if self._fernet else None
+
+    def _api_key(self, batch_id: str, encrypted: Optional[str]) -> Optional[str]:
+        """API key of a batch, or None if it is neither in memory nor decryptable (secret unset or changed)."""
+        if batch_id in self._api_keys:
+            return self._api_keys[batch_id]
+        if not encrypted or self._fernet is None:
+            return None
+        try:
+            return self._fernet.decrypt(encrypted.encode("ascii")).decode("utf-8")
+        except InvalidToken:
+            return None
+
+    def remember_api_key(self, batch_id: str, api_key: str):
+        """Keeps a key sent with a request for a batch whose stored key is not available."""
+        self._api_keys[batch_id] = api_key
+
+    def open_job(self, job_id: str):
+        """Marks a job whose shards are still being submitted; it cannot complete until closed."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, submitting, created_at) VALUES (?, 1, ?)",
+                (job_id, int(time.time())),
+            )
+            self._conn.commit()
+
+    def close_job(self, job_id: str):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET submitting = 0 WHERE job_id = ?", (job_id,))
+            self._conn.commit()
+
+    def create_batch(
+        self,
+        batch_id: str,
+        openai_api_key: str,
+        ocr_results: List[Dict[str, Any]],
+        status: str,
+        created_at: Optional[int] = None,
+        job_id: Optional[str] = None,
+    ):
+        self._api_keys[batch_id] = openai_api_key
+        encrypted = self._encrypt_api_key(openai_api_key)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO batches (batch_id, api_key_encrypted, status, created_at, updated_at, job_id) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (batch_id, encrypted, status, created_at or int(time.time()), time.time(), job_id or batch_id),
+            )
+            self._insert_ocr_results(batch_id, ocr_results)
+            self._conn.commit()
+
+    def _insert_ocr_results(self, batch_id: str, ocr_results: List[Dict[str, Any]]):
+        """Caller must hold the lock and commit."""
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO batch_ocr_results (batch_id, custom_id, clip_id, row, ocr_text, error) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (batch_id, r["custom_id"], r["clip_id"], r["row"], r.get("ocr_text"), r.get("error"))
+                for r in ocr_results
+            ],
+        )
+
+    def add_ocr_results(self, batch_id: str, ocr_results: List[Dict[str, Any]]):
+        with self._lock:
+            self._insert_ocr_results(batch_id, ocr_results)
+            self._conn.commit()
+
+    def get_batch(self, batch_id: str, include_ocr_results: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Returns the batch with its OCR results, in the same shape the endpoints
+        used to keep in memory, or None if the batch is unknown.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT batch_id, api_key_encrypted, status, created_at, total_requests, completed_requests, "
+                "failed_requests, completed_at, results_ingested, last_polled_at FROM batches WHERE batch_id = ?",
+                (batch_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            ocr_rows = self._conn.execute(
+                "SELECT custom_id, clip_id, row, ocr_text, error FROM batch_ocr_results "
+                "WHERE batch_id = ? ORDER BY row",
+                (batch_id,),
+            ).fetchall() if include_ocr_results else []
+        return {
+            "batch_id": row[0],
+            "openai_api_key": self._api_key(row[0], row[1]),
+            "status": row[2],
+            "created_at": row[3],
+            "total_requests": row[4],
+            "completed_requests": row[5],
+            "failed_requests": row[6],
+            "completed_at": row[7],
+            "results_ingested": bool(row[8]),
+            "last_polled_at": row[9],
+            "ocr_results": [
+                {"custom_id": r[0], "clip_id": r[1], "row": r[2], "ocr_text": r[3], "error": r[4]}
+                for r in ocr_rows
+            ],
+        }
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns a job with totals over its shards and the state of each shard,
+        or None if the job is unknown.
+        """
+        with self._lock:
+            job = self._conn.execute(
+                "SELECT submitting, created_at FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            rows = self._conn.execute(
+                "SELECT batch_id, api_key_encrypted, status, created_at, total_requests, completed_requests, "
+                "failed_requests, completed_at, results_ingested, last_polled_at FROM batches "
+                "WHERE job_id = ? ORDER BY created_at, batch_id",
+                (job_id,),
+            ).fetchall()
+        submitting = bool(job and job[0])
+        if not rows:
+            if not submitting:
+                return None
+            # OCR still running, no shard submitted yet
+            return {
+                "job_id": job_id,
+                "status": "in_progress",
+                "created_at": job[1],
+                "completed_at": None,
+                "total_requests": 0,
+                "completed_requests": 0,
+                "failed_requests": 0,
+                "results_ingested": False,
+                "submitting": True,
+                "shards": [],
+            }
+        shards = [
+            {
+                "batch_id": r[0],
+                "openai_api_key": self._api_key(r[0], r[1]),
+                "status": r[2],
+                "created_at": r[3],
+                "total_requests": r[4],
+                "completed_requests": r[5],
+                "failed_requests": r[6],
+                "completed_at": r[7],
+                "results_ingested": bool(r[8]),
+                "last_polled_at": r[9],
+            }
+            for r in rows
+        ]
+        completed_at = [shard["completed_at"] for shard in shards]
+        status = aggregate_status([shard["status"] for shard in shards])
+        return {
+            "job_id": job_id,
+            # More shards may still follow while OCR is running
+            "status": "in_progress" if submitting and status in TERMINAL_STATUSES else status,
+            "created_at": min(shard["created_at"] for shard in shards),
+            "completed_at": None if submitting or None in completed_at else max(completed_at),
+            "total_requests": sum(shard["total_requests"] for shard in shards),
+            "completed_requests": sum(shard["completed_requests"] for shard in shards),
+            "failed_requests": sum(shard["failed_requests"] for shard in shards),
+            "results_ingested": all(shard["results_ingested"] for shard in shards),
+            "submitting": submitting,
+            "shards": shards,
+        }
+
+    def update_status(self, batch_id: str, status: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE batches SET status = ?, updated_at = ? WHERE batch_id = ?",
+                (status, time.time(), batch_id),
+            )
+            self._conn.commit()
+
+    def update_progress(self, batch_id: str, batch):
+        """Stores what client.batches.retrieve() reported for a batch."""
+        counts = batch.request_counts
+        with self._lock:
+            self._conn.execute(
+                "UPDATE batches SET status = ?, total_requests = ?, completed_requests = ?, failed_requests = ?, "
+                "completed_at = ?, output_file_id = ?, error_file_id = ?, last_polled_at = ?, updated_at = ? "
+                "WHERE batch_id = ?",
+                (
+                    batch.status,
+                    counts.total if counts else 0,
+                    counts.completed if counts else 0,
+                    counts.failed if counts else 0,
+                    batch.completed_at,
+                    batch.output_file_id,
+                    batch.error_file_id,
+                    time.time(),
+                    time.time(),
+                    batch_id,
+                ),
+            )
+            self._conn.commit()
+
+    def set_request_counts(self, batch_id: str, total: int, completed: int, failed: int):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE batches SET total_requests = ?, completed_requests = ?, failed_requests = ?, updated_at = ? "
+                "WHERE batch_id = ?",
+                (total, completed, failed, time.time(), batch_id),
+            )
+            self._conn.commit()
+
+    def batches_to_poll(self) -> List[Dict[str, Any]]:
+        """Batches that are still running, or finished but whose results are not stored yet."""
+        placeholders = ", ".join("?" for _ in TERMINAL_STATUSES)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT batch_id, api_key_encrypted, status, output_file_id, error_file_id FROM batches "
+                f"WHERE status NOT IN ({placeholders}) OR results_ingested = 0 ORDER BY created_at",
+                TERMINAL_STATUSES,
+            ).fetchall()
+        return [
+            {"batch_id": r[0], "openai_api_key": self._api_key(r[0], r[1]), "status": r[2], "output_file_id": r[3], "error_file_id": r[4]}
+            for r in rows
+        ]
+
+    def add_results(self, batch_id: str, results: List[Tuple[str, str, Optional[str], Optional[str]]]):
+        """Stores parsed (custom_id, status, data_json, error) rows of a batch."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO batch_results (batch_id, custom_id, status, data, error) VALUES (?, ?, ?, ?, ?)",
+                [(batch_id, *result) for result in results],
+            )
+            self._conn.commit()
+
+    def fail_unanswered(self, batch_id: str, error: str) -> int:
+        """
+        Stores a failed result for every request of the batch that has no
+        result (expired, cancelled or never submitted); returns how many.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO batch_results (batch_id, custom_id, status, data, error) "
+                "SELECT o.batch_id, o.custom_id, 'failed', NULL, ? FROM batch_ocr_results o "
+                "WHERE o.batch_id = ? AND o.ocr_text IS NOT NULL AND o.error IS NULL AND NOT EXISTS ("
+                "SELECT 1 FROM batch_results r WHERE r.batch_id = o.batch_id AND r.custom_id = o.custom_id)",
+                (error, batch_id),
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def mark_ingested(self, batch_id: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE batches SET results_ingested = 1, updated_at = ? WHERE batch_id = ?",
+                (time.time(), batch_id),
+            )
+            self._conn.commit()
+
+    def get_results(self, job_id: str, offset: int = 0, limit: int = 500) -> Dict[str, Any]:
+        """
+        Returns one page of stored results over all shards of a job (ordered by
+        Excel row) plus the success/failure counts over the whole job.
+        """
+        with self._lock:
+            counts = dict(self._conn.execute(
+                "SELECT r.status, COUNT(*) FROM batch_results r JOIN batches b ON b.batch_id = r.batch_id "
+                "WHERE b.job_id = ? GROUP BY r.status",
+                (job_id,),
+            ).fetchall())
+            rows = self._conn.execute(
+                "SELECT r.custom_id, o.clip_id, o.row, o.ocr_text, r.status, r.data, r.error "
+                "FROM batch_results r JOIN batches b ON b.batch_id = r.batch_id "
+                "LEFT JOIN batch_ocr_results o ON o.batch_id = r.batch_id AND o.custom_id = r.custom_id "
+                "WHERE b.job_id = ? ORDER BY o.row, r.custom_id LIMIT ? OFFSET ?",
+                (job_id, limit, offset),
+            ).fetchall()
+        return {
+            "successful": counts.get("success", 0),
+            "failed": counts.get("failed", 0),
+            "results": [
+                {
+                    "custom_id": r[0],
+                    "clip_id": r[1],
+                    "row": r[2],
+                    "raw_ocr_text": r[3],
+                    "status": r[4],
+                    "data": json.loads(r[5]) if r[5] else None,
+                    "error": r[6],
+                }
+                for r in rows
+            ],
+        }
+
+    def try_acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """
+        Takes (or renews) a named lease for `ttl` seconds; False while another
+        holder's lease has not expired. Lets one of several workers run the poller.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO leases (name, holder, expires_at) VALUES (?, ?, ?)",
+                (name, holder, now + ttl),
+            )
+            cursor = self._conn.execute(
+                "UPDATE leases SET holder = ?, expires_at = ? WHERE name = ? AND (holder = ? OR expires_at < ?)",
+                (holder, now + ttl, name, holder, now),
+            )
+            self._conn.commit()
+            return cursor.rowcount == 1
+
+    def list_batches(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent jobs first, without their OCR results or API keys."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT b.job_id, GROUP_CONCAT(b.status, ','), MIN(b.created_at), COUNT(*), "
+                "(SELECT COUNT(*) FROM batch_ocr_results o JOIN batches s ON s.batch_id = o.batch_id "
+                "WHERE s.job_id = b.job_id) "
+                "FROM batches b GROUP BY b.job_id ORDER BY MIN(b.created_at) DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [
+            {
+                "batch_id": r[0],
+                "status": aggregate_status(r[1].split(",")),
+                "created_at": r[2],
+                "shards": r[3],
+                "rows": r[4],
+            }
+            for r in rows
+        ]
+
+
+def create_job_store() -> Optional[JobStore]:
+    """
+    Returns the job store, or None when its database cannot be opened (the
+    batch endpoints then answer 503 and the poller does not run).
+    """
+    try:
+        store = JobStore()
+    except Exception as e:
+        print(f"[ERROR] Error opening job store at {JOB_STORE_PATH}: {e}")
+        return None
+    if not JOB_STORE_SECRET:
+        print("[WARNING] JOB_STORE_SECRET is not set: API keys of batches are only kept in memory")
+    return store
+
+
+job_store = create_job_store()
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
@@ -7,11 +7,20 @@ import requests
 import openai
 import os
 import json
-from io import BytesIO
-import pandas as pd
-from PIL import Image
-import time
 import asyncio
+from dataclasses import dataclass
+from http_client import close_client
+from image_cache import RunCacheStats, download_clip_image, image_cache
+from rate_limiter import create_chat_completion
+from job_store import job_store
+from run_store import new_lease_owner, new_run_id, run_store
+from excel_ingest import read_sheet
+from batch_poller import batch_poller
+from batch_submit import RollingSubmitter, new_job_id
+from pipeline import (
+    PIPELINE_DOWNLOAD_WORKERS, PIPELINE_EXTRACT_WORKERS, PIPELINE_OCR_WORKERS,
+    RowFailed, Stage, run_pipeline,
+)
 
 app = FastAPI(title="MTM MBR Künye Pipeline", version="1.0.0")
 
@@ -50,6 +59,8 @@ class BatchProcessingSummary(BaseModel):
     successful: int
     failed: int
     results: List[BatchKunyeResult]
+    offset: int = 0
+    has_more: bool = False
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
@@ -61,9 +72,30 @@ async def global_exception_handler(request: Request, exc: Exception):
         content={"detail": f"Global Server Error: {str(exc)}"},
     )
 
+@app.on_event("startup")
+async def prune_run_store():
+    if run_store is None:
+        return
+    pruned = await asyncio.to_thread(run_store.prune)
+    if pruned:
+        print(f"[DEBUG] Pruned {pruned} old runs from the run store")
+
+@app.on_event("startup")
+async def start_batch_poller():
+    batch_poller.start()
+
+@app.on_event("shutdown")
+async def shutdown_http_client():
+    await batch_poller.stop()
+    await close_client()
+
 @app.get("/")
 async def root():
-    return {"status": "running", "service": "mbr-kunye-pipeline"}
+    return {
+        "status": "running",
+        "service": "mbr-kunye-pipeline",
+        "image_cache": image_cache.stats() if image_cache else {"enabled": False},
+    }
 
 app.add_middleware(
     CORSMiddleware,
@@ -82,6 +114,7 @@ class BatchJobStatus(BaseModel):
     failed_requests: int
     created_at: Optional[int] = None
     completed_at: Optional[int] = None
+    shards: List[Dict[str, Any]] = []  # One entry per OpenAI batch of the job
 
 class BatchSubmissionResponse(BaseModel):
     batch_id: str
@@ -89,9 +122,6 @@ class BatchSubmissionResponse(BaseModel):
     message: str
     ocr_results: List[Dict[str, Any]]  # OCR results for reference
 
-# In-memory storage for batch tracking (production should use DB)
-active_batches = {}
-
 def create_kunye_prompt(ocr_text: str) -> str:
     return f"""Sen gazete ve dergi künyeleri konusunda uzman bir yapay zekasın.
 Aşağıdaki OCR metni bir yayının künye bilgisini içermektedir. Metin İngilizce veya bozuk olabilir, sen Türkçe olarak yanıtla.
@@ -146,183 +176,199 @@ Eğer künyeden çıkarılabilecek başka önemli bilgiler varsa (baskı tesisi,
 }}
 """
 
-def download_image(image_url: str) -> Optional[bytes]:
-    try:
-        print(f"[DEBUG] Downloading image from: {image_url}")
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+def create_batch_request(ocr_result: Dict[str, Any]) -> Dict[str, Any]:
+    """One /v1/chat/completions line of a Batch API input file."""
+    return {
+        "custom_id": ocr_result["custom_id"],
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": "gpt-4o-mini",
+            "messages": [
+                {"role": "system", "content": "Sen yapılandırılmış veri çıkarımı yapan bir asistansın. Sadece geçerli JSON döndür."},
+                {"role": "user", "content": create_kunye_prompt(ocr_result["ocr_text"])}
+            ],
+            "temperature": 0.1,
+            "max_tokens": 2000,
+            "response_format": {"type": "json_object"}
         }
-        response = requests.get(image_url, headers=headers, timeout=30)
-        response.raise_for_status()
-        
-        # Verify it's an image
-        try:
-            img = Image.open(BytesIO(response.content))
-            img.verify()
-        except Exception as e:
-            print(f"[WARNING] Image verification failed: {e}")
-            if 'image' not in response.headers.get('content-type', ''):
-                return None
-        
-        return response.content
-    except Exception as e:
-        print(f"[ERROR] Error downloading image from {image_url}: {e}")
-        return None
+    }
 
-@app.post("/api/v1/pipelines/mbr-kunye-batch-stream")
-async def process_mbr_kunye_batch_stream(
-    file: UploadFile = File(...),
-    openai_api_key: Optional[str] = Form(None),
-    id_column: str = Form("A"),
+def parse_ocr_text(ocr_data: Any) -> str:
+    """Pulls the text out of a DeepSeek OCR service response."""
+    if isinstance(ocr_data, list) and len(ocr_data) > 0:
+        return ocr_data[0].get("text", "")
+    elif isinstance(ocr_data, dict):
+        return ocr_data.get("text", "")
+    return ""
+
+def ocr_image(clip_id: str, image_bytes: bytes) -> str:
+    """Sends one image to the DeepSeek OCR service and returns its text."""
+    ocr_files = {"files": (f"{clip_id}.jpg", image_bytes, "image/jpeg")}
+    ocr_response = requests.post(DEEPSEEK_OCR_URL, files=ocr_files, timeout=60)
+    if not ocr_response.ok:
+        raise Exception(f"OCR HTTP {ocr_response.status_code}")
+    return parse_ocr_text(ocr_response.json())
+
+async def extract_kunye(client: openai.OpenAI, ocr_text: str) -> KunyeResult:
+    """Extracts structured künye data from OCR text with OpenAI."""
+    response = await create_chat_completion(
+        client,
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "Sen yapılandırılmış veri çıkarımı yapan bir asistansın. Sadece geçerli JSON döndür."},
+            {"role": "user", "content": create_kunye_prompt(ocr_text)}
+        ],
+        temperature=0.1,
+        max_tokens=2000,
+        response_format={"type": "json_object"}
+    )
+    return KunyeResult(**json.loads(response.choices[0].message.content))
+
+@dataclass
+class KunyeJob:
+    """One Excel row travelling through the download -> OCR -> extract pipeline."""
+    index: int  # DataFrame index
+    clip_id: str
+    result: BatchKunyeResult
+    image_bytes: Optional[bytes] = None
+
+STEP_MESSAGES = {
+    "download": "Görsel indiriliyor...",
+    "ocr": "OCR işlemi yapılıyor...",
+    "ai": "Yapay zeka ile veri çıkarımı yapılıyor...",
+}
+
+STREAM_PIPELINE = "mbr-kunye-batch-stream"
+
+def require_run_store():
+    if run_store is None:
+        raise HTTPException(status_code=503, detail="Run deposu kullanılamıyor")
+
+def kunye_stream_response(
+    run_id: str,
+    contents: bytes,
+    id_column: str,
+    openai_api_key: str,
+    finished: Dict[int, Dict[str, Any]],
+    owner: Optional[str],
 ):
     """
-    Processes batch with Server-Sent Events for real-time progress updates
+    SSE response that processes the rows of an uploaded Excel file, skipping
+    rows in `finished`. Every finished row is checkpointed under `run_id`
+    (unless the run store is unavailable), and the run's lease held by
+    `owner` is released when the stream ends.
     """
     from fastapi.responses import StreamingResponse
     
-    # Validate API key
-    if not openai_api_key or not openai_api_key.strip():
-        raise HTTPException(
-            status_code=400,
-            detail="OpenAI API Key gerekli."
-        )
-    
+    client = openai.OpenAI(api_key=openai_api_key)
+    image_cache_stats = RunCacheStats()
+
+    async def download_stage(job: KunyeJob):
+        job.image_bytes = await download_clip_image(job.clip_id, image_cache_stats)
+        if not job.image_bytes:
+            raise RowFailed("Görsel indirilemedi")
+
+    async def ocr_stage(job: KunyeJob):
+        try:
+            ocr_text = await asyncio.to_thread(ocr_image, job.clip_id, job.image_bytes)
+        except Exception as e:
+            raise RowFailed(f"OCR Hatası: {str(e)}")
+        finally:
+            # The image is not needed after OCR; do not keep it while waiting for extraction
+            job.image_bytes = None
+
+        job.result.raw_ocr_text = ocr_text
+        if not ocr_text or len(ocr_text.strip()) < 10:
+            raise RowFailed("OCR metni yetersiz")
+
+    async def extract_stage(job: KunyeJob):
+        job.result.data = await extract_kunye(client, job.result.raw_ocr_text)
+
+    stages = [
+        Stage("download", download_stage, PIPELINE_DOWNLOAD_WORKERS),
+        Stage("ocr", ocr_stage, PIPELINE_OCR_WORKERS),
+        Stage("ai", extract_stage, PIPELINE_EXTRACT_WORKERS),
+    ]
+
+    # Results by Excel row, including rows finished before a resume
+    results_by_row = dict(finished)
+
+    async def checkpoint(job: KunyeJob):
+        results_by_row[job.result.row] = job.result.dict()
+        if run_store is not None:
+            await asyncio.to_thread(
+                run_store.save_row, run_id, job.result.row, job.clip_id, job.result.status, job.result.dict()
+            )
+
     async def event_generator():
-        results = []
-        total = 0
-        successful = 0
-        failed = 0
-        
         try:
-            # Read Excel file
-            contents = await file.read()
-            df = pd.read_excel(BytesIO(contents))
-            
-            # Get column index (A=0)
-            col_idx = 0
-            if id_column.isalpha():
-                col_idx = ord(id_column.upper()) - 65
-                
-            total = len(df)
-            
-            # Send initial status
-            yield f"data: {json.dumps({'type': 'init', 'total': total})}\n\n"
+            total = 0
             
-            for idx, row in df.iterrows():
-                # Get Clip ID
-                try:
-                    clip_id = str(row.iloc[col_idx]).strip()
-                    if pd.isna(row.iloc[col_idx]) or not clip_id:
-                        continue
-                except:
-                    continue
-                    
-                row_result = BatchKunyeResult(
-                    row=idx + 2,
-                    clip_id=clip_id,
-                    status="processing"
-                )
+            try:
+                # Read the clip ID column of the Excel file
+                sheet = await asyncio.to_thread(read_sheet, contents, id_column)
+                total = sheet.total
                 
-                try:
-                    # Step 1: Image URL
-                    yield f"data: {json.dumps({'type': 'progress', 'row': idx+1, 'total': total, 'clip_id': clip_id, 'step': 'url', 'message': 'Görsel URL oluşturuluyor...'})}\n\n"
-                    image_url = f"https://imgsrv.medyatakip.com/store/clip?gno={clip_id}"
-                    
-                    # Step 2: Download
-                    yield f"data: {json.dumps({'type': 'progress', 'row': idx+1, 'total': total, 'clip_id': clip_id, 'step': 'download', 'message': 'Görsel indiriliyor...'})}\n\n"
-                    image_bytes = download_image(image_url)
-                    if not image_bytes:
-                        row_result.status = "failed"
-                        row_result.error = "Görsel indirilemedi"
-                        failed += 1
-                        results.append(row_result)
-                        yield f"data: {json.dumps({'type': 'error', 'row': idx+1, 'total': total, 'clip_id': clip_id, 'message': 'Görsel indirilemedi'})}\n\n"
-                        continue
-                    
-                    # Step 3: OCR
-                    yield f"data: {json.dumps({'type': 'progress', 'row': idx+1, 'total': total, 'clip_id': clip_id, 'step': 'ocr', 'message': 'OCR işlemi yapılıyor...'})}\n\n"
-                    ocr_files = {"files": (f"{clip_id}.jpg", image_bytes, "image/jpeg")}
-                    
-                    try:
-                        ocr_response = requests.post(DEEPSEEK_OCR_URL, files=ocr_files, timeout=60)
-                        if not ocr_response.ok:
-                            raise Exception(f"OCR HTTP {ocr_response.status_code}")
-                    except Exception as e:
-                        row_result.status = "failed"
-                        row_result.error = f"OCR Hatası: {str(e)}"
-                        failed += 1
-                        results.append(row_result)
-                        yield f"data: {json.dumps({'type': 'error', 'row': idx+1, 'total': total, 'clip_id': clip_id, 'message': f'OCR Hatası: {str(e)}'})}\n\n"
-                        continue
-                    
-                    ocr_data = ocr_response.json()
-                    ocr_text = ""
-                    if isinstance(ocr_data, list) and len(ocr_data) > 0:
-                        ocr_text = ocr_data[0].get("text", "")
-                    elif isinstance(ocr_data, dict):
-                        ocr_text = ocr_data.get("text", "")
-                    
-                    if not ocr_text or len(ocr_text.strip()) < 10:
-                        row_result.status = "failed"
-                        row_result.error = "OCR metni yetersiz"
-                        row_result.raw_ocr_text = ocr_text
-                        failed += 1
-                        results.append(row_result)
-                        yield f"data: {json.dumps({'type': 'error', 'row': idx+1, 'total': total, 'clip_id': clip_id, 'message': 'OCR metni yetersiz'})}\n\n"
-                        continue
-                    
-                    row_result.raw_ocr_text = ocr_text
-                    
-                    # Step 4: OpenAI
-                    yield f"data: {json.dumps({'type': 'progress', 'row': idx+1, 'total': total, 'clip_id': clip_id, 'step': 'ai', 'message': 'Yapay zeka ile veri çıkarımı yapılıyor...'})}\n\n"
-                    client = openai.OpenAI(api_key=openai_api_key)
-                    prompt = create_kunye_prompt(ocr_text)
-                    
-                    response = client.chat.completions.create(
-                        model="gpt-4o-mini",
-                        messages=[
-                            {"role": "system", "content": "Sen yapılandırılmış veri çıkarımı yapan bir asistansın. Sadece geçerli JSON döndür."},
-                            {"role": "user", "content": prompt}
-                        ],
-                        temperature=0.1,
-                        max_tokens=2000,
-                        response_format={"type": "json_object"}
+                jobs = [
+                    KunyeJob(
+                        index=sheet_row.index,
+                        clip_id=sheet_row.id,
+                        result=BatchKunyeResult(row=sheet_row.index + 2, clip_id=sheet_row.id, status="processing")
                     )
-                    
-                    extracted_data = json.loads(response.choices[0].message.content)
-                    
-                    row_result.status = "success"
-                    row_result.data = KunyeResult(**extracted_data)
-                    successful += 1
-                    results.append(row_result)
-                    
-                    # Success notification
-                    yield f"data: {json.dumps({'type': 'success', 'row': idx+1, 'total': total, 'clip_id': clip_id, 'message': 'Başarıyla tamamlandı'})}\n\n"
-                    
-                    # Small delay for rate limiting
-                    await asyncio.sleep(0.3)
-                        
-                except Exception as e:
-                    print(f"[ERROR] Error processing {clip_id}: {e}")
-                    row_result.status = "failed"
-                    row_result.error = str(e)
-                    failed += 1
-                    results.append(row_result)
-                    yield f"data: {json.dumps({'type': 'error', 'row': idx+1, 'total': total, 'clip_id': clip_id, 'message': str(e)})}\n\n"
-            
-            # Send final summary
-            summary = {
-                'type': 'complete',
-                'total': total,
-                'processed': len(results),
-                'successful': successful,
-                'failed': failed,
-                'results': [r.dict() for r in results]
-            }
-            yield f"data: {json.dumps(summary)}\n\n"
+                    for sheet_row in sheet.rows
+                    if sheet_row.index + 2 not in finished
+                ]
+            except Exception as e:
+                yield f"data: {json.dumps({'type': 'error', 'message': f'Excel hatası: {str(e)}'})}\n\n"
+                return
+
+            # Send initial status (run_id is what the client needs to resume)
+            yield f"data: {json.dumps({'type': 'init', 'total': total, 'run_id': run_id, 'resumed': len(finished)})}\n\n"
+
+            try:
+                async for event in run_pipeline(jobs, stages):
+                    job = event.job
+                    base = {'row': job.index + 1, 'total': total, 'clip_id': job.clip_id}
+
+                    if event.type == "progress":
+                        yield f"data: {json.dumps({'type': 'progress', **base, 'step': event.stage, 'message': STEP_MESSAGES[event.stage]})}\n\n"
+                    elif event.type == "error":
+                        if not isinstance(event.error, RowFailed):
+                            print(f"[ERROR] Error processing {job.clip_id}: {event.error}")
+                        job.result.status = "failed"
+                        job.result.error = str(event.error)
+                        await checkpoint(job)
+                        yield f"data: {json.dumps({'type': 'error', **base, 'message': str(event.error)})}\n\n"
+                    else:
+                        job.result.status = "success"
+                        await checkpoint(job)
+                        yield f"data: {json.dumps({'type': 'success', **base, 'message': 'Başarıyla tamamlandı'})}\n\n"
                 
-        except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'message': f'Excel hatası: {str(e)}'})}\n\n"
+                # Send final summary, including rows finished before a resume
+                if run_store is not None:
+                    await asyncio.to_thread(run_store.set_status, run_id, "completed")
+                results = [results_by_row[row] for row in sorted(results_by_row)]
+                successful = sum(1 for r in results if r["status"] == "success")
+                summary = {
+                    'type': 'complete',
+                    'run_id': run_id,
+                    'total': total,
+                    'processed': len(results),
+                    'successful': successful,
+                    'failed': len(results) - successful,
+                    'image_cache': image_cache_stats.to_dict(),
+                    'results': results
+                }
+                yield f"data: {json.dumps(summary)}\n\n"
+                    
+            except Exception as e:
+                print(f"[ERROR] Pipeline error: {e}")
+                yield f"data: {json.dumps({'type': 'error', 'run_id': run_id, 'message': f'Hata: {str(e)}'})}\n\n"
+        finally:
+            if run_store is not None:
+                # Not awaited: the stream may be ending because the client was cancelled
+                asyncio.get_running_loop().run_in_executor(None, run_store.release_run, run_id, owner)
     
     return StreamingResponse(
         event_generator(),
@@ -333,6 +379,76 @@ async def process_mbr_kunye_batch_stream(
         }
     )
 
+@app.post("/api/v1/pipelines/mbr-kunye-batch-stream")
+async def process_mbr_kunye_batch_stream(
+    file: UploadFile = File(...),
+    openai_api_key: Optional[str] = Form(None),
+    id_column: str = Form("A"),
+    run_id: Optional[str] = Form(None),
+):
+    """
+    Processes batch with Server-Sent Events for real-time progress updates.
+    Rows go through download, OCR and extraction stages concurrently, so
+    events of different rows interleave. Finished rows are checkpointed under
+    a run ID (sent in the init event, or chosen by the client) so an
+    interrupted run can be resumed.
+    """
+    # Validate API key
+    if not openai_api_key or not openai_api_key.strip():
+        raise HTTPException(
+            status_code=400,
+            detail="OpenAI API Key gerekli."
+        )
+    
+    contents = await file.read()
+    run_id = run_id or new_run_id()
+    owner = new_lease_owner()
+    if run_store is not None:
+        created = await asyncio.to_thread(
+            run_store.create_run, run_id, STREAM_PIPELINE, contents, {"id_column": id_column}, owner
+        )
+        if not created:
+            raise HTTPException(status_code=409, detail="Bu run ID zaten kullanılmış. Devam etmek için resume kullanın.")
+    
+    return kunye_stream_response(run_id, contents, id_column, openai_api_key, {}, owner)
+
+@app.post("/api/v1/pipelines/mbr-kunye-batch-stream/{run_id}/resume")
+async def resume_mbr_kunye_batch_stream(
+    run_id: str,
+    openai_api_key: Optional[str] = Form(None),
+    retry_failed: bool = Form(False),
+):
+    """
+    Continues an interrupted stream run: rows that already have a checkpoint
+    are skipped (failed rows are processed again if retry_failed is set).
+    """
+    if not openai_api_key or not openai_api_key.strip():
+        raise HTTPException(status_code=400, detail="OpenAI API Key gerekli.")
+    
+    require_run_store()
+    
+    run = await asyncio.to_thread(run_store.get_run, run_id)
+    if run is None or run["pipeline"] != STREAM_PIPELINE:
+        raise HTTPException(status_code=404, detail="Run ID bulunamadı")
+    owner = new_lease_owner()
+    if not await asyncio.to_thread(run_store.claim_run, run_id, owner):
+        raise HTTPException(status_code=409, detail="Bu run hâlâ işleniyor")
+    
+    contents = await asyncio.to_thread(run_store.get_source, run_id)
+    finished = await asyncio.to_thread(run_store.finished_rows, run_id)
+    if retry_failed:
+        finished = {row: result for row, result in finished.items() if result["status"] == "success"}
+    
+    return kunye_stream_response(run_id, contents, run["settings"]["id_column"], openai_api_key, finished, owner)
+
+@app.get("/api/v1/pipelines/mbr-kunye-batch-stream/runs")
+async def list_stream_runs(limit: int = 50):
+    """
+    Lists recent stream runs (newest first) with their checkpointed row counts
+    """
+    require_run_store()
+    return await asyncio.to_thread(run_store.list_runs, STREAM_PIPELINE, limit)
+
 # Keep old endpoint for backward compatibility
 @app.post("/api/v1/pipelines/mbr-kunye-batch", response_model=BatchProcessingSummary)
 async def process_mbr_kunye_batch(
@@ -354,26 +470,14 @@ async def process_mbr_kunye_batch(
     failed = 0
     
     try:
-        # Read Excel file
+        # Read the clip ID column of the Excel file
         contents = await file.read()
-        df = pd.read_excel(BytesIO(contents))
-        
-        # Get column index (A=0)
-        col_idx = 0
-        if id_column.isalpha():
-            col_idx = ord(id_column.upper()) - 65
-            
-        total = len(df)
-        print(f"Processing {total} rows from Excel...")
+        sheet = await asyncio.to_thread(read_sheet, contents, id_column)
+        total = sheet.total
+        print(f"Processing {total} rows from Excel ({sheet.duplicates} duplicate clip IDs skipped)...")
         
-        for idx, row in df.iterrows():
-            # Get Clip ID
-            try:
-                clip_id = str(row.iloc[col_idx]).strip()
-                if pd.isna(row.iloc[col_idx]) or not clip_id:
-                    continue
-            except:
-                continue
+        for sheet_row in sheet.rows:
+            idx, clip_id = sheet_row.index, sheet_row.id
                 
             row_result = BatchKunyeResult(
                 row=idx + 2, # Excel is 1-indexed + header
@@ -382,11 +486,8 @@ async def process_mbr_kunye_batch(
             )
             
             try:
-                # 1. Construct Image URL
-                image_url = f"https://imgsrv.medyatakip.com/store/clip?gno={clip_id}"
-                
-                # 2. Download Image
-                image_bytes = download_image(image_url)
+                # 1-2. Download Image (or take it from the disk cache)
+                image_bytes = await download_clip_image(clip_id)
                 if not image_bytes:
                     row_result.status = "failed"
                     row_result.error = "Görsel indirilemedi"
@@ -409,12 +510,7 @@ async def process_mbr_kunye_batch(
                     results.append(row_result)
                     continue
                 
-                ocr_data = ocr_response.json()
-                ocr_text = ""
-                if isinstance(ocr_data, list) and len(ocr_data) > 0:
-                    ocr_text = ocr_data[0].get("text", "")
-                elif isinstance(ocr_data, dict):
-                    ocr_text = ocr_data.get("text", "")
+                ocr_text = parse_ocr_text(ocr_response.json())
                 
                 if not ocr_text or len(ocr_text.strip()) < 10:
                     row_result.status = "failed"
@@ -431,7 +527,8 @@ async def process_mbr_kunye_batch(
                 client = openai.OpenAI(api_key=openai_api_key)
                 prompt = create_kunye_prompt(ocr_text)
                 
-                response = client.chat.completions.create(
+                response = await create_chat_completion(
+                    client,
                     model="gpt-4o-mini",
                     messages=[
                         {"role": "system", "content": "Sen yapılandırılmış veri çıkarımı yapan bir asistansın. Sadece geçerli JSON döndür."},
@@ -450,10 +547,6 @@ async def process_mbr_kunye_batch(
                 results.append(row_result)
                 
                 print(f"[{idx+1}/{total}] ✓ Success")
-                
-                # Rate limit
-                if idx < total - 1:
-                    time.sleep(0.5)
                     
             except Exception as e:
                 print(f"[ERROR] Error processing {clip_id}: {e}")
@@ -483,47 +576,53 @@ async def process_mbr_kunye_batch_hybrid(
     id_column: str = Form("A"),
 ):
     """
-    Hybrid approach with SSE: OCR synchronously with live progress, then submit to OpenAI Batch API
-    Returns batch_id via SSE after OCR phase completes
+    Hybrid approach with SSE: OCR with live progress while successful rows are
+    submitted to the OpenAI Batch API in rolling shards.
+    Returns the job ID via SSE once OCR is done and every shard is submitted
     """
     from fastapi.responses import StreamingResponse
     
     if not openai_api_key or not openai_api_key.strip():
         raise HTTPException(status_code=400, detail="OpenAI API Key gerekli.")
+    require_job_store()
     
     async def event_generator():
         ocr_results = []
+        image_cache_stats = RunCacheStats()
+        client = openai.OpenAI(api_key=openai_api_key)
+        job_id = new_job_id()
+        submitter = RollingSubmitter(client, job_id)
+        await submitter.open()
+        
+        def record(ocr_result: Dict[str, Any]):
+            ocr_results.append(ocr_result)
+            if ocr_result["ocr_text"] and not ocr_result["error"]:
+                submitter.add(create_batch_request(ocr_result), ocr_result)
+            else:
+                submitter.add_unsubmitted(ocr_result)
         
         try:
             # Phase 1: Perform OCR (with SSE progress)
             contents = await file.read()
-            df = pd.read_excel(BytesIO(contents))
-            
-            col_idx = 0
-            if id_column.isalpha():
-                col_idx = ord(id_column.upper()) - 65
-                
-            total = len(df)
+            sheet = await asyncio.to_thread(read_sheet, contents, id_column)
+            total = sheet.total
             
             # Send init
-            yield f"data: {json.dumps({'type': 'init', 'phase': 'ocr', 'total': total})}\n\n"
+            yield f"data: {json.dumps({'type': 'init', 'phase': 'ocr', 'total': total, 'batch_id': job_id})}\n\n"
             
-            for idx, row in df.iterrows():
-                try:
-                    clip_id = str(row.iloc[col_idx]).strip()
-                    if pd.isna(row.iloc[col_idx]) or not clip_id:
-                        continue
-                except:
-                    continue
+            for sheet_row in sheet.rows:
+                idx, clip_id = sheet_row.index, sheet_row.id
+                for shard in submitter.submitted():
+                    shard_msg = f"Batch parçası gönderildi: {shard['batch_id']}"
+                    yield f"data: {json.dumps({'type': 'shard_submitted', 'phase': 'batch', 'shard': shard, 'message': shard_msg})}\n\n"
                     
                 try:
                     # Download
                     yield f"data: {json.dumps({'type': 'progress', 'phase': 'ocr', 'row': idx+1, 'total': total, 'clip_id': clip_id, 'step': 'download', 'message': 'Görsel indiriliyor...'})}\n\n"
-                    image_url = f"https://imgsrv.medyatakip.com/store/clip?gno={clip_id}"
-                    image_bytes = download_image(image_url)
+                    image_bytes = await download_clip_image(clip_id, image_cache_stats)
                     
                     if not image_bytes:
-                        ocr_results.append({
+                        record({
                             "custom_id": f"clip-{clip_id}",
                             "clip_id": clip_id,
                             "row": idx + 2,
@@ -536,10 +635,11 @@ async def process_mbr_kunye_batch_hybrid(
                     # OCR
                     yield f"data: {json.dumps({'type': 'progress', 'phase': 'ocr', 'row': idx+1, 'total': total, 'clip_id': clip_id, 'step': 'ocr', 'message': 'OCR işleniyor...'})}\n\n"
                     ocr_files = {"files": (f"{clip_id}.jpg", image_bytes, "image/jpeg")}
-                    ocr_response = requests.post(DEEPSEEK_OCR_URL, files=ocr_files, timeout=60)
+                    # Off the event loop, so shard uploads keep going during OCR
+                    ocr_response = await asyncio.to_thread(requests.post, DEEPSEEK_OCR_URL, files=ocr_files, timeout=60)
                     
                     if not ocr_response.ok:
-                        ocr_results.append({
+                        record({
                             "custom_id": f"clip-{clip_id}",
                             "clip_id": clip_id,
                             "row": idx + 2,
@@ -549,15 +649,10 @@ async def process_mbr_kunye_batch_hybrid(
                         yield f"data: {json.dumps({'type': 'error', 'phase': 'ocr', 'row': idx+1, 'total': total, 'clip_id': clip_id, 'message': f'OCR hatası'})}\n\n"
                         continue
                     
-                    ocr_data = ocr_response.json()
-                    ocr_text = ""
-                    if isinstance(ocr_data, list) and len(ocr_data) > 0:
-                        ocr_text = ocr_data[0].get("text", "")
-                    elif isinstance(ocr_data, dict):
-                        ocr_text = ocr_data.get("text", "")
+                    ocr_text = parse_ocr_text(ocr_response.json())
                     
                     if not ocr_text or len(ocr_text.strip()) < 10:
-                        ocr_results.append({
+                        record({
                             "custom_id": f"clip-{clip_id}",
                             "clip_id": clip_id,
                             "row": idx + 2,
@@ -567,7 +662,7 @@ async def process_mbr_kunye_batch_hybrid(
                         yield f"data: {json.dumps({'type': 'error', 'phase': 'ocr', 'row': idx+1, 'total': total, 'clip_id': clip_id, 'message': 'OCR metni yetersiz'})}\n\n"
                         continue
                     
-                    ocr_results.append({
+                    record({
                         "custom_id": f"clip-{clip_id}",
                         "clip_id": clip_id,
                         "row": idx + 2,
@@ -579,7 +674,7 @@ async def process_mbr_kunye_batch_hybrid(
                     
                 except Exception as e:
                     print(f"[ERROR] OCR failed for {clip_id}: {e}")
-                    ocr_results.append({
+                    record({
                         "custom_id": f"clip-{clip_id}",
                         "clip_id": clip_id,
                         "row": idx + 2,
@@ -588,76 +683,34 @@ async def process_mbr_kunye_batch_hybrid(
                     })
                     yield f"data: {json.dumps({'type': 'error', 'phase': 'ocr', 'row': idx+1, 'total': total, 'clip_id': clip_id, 'message': str(e)})}\n\n"
             
-            # Phase 2: Create Batch
-            yield f"data: {json.dumps({'type': 'progress', 'phase': 'batch', 'message': 'Batch dosyası hazırlanıyor...'})}\n\n"
+            # Phase 2: Submit the remaining requests and wait for every shard
+            msg1 = "Kalan istekler OpenAI'a gönderiliyor..."
+            yield f"data: {json.dumps({'type': 'progress', 'phase': 'batch', 'message': msg1})}\n\n"
             
             successful_ocr = [r for r in ocr_results if r["ocr_text"] and not r["error"]]
             
             if not successful_ocr:
+                await submitter.finish()
                 yield f"data: {json.dumps({'type': 'error', 'phase': 'batch', 'message': 'Hiçbir OCR başarılı olmadı'})}\n\n"
                 return
             
-            # Create JSONL for batch
-            batch_requests = []
-            for ocr_result in successful_ocr:
-                prompt = create_kunye_prompt(ocr_result["ocr_text"])
-                batch_requests.append({
-                    "custom_id": ocr_result["custom_id"],
-                    "method": "POST",
-                    "url": "/v1/chat/completions",
-                    "body": {
-                        "model": "gpt-4o-mini",
-                        "messages": [
-                            {"role": "system", "content": "Sen yapılandırılmış veri çıkarımı yapan bir asistansın. Sadece geçerli JSON döndür."},
-                            {"role": "user", "content": prompt}
-                        ],
-                        "temperature": 0.1,
-                        "max_tokens": 2000,
-                        "response_format": {"type": "json_object"}
-                    }
-                })
-            
-            # Write to temporary file
-            import tempfile
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.jsonl', delete=False, encoding='utf-8') as f:
-                for req in batch_requests:
-                    f.write(json.dumps(req, ensure_ascii=False) + '\n')
-                batch_file_path = f.name
-            
-            # Upload to OpenAI
-            msg1 = "OpenAI'a yükleniyor..."
-            yield f"data: {json.dumps({'type': 'progress', 'phase': 'batch', 'message': msg1})}\n\n"
-            client = openai.OpenAI(api_key=openai_api_key)
-            
-            with open(batch_file_path, 'rb') as f:
-                batch_input_file = client.files.create(file=f, purpose="batch")
-            
-            # Create batch job
-            msg2 = "Batch job oluşturuluyor..."
-            yield f"data: {json.dumps({'type': 'progress', 'phase': 'batch', 'message': msg2})}\n\n"
-            batch_job = client.batches.create(
-                input_file_id=batch_input_file.id,
-                endpoint="/v1/chat/completions",
-                completion_window="24h"
-            )
+            # Shards are persisted under one job ID, so status/results survive restarts
+            shards = await submitter.finish()
             
-            # Clean up temp file
-            os.unlink(batch_file_path)
-            
-            # Store batch info
-            active_batches[batch_job.id] = {
-                "batch_id": batch_job.id,
-                "openai_api_key": openai_api_key,
-                "ocr_results": ocr_results,
-                "created_at": batch_job.created_at,
-                "status": batch_job.status
-            }
+            if all(shard["error"] for shard in shards):
+                error_msg = f"Batch gönderilemedi: {shards[0]['error']}"
+                yield f"data: {json.dumps({'type': 'error', 'phase': 'batch', 'message': error_msg})}\n\n"
+                return
             
             # Send completion
-            yield f"data: {json.dumps({'type': 'batch_submitted', 'batch_id': batch_job.id, 'status': batch_job.status, 'ocr_successful': len(successful_ocr), 'message': f'Batch gönderildi! ID: {batch_job.id}'})}\n\n"
+            job_info = await asyncio.to_thread(job_store.get_job, job_id)
+            yield f"data: {json.dumps({'type': 'batch_submitted', 'batch_id': job_id, 'batch_ids': [shard['batch_id'] for shard in shards], 'shards': shards, 'status': job_info['status'], 'ocr_successful': len(successful_ocr), 'image_cache': image_cache_stats.to_dict(), 'message': f'Batch gönderildi! ID: {job_id}'})}\n\n"
                 
         except Exception as e:
             yield f"data: {json.dumps({'type': 'error', 'message': f'Hata: {str(e)}'})}\n\n"
+        finally:
+            # Error or client disconnect: requests OCR'd so far are still submitted and the job is closed
+            submitter.finish_in_background()
     
     return StreamingResponse(
         event_generator(),
@@ -668,107 +721,130 @@ async def process_mbr_kunye_batch_hybrid(
         }
     )
 
+def require_job_store():
+    if job_store is None:
+        raise HTTPException(status_code=503, detail="Batch iş deposu kullanılamıyor")
+
+@app.get("/api/v1/pipelines/mbr-kunye-batches")
+async def list_batches(limit: int = 50):
+    """
+    Lists recently submitted batch jobs (newest first)
+    """
+    require_job_store()
+    return await asyncio.to_thread(job_store.list_batches, limit)
+
+async def refresh_job_shards(job_info: Dict[str, Any], shards: List[Dict[str, Any]], openai_api_key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Polls the given shards of a job right away and returns the updated job.
+    Shards whose stored key cannot be read use the key sent with the request;
+    shards without any key are left as they are.
+    """
+    polls = []
+    for shard in shards:
+        api_key = shard["openai_api_key"] or openai_api_key
+        if not api_key:
+            continue
+        if not shard["openai_api_key"]:
+            # Lets the background poller of this process follow the batch too
+            job_store.remember_api_key(shard["batch_id"], api_key)
+        polls.append(batch_poller.poll_batch(shard["batch_id"], api_key))
+    if not polls:
+        return job_info
+    await asyncio.gather(*polls)
+    return await asyncio.to_thread(job_store.get_job, job_info["job_id"])
+
+def public_shards(job_info: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {key: value for key, value in shard.items() if key != "openai_api_key"}
+        for shard in job_info["shards"]
+    ]
+
 @app.get("/api/v1/pipelines/mbr-kunye-batch-status/{batch_id}", response_model=BatchJobStatus)
-async def get_batch_status(batch_id: str):
+async def get_batch_status(batch_id: str, openai_api_key: Optional[str] = Header(None, alias="X-OpenAI-Api-Key")):
     """
-    Check the status of a batch job
+    Check the status of a batch job (as last seen by the background poller).
+    For jobs split into several OpenAI batches, counts are summed over the shards.
+    The X-OpenAI-Api-Key header is only needed when the server has no readable key for the job.
     """
-    if batch_id not in active_batches:
+    require_job_store()
+    job_info = await asyncio.to_thread(job_store.get_job, batch_id)
+    if job_info is None:
         raise HTTPException(status_code=404, detail="Batch ID bulunamadı")
     
-    batch_info = active_batches[batch_id]
-    openai_api_key = batch_info["openai_api_key"]
+    never_polled = [shard for shard in job_info["shards"] if shard["last_polled_at"] is None and not shard["results_ingested"]]
+    if never_polled:
+        # Not picked up by the poller yet; ask OpenAI once
+        try:
+            job_info = await refresh_job_shards(job_info, never_polled, openai_api_key)
+        except Exception as e:
+            print(f"[ERROR] Status check error: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
     
-    try:
-        client = openai.OpenAI(api_key=openai_api_key)
-        batch = client.batches.retrieve(batch_id)
-        
-        # Update local storage
-        active_batches[batch_id]["status"] = batch.status
-        
-        return BatchJobStatus(
-            batch_id=batch_id,
-            status=batch.status,
-            total_requests=batch.request_counts.total,
-            completed_requests=batch.request_counts.completed,
-            failed_requests=batch.request_counts.failed,
-            created_at=batch.created_at,
-            completed_at=batch.completed_at
-        )
-    except Exception as e:
-        print(f"[ERROR] Status check error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    return BatchJobStatus(
+        batch_id=batch_id,
+        status=job_info["status"],
+        total_requests=job_info["total_requests"],
+        completed_requests=job_info["completed_requests"],
+        failed_requests=job_info["failed_requests"],
+        created_at=job_info["created_at"],
+        completed_at=job_info["completed_at"],
+        shards=public_shards(job_info)
+    )
 
 @app.get("/api/v1/pipelines/mbr-kunye-batch-results/{batch_id}", response_model=BatchProcessingSummary)
-async def get_batch_results(batch_id: str):
+async def get_batch_results(
+    batch_id: str,
+    offset: int = 0,
+    limit: int = 500,
+    openai_api_key: Optional[str] = Header(None, alias="X-OpenAI-Api-Key"),
+):
     """
-    Retrieve results from a completed batch job
+    Retrieve merged results of all batches of a completed job, one page at a time (ordered by row)
+    The X-OpenAI-Api-Key header is only needed when the server has no readable key for the job.
     """
-    if batch_id not in active_batches:
+    require_job_store()
+    if offset < 0 or not 1 <= limit <= 5000:
+        raise HTTPException(status_code=400, detail="offset >= 0 ve 1 <= limit <= 5000 olmalı")
+    
+    job_info = await asyncio.to_thread(job_store.get_job, batch_id)
+    if job_info is None:
         raise HTTPException(status_code=404, detail="Batch ID bulunamadı")
     
-    batch_info = active_batches[batch_id]
-    openai_api_key = batch_info["openai_api_key"]
-    ocr_results_map = {r["custom_id"]: r for r in batch_info["ocr_results"]}
+    pending = [shard for shard in job_info["shards"] if not shard["results_ingested"]]
+    if not openai_api_key and any(not shard["openai_api_key"] for shard in pending):
+        raise HTTPException(status_code=400, detail="Bu batch için sunucuda API anahtarı yok; X-OpenAI-Api-Key başlığı gerekli.")
+    if pending:
+        # May have finished since the last poll: check now instead of waiting for the poller
+        try:
+            job_info = await refresh_job_shards(job_info, pending, openai_api_key)
+        except Exception as e:
+            print(f"[ERROR] Results retrieval error: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
     
-    try:
-        client = openai.OpenAI(api_key=openai_api_key)
-        batch = client.batches.retrieve(batch_id)
-        
-        if batch.status != "completed":
-            raise HTTPException(status_code=400, detail=f"Batch henüz tamamlanmadı. Durum: {batch.status}")
-        
-        # Download results
-        result_file_id = batch.output_file_id
-        file_response = client.files.content(result_file_id)
-        
-        # Parse results
-        results = []
-        successful = 0
-        failed = 0
-        
-        for line in file_response.text.split('\n'):
-            if not line.strip():
-                continue
-            
-            result_data = json.loads(line)
-            custom_id = result_data.get("custom_id")
-            ocr_info = ocr_results_map.get(custom_id, {})
-            
-            if result_data.get("error"):
-                results.append(BatchKunyeResult(
-                    row=ocr_info.get("row", 0),
-                    clip_id=ocr_info.get("clip_id", "unknown"),
-                    status="failed",
-                    error=str(result_data["error"]),
-                    raw_ocr_text=ocr_info.get("ocr_text")
-                ))
-                failed += 1
-            else:
-                response_body = result_data["response"]["body"]
-                extracted_text = response_body["choices"][0]["message"]["content"]
-                extracted_data = json.loads(extracted_text)
-                
-                results.append(BatchKunyeResult(
-                    row=ocr_info.get("row", 0),
-                    clip_id=ocr_info.get("clip_id", "unknown"),
-                    status="success",
-                    data=KunyeResult(**extracted_data),
-                    raw_ocr_text=ocr_info.get("ocr_text")
-                ))
-                successful += 1
-        
-        return BatchProcessingSummary(
-            total=batch.request_counts.total,
-            processed=batch.request_counts.completed + batch.request_counts.failed,
-            successful=successful,
-            failed=failed,
-            results=results
-        )
-        
-    except Exception as e:
-        print(f"[ERROR] Results retrieval error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    if job_info["status"] != "completed" or not job_info["results_ingested"]:
+        raise HTTPException(status_code=400, detail=f"Batch henüz tamamlanmadı. Durum: {job_info['status']}")
+    
+    stored = await asyncio.to_thread(job_store.get_results, batch_id, offset, limit)
+    results = []
+    for result in stored["results"]:
+        results.append(BatchKunyeResult(
+            row=result["row"] or 0,
+            clip_id=result["clip_id"] or "unknown",
+            status=result["status"],
+            data=KunyeResult(**result["data"]) if result["data"] else None,
+            raw_ocr_text=result["raw_ocr_text"],
+            error=result["error"]
+        ))
+    
+    return BatchProcessingSummary(
+        total=job_info["total_requests"],
+        processed=job_info["completed_requests"] + job_info["failed_requests"],
+        successful=stored["successful"],
+        failed=stored["failed"],
+        results=results,
+        offset=offset,
+        has_more=offset + len(results) < stored["successful"] + stored["failed"]
+    )
 
 if __name__ == "__main__":
     import uvicorn
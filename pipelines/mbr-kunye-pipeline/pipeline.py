@@ -0,0 +1,106 @@
+"""
+Staged producer/consumer pipeline for per-row batch jobs.
+
+Each stage (e.g. download -> OCR -> extract) has its own pool of workers and a
+bounded input queue, so stages overlap across rows: while row N is being
+extracted, row N+1 is in OCR and later rows are downloading. The bounded
+queues keep a slow stage from piling up downloaded images in memory.
+
+run_pipeline() yields an event whenever a row enters a stage, fails, or
+finishes the last stage; events arrive in completion order, not row order.
+"""
+import os
+import asyncio
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, List, Optional
+
+PIPELINE_DOWNLOAD_WORKERS = int(os.getenv("PIPELINE_DOWNLOAD_WORKERS", "8"))
+PIPELINE_OCR_WORKERS = int(os.getenv("PIPELINE_OCR_WORKERS", "4"))
+PIPELINE_EXTRACT_WORKERS = int(os.getenv("PIPELINE_EXTRACT_WORKERS", "4"))
+# Rows waiting between two stages
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "16"))
+
+
+class RowFailed(Exception):
+    """Raised by a stage handler to fail a row with a user-facing message."""
+
+
+@dataclass
+class Stage:
+    name: str
+    handler: Callable[[Any], Awaitable[None]]  # Updates the job in place; raises to fail the row
+    workers: int
+
+
+@dataclass
+class PipelineEvent:
+    type: str  # 'progress' (row entered stage), 'error' or 'success'
+    job: Any
+    stage: str
+    error: Optional[Exception] = None
+
+
+_DONE = object()
+
+
+async def run_pipeline(jobs: Iterable[Any], stages: List[Stage]) -> AsyncIterator[PipelineEvent]:
+    """
+    Pushes every job through the stages and yields events as they happen.
+    Closing the iterator early cancels all in-flight work.
+    """
+    queues = [asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE) for _ in stages]
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def feed():
+        for job in jobs:
+            await queues[0].put(job)
+        for _ in range(stages[0].workers):
+            await queues[0].put(_DONE)
+
+    async def worker(position: int, stage: Stage):
+        is_last = position == len(stages) - 1
+        while True:
+            job = await queues[position].get()
+            if job is _DONE:
+                return
+            await events.put(PipelineEvent("progress", job, stage.name))
+            try:
+                await stage.handler(job)
+            except Exception as e:
+                await events.put(PipelineEvent("error", job, stage.name, e))
+                continue
+            if is_last:
+                await events.put(PipelineEvent("success", job, stage.name))
+            else:
+                await queues[position + 1].put(job)
+
+    async def run_stage(position: int, stage: Stage):
+        await asyncio.gather(*(worker(position, stage) for _ in range(stage.workers)))
+        # Every worker of this stage is done, so the next stage gets no more rows
+        if position + 1 < len(stages):
+            for _ in range(stages[position + 1].workers):
+                await queues[position + 1].put(_DONE)
+
+    tasks = [asyncio.create_task(feed())]
+    tasks += [asyncio.create_task(run_stage(position, stage)) for position, stage in enumerate(stages)]
+    finished = asyncio.gather(*tasks)
+
+    def on_finished(future: asyncio.Future):
+        # Marks the outcome as seen, so an abandoned run (client went away) does not log a stray error
+        if not future.cancelled():
+            future.exception()
+        events.put_nowait(None)
+
+    finished.add_done_callback(on_finished)
+
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+        # Surfaces unexpected errors from the pipeline tasks themselves
+        await finished
+    finally:
+        for task in tasks:
+            task.cancel()
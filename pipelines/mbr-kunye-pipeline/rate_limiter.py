@@ -0,0 +1,184 @@
+"""
+Adaptive client-side rate limiting for OpenAI chat completions.
+
+Instead of sleeping a fixed time between rows, every chat.completions call
+goes through a token bucket per API key: one bucket for requests per minute,
+one for tokens per minute. The buckets start from OPENAI_RPM_LIMIT /
+OPENAI_TPM_LIMIT and are then kept in sync with OpenAI's x-ratelimit-*
+response headers, so throughput follows the account's real limits. A 429
+pauses every caller sharing the key for the time OpenAI asks for (or an
+exponential backoff) and the request is retried.
+"""
+import os
+import re
+import time
+import random
+import asyncio
+import hashlib
+from typing import Dict, Optional
+
+import openai
+
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "200000"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+# First backoff after a 429 without a usable retry hint (seconds); doubles per attempt
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "1.0"))
+
+# Rough characters-per-token ratio used to estimate a request before sending it
+CHARS_PER_TOKEN = 3
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parses OpenAI reset durations such as '1s', '6m0s', '120ms' or '0.5' into seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    parts = re.findall(r"([\d.]+)(ms|s|m|h)", value)
+    if not parts:
+        return None
+    for number, unit in parts:
+        total += float(number) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total
+
+
+def estimate_tokens(request_kwargs: dict) -> int:
+    """Prompt characters / CHARS_PER_TOKEN plus max_tokens, which OpenAI counts against the TPM limit."""
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in request_kwargs.get("messages", []))
+    return prompt_chars // CHARS_PER_TOKEN + int(request_kwargs.get("max_tokens") or 0)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        rate = self.capacity / 60
+        self.level = min(self.capacity, self.level + (now - self.updated) * rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` is available (requests larger than the bucket wait for a full bucket)."""
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / (self.capacity / 60)
+
+    def sync(self, limit: Optional[str], remaining: Optional[str]):
+        """Adopts the limit and remaining quota reported by the server."""
+        if limit and limit.isdigit() and int(limit) > 0:
+            self.capacity = float(limit)
+        if remaining and remaining.isdigit():
+            # Requests still in flight were already taken from our level, so never raise it
+            self.level = min(self.level, float(remaining), self.capacity)
+
+
+class OpenAIRateLimiter:
+    def __init__(self, rpm: int = OPENAI_RPM_LIMIT, tpm: int = OPENAI_TPM_LIMIT):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self.rate_limited = 0
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self, tokens: int):
+        """Waits until one request and `tokens` tokens fit into the current limits."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # One waiter at a time, so callers are served in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                wait = max(self.paused_until - now, self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                if wait <= 0:
+                    self.requests.level -= 1
+                    self.tokens.level -= min(tokens, self.tokens.capacity)
+                    return
+                await asyncio.sleep(wait)
+
+    def update_from_headers(self, headers):
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        self.requests.sync(headers.get("x-ratelimit-limit-requests"), headers.get("x-ratelimit-remaining-requests"))
+        self.tokens.sync(headers.get("x-ratelimit-limit-tokens"), headers.get("x-ratelimit-remaining-tokens"))
+
+    def refund(self, estimated: int, actual: int):
+        """Returns over-estimated tokens to the bucket once the real usage is known."""
+        if actual < estimated:
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + estimated - actual)
+
+    def pause_after_429(self, headers, attempt: int) -> float:
+        """Pauses every caller of this key after a 429; returns the pause in seconds."""
+        self.rate_limited += 1
+        delay = None
+        if headers is not None:
+            retry_after_ms = headers.get("retry-after-ms")
+            delay = float(retry_after_ms) / 1000 if retry_after_ms else parse_duration(headers.get("retry-after"))
+            if delay is None:
+                resets = [
+                    parse_duration(headers.get("x-ratelimit-reset-requests")),
+                    parse_duration(headers.get("x-ratelimit-reset-tokens")),
+                ]
+                resets = [reset for reset in resets if reset]
+                delay = max(resets) if resets else None
+        if delay is None:
+            delay = OPENAI_BACKOFF_BASE * (2 ** attempt)
+        # Jitter so workers do not all resume in the same instant
+        delay *= 1 + random.random() * 0.25
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        return delay
+
+
+_limiters: Dict[str, OpenAIRateLimiter] = {}
+
+
+def get_limiter(api_key: str) -> OpenAIRateLimiter:
+    """Limits are per OpenAI account, so limiters are shared per API key."""
+    key = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+    if key not in _limiters:
+        _limiters[key] = OpenAIRateLimiter()
+    return _limiters[key]
+
+
+async def create_chat_completion(client: openai.OpenAI, **kwargs):
+    """
+    Rate-limited client.chat.completions.create(**kwargs). The blocking call
+    runs in a worker thread; 429s, connection errors and 5xx are retried here
+    (the client's own retries are disabled so they do not bypass the limiter).
+    """
+    limiter = get_limiter(client.api_key)
+    estimated = estimate_tokens(kwargs)
+    create = client.with_options(max_retries=0).chat.completions.with_raw_response.create
+
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        await limiter.acquire(estimated)
+        try:
+            raw_response = await asyncio.to_thread(create, **kwargs)
+        except openai.RateLimitError as e:
+            if e.code == "insufficient_quota" or attempt == OPENAI_MAX_RETRIES:
+                raise
+            delay = limiter.pause_after_429(e.response.headers, attempt)
+            print(f"[WARNING] OpenAI rate limit hit, pausing {delay:.1f}s (retry {attempt + 1}/{OPENAI_MAX_RETRIES})")
+            continue
+        except (openai.APIConnectionError, openai.InternalServerError) as e:
+            if attempt == OPENAI_MAX_RETRIES:
+                raise
+            delay = OPENAI_BACKOFF_BASE * (2 ** attempt)
+            print(f"[WARNING] OpenAI request failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+
+        limiter.update_from_headers(raw_response.headers)
+        completion = raw_response.parse()
+        if completion.usage:
+            limiter.refund(estimated, completion.usage.total_tokens)
+        return completion
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Page-fetch throughput benchmark for the Playwright browser pool.
+
+Compares pages per minute of fetching künye pages:
+  before: a new Playwright driver + Chromium launch per URL (the removed code)
+  after:  fetch_page_content_with_playwright on the warm browser pool,
+          one page at a time and BROWSER_POOL_SIZE pages at a time
+Both sides load pages the same way (resource blocking, domcontentloaded and
+the content wait of page_loading), so only the browser start-up differs.
+
+Without URLs a local HTTP server serves a generated künye page, so the numbers
+show the browser overhead rather than network latency.
+Usage: python benchmark_browser_pool.py [pages] [url ...]
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from playwright.async_api import async_playwright  # noqa: E402
+
+from browser_pool import USER_AGENT, browser_pool  # noqa: E402
+from page_fetcher import BROWSER_MIN_TEXT, KUNYE_MARKERS, fetch_page_content_with_playwright  # noqa: E402
+from page_loading import block_resources, wait_for_content  # noqa: E402
+
+SAMPLE_PAGE = """<!DOCTYPE html>
+<html lang="tr"><head><meta charset="utf-8"><title>Künye</title></head>
+<body>
+<nav>Anasayfa | Gündem | Ekonomi | Spor</nav>
+<div id="kunye">
+<h1>KÜNYE</h1>
+<p>İmtiyaz Sahibi: Örnek Medya A.Ş. adına Ahmet Yılmaz</p>
+<p>Genel Yayın Yönetmeni: Ayşe Demir</p>
+<p>Haber Müdürü: Mehmet Kaya</p>
+<p>Adres: Atatürk Cad. No: 1 Çankaya / Ankara</p>
+<p>Telefon: 0312 000 00 00 - Faks: 0312 000 00 01</p>
+<p>E-posta: haber@ornekgazete.com.tr</p>
+</div>
+<script>document.getElementById('kunye').insertAdjacentHTML('beforeend', '<p>Yazı İşleri Müdürü: Zeynep Şahin</p>');</script>
+</body></html>
+""".encode("utf-8")
+
+
+class SamplePageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(SAMPLE_PAGE)))
+        self.end_headers()
+        self.wfile.write(SAMPLE_PAGE)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_sample_server() -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SamplePageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/kunye"
+
+
+async def legacy_fetch(url: str) -> str:
+    """The removed code path (driver start and browser launch for every URL), with the pool's page loading."""
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        context = await browser.new_context(user_agent=USER_AGENT)
+        await block_resources(context)
+        page = await context.new_page()
+        await page.goto(url, wait_until='domcontentloaded', timeout=30000)
+        await wait_for_content(page, min_chars=BROWSER_MIN_TEXT, markers=KUNYE_MARKERS)
+        html_content = await page.content()
+        await browser.close()
+        return html_content
+
+
+async def timed(label: str, urls, fetch, concurrency: int = 1) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(url):
+        async with semaphore:
+            return await fetch(url)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(url) for url in urls))
+    elapsed = time.perf_counter() - start
+    ok = sum(1 for r in results if r)
+    print(f"{label:<40} {elapsed:7.1f} s  {len(urls) / elapsed * 60:7.1f} pages/min  ({ok}/{len(urls)} ok)")
+    return elapsed
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    urls = sys.argv[2:] or [start_sample_server()]
+    urls = [urls[i % len(urls)] for i in range(count)]
+    print(f"Fetching {count} pages, pool size {browser_pool.size}")
+    print()
+
+    before = await timed("before: launch per URL", urls, legacy_fetch)
+
+    start = time.perf_counter()
+    await browser_pool.start()
+    print(f"{'pool start-up (once per app)':<40} {time.perf_counter() - start:7.1f} s")
+    after = await timed("after:  pool, sequential", urls, fetch_page_content_with_playwright)
+    after_concurrent = await timed(
+        f"after:  pool, {browser_pool.size} at a time", urls, fetch_page_content_with_playwright, browser_pool.size
+    )
+    print()
+    print(f"pool: {browser_pool.status()}")
+    await browser_pool.stop()
+
+    print(f"speed-up (sequential): {before / after:.1f}x")
+    print(f"speed-up ({browser_pool.size} at a time): {before / after_concurrent:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,168 @@
+"""
+Long-lived Playwright browser pool.
+
+Every fetch used to start its own Playwright driver and launch a fresh
+Chromium, which cost 1-3 s and a few hundred MB per row. The pool starts one
+driver and one headless Chromium at app startup and keeps BROWSER_POOL_SIZE
+browser contexts warm. A fetch borrows a context, opens a page in it and
+gives the context back; a context is recycled (closed and recreated) after
+BROWSER_MAX_PAGES pages so cookies, caches and leaked memory do not pile up,
+and the browser is relaunched when it crashes or disconnects. Every context
+blocks images, fonts and ad/tracker requests (page_loading).
+
+The pool size also caps how many pages are rendered at the same time: a
+fetch waits for a free context.
+"""
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from playwright.async_api import Browser, BrowserContext, Page, Playwright, async_playwright
+
+from page_loading import block_resources
+
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "4"))
+BROWSER_MAX_PAGES = int(os.getenv("BROWSER_MAX_PAGES", "50"))
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+
+class _Slot:
+    """One pooled context and the number of pages it has served."""
+
+    def __init__(self):
+        self.context: Optional[BrowserContext] = None
+        self.generation = 0  # Browser launch the context belongs to
+        self.pages = 0
+
+
+class BrowserPool:
+    def __init__(self, size: int = BROWSER_POOL_SIZE, max_pages: int = BROWSER_MAX_PAGES):
+        self.size = max(1, size)
+        self.max_pages = max(1, max_pages)
+        self._playwright: Optional[Playwright] = None
+        self._browser: Optional[Browser] = None
+        self._generation = 0
+        self._slots: Optional[asyncio.Queue] = None
+        self._lock = asyncio.Lock()
+        self.stats = {"pages": 0, "contexts_created": 0, "browser_launches": 0}
+
+    async def start(self):
+        """Starts the driver and browser and warms up the contexts; no-op if already started."""
+        async with self._lock:
+            if self._slots is not None:
+                return
+            self._playwright = await async_playwright().start()
+            try:
+                await self._launch()
+                slots = asyncio.Queue()
+                for _ in range(self.size):
+                    slot = _Slot()
+                    await self._new_context(slot)
+                    slots.put_nowait(slot)
+            except Exception:
+                if self._browser is not None:
+                    await self._browser.close()
+                    self._browser = None
+                await self._playwright.stop()
+                self._playwright = None
+                raise
+            self._slots = slots
+        print(f"[DEBUG] Browser pool started with {self.size} contexts")
+
+    async def stop(self):
+        async with self._lock:
+            if self._slots is None:
+                return
+            while not self._slots.empty():
+                await self._close_context(self._slots.get_nowait())
+            self._slots = None
+            if self._browser is not None:
+                try:
+                    await self._browser.close()
+                except Exception:
+                    pass
+                self._browser = None
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+        print("[DEBUG] Browser pool stopped")
+
+    async def _launch(self):
+        self._browser = await self._playwright.chromium.launch(headless=True)
+        self._generation += 1
+        self.stats["browser_launches"] += 1
+
+    async def _ensure_browser(self):
+        """Relaunches the browser if it crashed or disconnected."""
+        async with self._lock:
+            if self._browser is not None and self._browser.is_connected():
+                return
+            print("[WARNING] Browser disconnected, relaunching")
+            if self._browser is not None:
+                try:
+                    await self._browser.close()
+                except Exception:
+                    pass
+            await self._launch()
+
+    async def _new_context(self, slot: _Slot):
+        slot.context = await self._browser.new_context(user_agent=USER_AGENT)
+        await block_resources(slot.context)
+        slot.generation = self._generation
+        slot.pages = 0
+        self.stats["contexts_created"] += 1
+
+    async def _close_context(self, slot: _Slot):
+        if slot.context is not None:
+            try:
+                await slot.context.close()
+            except Exception:
+                pass
+        slot.context = None
+
+    @asynccontextmanager
+    async def page(self) -> AsyncIterator[Page]:
+        """
+        Borrows a context and yields a new page in it; the page is closed and
+        the context returned to the pool (or recycled) afterwards.
+        """
+        if self._slots is None:
+            await self.start()
+        slots = self._slots
+        slot = await slots.get()
+        page = None
+        try:
+            await self._ensure_browser()
+            if slot.context is None or slot.generation != self._generation:
+                # Never created, recycled, or left over from a crashed browser
+                await self._close_context(slot)
+                await self._new_context(slot)
+            page = await slot.context.new_page()
+            yield page
+        finally:
+            try:
+                recycle = page is None
+                if page is not None:
+                    slot.pages += 1
+                    self.stats["pages"] += 1
+                    try:
+                        await page.close()
+                    except Exception:
+                        recycle = True  # Page or context crashed
+                if recycle or slot.pages >= self.max_pages:
+                    await self._close_context(slot)
+            finally:
+                slots.put_nowait(slot)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "available": self._slots.qsize() if self._slots is not None else 0,
+            "started": self._slots is not None,
+            **self.stats,
+        }
+
+
+browser_pool = BrowserPool()
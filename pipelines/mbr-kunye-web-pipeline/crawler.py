@@ -0,0 +1,125 @@
+"""
+Concurrent crawling of the künye links of a batch.
+
+Batch endpoints used to fetch one publication page after the other. A Crawler
+now runs all rows of a sheet at the same time, within two limits:
+  - CRAWL_CONCURRENCY page fetches at once per run (the global cap; the
+    browser pool additionally caps how many pages are rendered at once)
+  - per domain, at most CRAWL_PER_DOMAIN fetches at once and
+    CRAWL_DOMAIN_DELAY seconds between the start of two fetches, shared by
+    every run of the process, so no single newspaper site gets hammered
+
+A row first waits for its domain and only then takes a global slot, so rows
+of one busy domain never block fetches of other domains. Results and the
+events a row emits are yielded as soon as they happen.
+"""
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Tuple
+from urllib.parse import urlparse
+
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "16"))
+CRAWL_PER_DOMAIN = int(os.getenv("CRAWL_PER_DOMAIN", "2"))
+CRAWL_DOMAIN_DELAY = float(os.getenv("CRAWL_DOMAIN_DELAY", "1.0"))
+
+Emit = Callable[[Dict[str, Any]], None]
+
+
+def domain_of(url: str) -> str:
+    """Host of a URL without 'www.', lower-cased ('' for unparseable links)."""
+    try:
+        host = urlparse(url if "://" in url else f"http://{url}").hostname or ""
+    except ValueError:
+        return ""
+    return host[4:] if host.startswith("www.") else host
+
+
+class _Domain:
+    def __init__(self, per_domain: int):
+        self.semaphore = asyncio.Semaphore(per_domain)
+        self.lock = asyncio.Lock()
+        self.next_start = 0.0
+
+
+class DomainLimiter:
+    """Per-domain concurrency and delay between request starts."""
+
+    def __init__(self, per_domain: int = CRAWL_PER_DOMAIN, delay: float = CRAWL_DOMAIN_DELAY):
+        self.per_domain = max(1, per_domain)
+        self.delay = max(0.0, delay)
+        self._domains: Dict[str, _Domain] = {}
+
+    @asynccontextmanager
+    async def slot(self, url: str):
+        name = domain_of(url)
+        domain = self._domains.get(name)
+        if domain is None:
+            domain = self._domains[name] = _Domain(self.per_domain)
+        async with domain.semaphore:
+            async with domain.lock:
+                loop = asyncio.get_running_loop()
+                wait = domain.next_start - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                domain.next_start = loop.time() + self.delay
+            yield
+
+
+domain_limiter = DomainLimiter()
+
+
+class Crawler:
+    def __init__(self, concurrency: int = CRAWL_CONCURRENCY, limiter: DomainLimiter = domain_limiter):
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.limiter = limiter
+
+    @asynccontextmanager
+    async def fetch_slot(self, url: str):
+        """Holds a slot of the URL's domain and a global slot while a page is fetched."""
+        async with self.limiter.slot(url):
+            async with self._semaphore:
+                yield
+
+    async def run(
+        self,
+        items: Iterable[Any],
+        worker: Callable[[Any, Emit], Awaitable[Any]],
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Runs worker(item, emit) for every item concurrently. Yields
+        ("event", event) for everything a worker emits and ("result", value)
+        when a worker finishes, in the order they happen. Workers are expected
+        to handle their own errors; an exception escaping a worker cancels
+        the rest and is raised. Closing the iterator cancels running workers.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def emit(event: Dict[str, Any]):
+            queue.put_nowait(("event", event))
+
+        async def run_one(item):
+            try:
+                result = await worker(item, emit)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                queue.put_nowait(("error", e))
+                return
+            queue.put_nowait(("result", result))
+
+        tasks = [asyncio.create_task(run_one(item)) for item in items]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                kind, payload = await queue.get()
+                if kind == "error":
+                    raise payload
+                if kind == "result":
+                    remaining -= 1
+                yield kind, payload
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
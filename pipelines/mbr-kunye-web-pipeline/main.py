@@ -2,17 +2,23 @@ from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import requests
 import openai
 import os
 import json
+import hashlib
 from io import BytesIO
 import pandas as pd
-from bs4 import BeautifulSoup
-import time
+from rate_limiter import create_chat_completion
+from excel_ingest import Sheet, SheetRow, read_sheet
+from crawler import Crawler, Emit
 import asyncio
-from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+from contextlib import aclosing
+from browser_pool import browser_pool
+from http_client import close_client
+from page_fetcher import FetchedPage, cached_entry, fetch_page_content, fresh_page, refresh_page
+from page_cache import page_cache
 
 app = FastAPI(title="MTM MBR Künye Web Pipeline", version="1.0.0")
 
@@ -64,7 +70,28 @@ async def global_exception_handler(request: Request, exc: Exception):
 
 @app.get("/")
 async def root():
-    return {"status": "running", "service": "mbr-kunye-web-pipeline"}
+    return {"status": "running", "service": "mbr-kunye-web-pipeline", "browser_pool": browser_pool.status()}
+
+@app.on_event("startup")
+async def prune_page_cache():
+    if page_cache is None:
+        return
+    pruned = await asyncio.to_thread(page_cache.prune)
+    if pruned:
+        print(f"[DEBUG] Pruned {pruned} expired pages from the page cache")
+
+@app.on_event("startup")
+async def start_browser_pool():
+    try:
+        await browser_pool.start()
+    except Exception as e:
+        # Retried by the first fetch
+        print(f"[ERROR] Browser pool could not be started: {e}")
+
+@app.on_event("shutdown")
+async def stop_browser_pool():
+    await browser_pool.stop()
+    await close_client()
 
 app.add_middleware(
     CORSMiddleware,
@@ -132,75 +159,6 @@ Eğer künyeden çıkarılabilecek başka önemli bilgiler varsa (baskı tesisi,
 }}
 """
 
-async def fetch_page_content_with_playwright(url: str) -> Optional[str]:
-    """
-    Fetches web page content using Playwright for JavaScript rendering support.
-    Extracts visible text from the page after JavaScript execution.
-    
-    Args:
-        url: Web page URL
-        
-    Returns:
-        Extracted text content or None if fetch fails
-    """
-    try:
-        print(f"[DEBUG] Fetching page with Playwright: {url}")
-        
-        async with async_playwright() as p:
-            # Launch browser in headless mode
-            browser = await p.chromium.launch(headless=True)
-            
-            # Create new page with realistic user agent
-            page = await browser.new_page(
-                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-            )
-            
-            try:
-                # Navigate to page with timeout
-                await page.goto(url, wait_until='networkidle', timeout=30000)
-                
-                # Wait a bit for any lazy-loaded content
-                await page.wait_for_timeout(2000)
-                
-                # Get page content
-                html_content = await page.content()
-                
-                # Parse with BeautifulSoup to extract text
-                soup = BeautifulSoup(html_content, 'html.parser')
-                
-                # Remove script and style elements
-                for script in soup(["script", "style", "noscript"]):
-                    script.decompose()
-                
-                # Get text
-                text = soup.get_text(separator='\n', strip=True)
-                
-                # Clean up multiple newlines
-                lines = [line.strip() for line in text.splitlines() if line.strip()]
-                clean_text = '\n'.join(lines)
-                
-                await browser.close()
-                
-                if len(clean_text) < 50:
-                    print(f"[WARNING] Extracted text too short: {len(clean_text)} chars")
-                    return None
-                
-                print(f"[DEBUG] Successfully extracted {len(clean_text)} characters from {url}")
-                return clean_text
-                
-            except PlaywrightTimeoutError:
-                print(f"[ERROR] Timeout loading page: {url}")
-                await browser.close()
-                return None
-            except Exception as e:
-                print(f"[ERROR] Error during page interaction: {e}")
-                await browser.close()
-                return None
-                
-    except Exception as e:
-        print(f"[ERROR] Playwright error for {url}: {e}")
-        return None
-
 def results_to_excel(results: List[BatchKunyeWebResult]) -> bytes:
     """
     Converts batch results to Excel file bytes.
@@ -271,11 +229,49 @@ def results_to_excel(results: List[BatchKunyeWebResult]) -> bytes:
     output.seek(0)
     return output.getvalue()
 
+KUNYE_MODEL = "gpt-4o-mini"
+# Changes whenever the model or prompt template changes, so cached extractions of an older prompt are not reused
+KUNYE_PROMPT_KEY = hashlib.sha256((KUNYE_MODEL + create_kunye_prompt("")).encode("utf-8")).hexdigest()[:16]
+
+async def extract_kunye(client: openai.OpenAI, page: FetchedPage, force_refresh: bool = False) -> Tuple[Dict[str, Any], bool]:
+    """
+    Extracts künye data from a fetched page with OpenAI, reusing the stored
+    extraction of identical page text unless force_refresh is set.
+    
+    Returns:
+        (extracted data, whether it came from the cache)
+    """
+    content_hash = page.content_hash
+    if not force_refresh and page_cache is not None:
+        cached = await asyncio.to_thread(page_cache.get_extraction, content_hash, KUNYE_PROMPT_KEY)
+        if cached is not None:
+            return cached, True
+    
+    prompt = create_kunye_prompt(page.text)
+    
+    response = await create_chat_completion(
+        client,
+        model=KUNYE_MODEL,
+        messages=[
+            {"role": "system", "content": "Sen yapılandırılmış veri çıkarımı yapan bir asistansın. Sadece geçerli JSON döndür."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.1,
+        max_tokens=2000,
+        response_format={"type": "json_object"}
+    )
+    
+    extracted_data = json.loads(response.choices[0].message.content)
+    if page_cache is not None:
+        await asyncio.to_thread(page_cache.put_extraction, content_hash, KUNYE_PROMPT_KEY, extracted_data)
+    return extracted_data, False
+
 @app.post("/api/v1/pipelines/mbr-kunye-web-single")
 async def process_single_link(
     link: str = Form(...),
     yayin_adi: Optional[str] = Form(None),
     openai_api_key: Optional[str] = Form(None),
+    force_refresh: bool = Form(False),
 ):
     """
     Processes a single künye page from web link.
@@ -284,6 +280,7 @@ async def process_single_link(
         link: Web URL of künye page
         yayin_adi: Optional publication name
         openai_api_key: OpenAI API Key
+        force_refresh: Fetch and extract again, ignoring the page cache
         
     Returns:
         KunyeResult with extracted data
@@ -298,38 +295,25 @@ async def process_single_link(
     try:
         # Step 1: Fetch web page
         print(f"[DEBUG] Processing single link: {link}")
-        html_text = await fetch_page_content_with_playwright(link)
+        page = await fetch_page_content(link, force_refresh)
         
-        if not html_text:
+        if not page:
             raise HTTPException(
                 status_code=400,
                 detail="Web sayfası alınamadı. Lütfen geçerli bir URL girin."
             )
         
-        # Step 2: OpenAI extraction
+        # Step 2: OpenAI extraction (skipped when the page text is unchanged)
         print(f"[DEBUG] Extracting data with OpenAI...")
         client = openai.OpenAI(api_key=openai_api_key)
-        prompt = create_kunye_prompt(html_text)
-        
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Sen yapılandırılmış veri çıkarımı yapan bir asistansın. Sadece geçerli JSON döndür."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1,
-            max_tokens=2000,
-            response_format={"type": "json_object"}
-        )
-        
-        extracted_data = json.loads(response.choices[0].message.content)
+        extracted_data, _ = await extract_kunye(client, page, force_refresh)
         
         result = {
             "yayin_adi": yayin_adi or extracted_data.get("yayin_adi"),
             "link": link,
             "status": "success",
             "data": extracted_data,
-            "raw_html_text": html_text[:500]  # First 500 chars
+            "raw_html_text": page.text[:500]  # First 500 chars
         }
         
         return result
@@ -343,16 +327,93 @@ async def process_single_link(
             detail=f"İşlem hatası: {str(e)}"
         )
 
+async def process_kunye_row(
+    crawler: Crawler,
+    client: openai.OpenAI,
+    sheet_row: SheetRow,
+    yayin_column: str,
+    total: int,
+    emit: Emit,
+    force_refresh: bool = False,
+) -> BatchKunyeWebResult:
+    """
+    Fetches the künye page of one sheet row and extracts it with OpenAI.
+    Emits the row's SSE progress/error/success events; never raises.
+    """
+    idx, link = sheet_row.index, sheet_row.id
+    yayin_adi = sheet_row.values[yayin_column]
+    
+    row_result = BatchKunyeWebResult(
+        row=idx + 2,
+        yayin_adi=yayin_adi,
+        link=link,
+        status="processing"
+    )
+    
+    try:
+        # Step 1: Fetch web page (fresh cache hits skip the per-domain and global crawl limits)
+        emit({'type': 'progress', 'row': idx+1, 'total': total, 'yayin': yayin_adi, 'step': 'fetch', 'message': 'Web sayfası alınıyor...'})
+        
+        cached = None if force_refresh else await cached_entry(link)
+        page = fresh_page(cached)
+        if page is None:
+            async with crawler.fetch_slot(link):
+                page = await refresh_page(link, cached)
+        
+        if not page:
+            row_result.status = "failed"
+            row_result.error = "Web sayfası alınamadı"
+            emit({'type': 'error', 'row': idx+1, 'total': total, 'yayin': yayin_adi, 'message': 'Web sayfası alınamadı'})
+            return row_result
+        
+        row_result.raw_html_text = page.text[:1000]  # Store first 1000 chars
+        
+        # Step 2: OpenAI extraction (skipped when the page text is unchanged)
+        emit({'type': 'progress', 'row': idx+1, 'total': total, 'yayin': yayin_adi, 'step': 'ai', 'message': 'Yapay zeka ile veri çıkarımı yapılıyor...'})
+        
+        extracted_data, extraction_cached = await extract_kunye(client, page, force_refresh)
+        
+        row_result.status = "success"
+        row_result.data = KunyeResult(**extracted_data)
+        emit({'type': 'success', 'row': idx+1, 'total': total, 'yayin': yayin_adi, 'message': 'Başarıyla tamamlandı', 'page_cached': page.from_cache, 'extraction_cached': extraction_cached})
+        
+    except Exception as e:
+        print(f"[ERROR] Error processing {yayin_adi}: {e}")
+        row_result.status = "failed"
+        row_result.error = str(e)
+        emit({'type': 'error', 'row': idx+1, 'total': total, 'yayin': yayin_adi, 'message': str(e)})
+    
+    return row_result
+
+async def crawl_kunye_sheet(sheet: Sheet, yayin_column: str, openai_api_key: str, force_refresh: bool = False):
+    """
+    Processes every row with a publication name concurrently and yields
+    Crawler.run's ("event", event) / ("result", BatchKunyeWebResult) pairs
+    as rows progress.
+    """
+    crawler = Crawler()
+    client = openai.OpenAI(api_key=openai_api_key)
+    rows = [sheet_row for sheet_row in sheet.rows if sheet_row.values[yayin_column]]
+    
+    async def worker(sheet_row: SheetRow, emit: Emit) -> BatchKunyeWebResult:
+        return await process_kunye_row(crawler, client, sheet_row, yayin_column, sheet.total, emit, force_refresh)
+    
+    async with aclosing(crawler.run(rows, worker)) as events:
+        async for item in events:
+            yield item
+
 @app.post("/api/v1/pipelines/mbr-kunye-web-batch-stream")
 async def process_mbr_kunye_web_batch_stream(
     file: UploadFile = File(...),
     openai_api_key: Optional[str] = Form(None),
     yayin_column: str = Form("A"),
     link_column: str = Form("B"),
+    force_refresh: bool = Form(False),
 ):
     """
     Processes batch with Server-Sent Events for real-time progress updates.
-    Fetches künye pages from web links using Playwright.
+    Fetches künye pages from web links using Playwright, several sites at a
+    time; events of a row are sent as soon as they happen.
     """
     # Validate API key
     if not openai_api_key or not openai_api_key.strip():
@@ -368,94 +429,27 @@ async def process_mbr_kunye_web_batch_stream(
         failed = 0
         
         try:
-            # Read Excel file
+            # Read the link and publication columns (rows sharing a link are kept)
             contents = await file.read()
-            df = pd.read_excel(BytesIO(contents))
-            
-            # Get column indices
-            yayin_col_idx = ord(yayin_column.upper()) - 65 if yayin_column.isalpha() else 0
-            link_col_idx = ord(link_column.upper()) - 65 if link_column.isalpha() else 1
-            
-            total = len(df)
+            sheet = await asyncio.to_thread(read_sheet, contents, link_column, [yayin_column], dedupe=False)
+            total = sheet.total
             
             # Send initial status
             yield f"data: {json.dumps({'type': 'init', 'total': total})}\n\n"
             
-            for idx, row in df.iterrows():
-                # Get Yayın and Link
-                try:
-                    yayin_adi = str(row.iloc[yayin_col_idx]).strip()
-                    link = str(row.iloc[link_col_idx]).strip()
-                    
-                    if pd.isna(row.iloc[yayin_col_idx]) or not yayin_adi:
-                        continue
-                    if pd.isna(row.iloc[link_col_idx]) or not link:
-                        continue
-                except:
-                    continue
-                
-                row_result = BatchKunyeWebResult(
-                    row=idx + 2,
-                    yayin_adi=yayin_adi,
-                    link=link,
-                    status="processing"
-                )
-                
-                try:
-                    # Step 1: Fetch web page
-                    yield f"data: {json.dumps({'type': 'progress', 'row': idx+1, 'total': total, 'yayin': yayin_adi, 'step': 'fetch', 'message': 'Web sayfası alınıyor...'})}\n\n"
-                    
-                    html_text = await fetch_page_content_with_playwright(link)
-                    
-                    if not html_text:
-                        row_result.status = "failed"
-                        row_result.error = "Web sayfası alınamadı"
-                        failed += 1
-                        results.append(row_result)
-                        yield f"data: {json.dumps({'type': 'error', 'row': idx+1, 'total': total, 'yayin': yayin_adi, 'message': 'Web sayfası alınamadı'})}\n\n"
+            async with aclosing(crawl_kunye_sheet(sheet, yayin_column, openai_api_key, force_refresh)) as events:
+                async for kind, payload in events:
+                    if kind == "result":
+                        results.append(payload)
+                        if payload.status == "success":
+                            successful += 1
+                        else:
+                            failed += 1
                         continue
-                    
-                    row_result.raw_html_text = html_text[:1000]  # Store first 1000 chars
-                    
-                    # Step 2: OpenAI extraction
-                    yield f"data: {json.dumps({'type': 'progress', 'row': idx+1, 'total': total, 'yayin': yayin_adi, 'step': 'ai', 'message': 'Yapay zeka ile veri çıkarımı yapılıyor...'})}\n\n"
-                    
-                    client = openai.OpenAI(api_key=openai_api_key)
-                    prompt = create_kunye_prompt(html_text)
-                    
-                    response = client.chat.completions.create(
-                        model="gpt-4o-mini",
-                        messages=[
-                            {"role": "system", "content": "Sen yapılandırılmış veri çıkarımı yapan bir asistansın. Sadece geçerli JSON döndür."},
-                            {"role": "user", "content": prompt}
-                        ],
-                        temperature=0.1,
-                        max_tokens=2000,
-                        response_format={"type": "json_object"}
-                    )
-                    
-                    extracted_data = json.loads(response.choices[0].message.content)
-                    
-                    row_result.status = "success"
-                    row_result.data = KunyeResult(**extracted_data)
-                    successful += 1
-                    results.append(row_result)
-                    
-                    # Success notification
-                    yield f"data: {json.dumps({'type': 'success', 'row': idx+1, 'total': total, 'yayin': yayin_adi, 'message': 'Başarıyla tamamlandı'})}\n\n"
-                    
-                    # Rate limiting
-                    await asyncio.sleep(0.3)
-                    
-                except Exception as e:
-                    print(f"[ERROR] Error processing {yayin_adi}: {e}")
-                    row_result.status = "failed"
-                    row_result.error = str(e)
-                    failed += 1
-                    results.append(row_result)
-                    yield f"data: {json.dumps({'type': 'error', 'row': idx+1, 'total': total, 'yayin': yayin_adi, 'message': str(e)})}\n\n"
+                    yield f"data: {json.dumps(payload)}\n\n"
             
             # Send final summary
+            results.sort(key=lambda r: r.row)
             summary = {
                 'type': 'complete',
                 'total': total,
@@ -484,6 +478,7 @@ async def process_mbr_kunye_web_batch(
     openai_api_key: Optional[str] = Form(None),
     yayin_column: str = Form("A"),
     link_column: str = Form("B"),
+    force_refresh: bool = Form(False),
 ):
     """
     Processes batch künye extraction from web links.
@@ -498,96 +493,28 @@ async def process_mbr_kunye_web_batch(
     
     results = []
     total = 0
-    successful = 0
-    failed = 0
     
     try:
-        # Read Excel file
+        # Read the link and publication columns (rows sharing a link are kept)
         contents = await file.read()
-        df = pd.read_excel(BytesIO(contents))
-        
-        # Get column indices
-        yayin_col_idx = ord(yayin_column.upper()) - 65 if yayin_column.isalpha() else 0
-        link_col_idx = ord(link_column.upper()) - 65 if link_column.isalpha() else 1
-        
-        total = len(df)
+        sheet = await asyncio.to_thread(read_sheet, contents, link_column, [yayin_column], dedupe=False)
+        total = sheet.total
         print(f"Processing {total} rows from Excel...")
         
-        for idx, row in df.iterrows():
-            # Get Yayın and Link
-            try:
-                yayin_adi = str(row.iloc[yayin_col_idx]).strip()
-                link = str(row.iloc[link_col_idx]).strip()
-                
-                if pd.isna(row.iloc[yayin_col_idx]) or not yayin_adi:
-                    continue
-                if pd.isna(row.iloc[link_col_idx]) or not link:
-                    continue
-            except:
-                continue
-            
-            row_result = BatchKunyeWebResult(
-                row=idx + 2,
-                yayin_adi=yayin_adi,
-                link=link,
-                status="processing"
-            )
-            
-            try:
-                # 1. Fetch web page
-                print(f"[{idx+1}/{total}] Fetching {yayin_adi} from {link}...")
-                html_text = await fetch_page_content_with_playwright(link)
-                
-                if not html_text:
-                    row_result.status = "failed"
-                    row_result.error = "Web sayfası alınamadı"
-                    failed += 1
-                    results.append(row_result)
-                    continue
-                
-                row_result.raw_html_text = html_text[:1000]
-                
-                # 2. OpenAI Extraction
-                print(f"[{idx+1}/{total}] Extracting data with OpenAI...")
-                client = openai.OpenAI(api_key=openai_api_key)
-                prompt = create_kunye_prompt(html_text)
-                
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": "Sen yapılandırılmış veri çıkarımı yapan bir asistansın. Sadece geçerli JSON döndür."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.1,
-                    max_tokens=2000,
-                    response_format={"type": "json_object"}
-                )
-                
-                extracted_data = json.loads(response.choices[0].message.content)
-                
-                row_result.status = "success"
-                row_result.data = KunyeResult(**extracted_data)
-                successful += 1
-                results.append(row_result)
-                
-                print(f"[{idx+1}/{total}] ✓ Success")
-                
-                # Rate limit
-                if idx < total - 1:
-                    time.sleep(0.5)
-                
-            except Exception as e:
-                print(f"[ERROR] Error processing {yayin_adi}: {e}")
-                row_result.status = "failed"
-                row_result.error = str(e)
-                failed += 1
-                results.append(row_result)
+        async with aclosing(crawl_kunye_sheet(sheet, yayin_column, openai_api_key, force_refresh)) as events:
+            async for kind, payload in events:
+                if kind == "result":
+                    results.append(payload)
+                    print(f"[{len(results)}/{total}] {payload.yayin_adi}: {payload.status}")
+        
+        results.sort(key=lambda r: r.row)
+        successful = sum(1 for r in results if r.status == "success")
         
         return BatchProcessingSummary(
             total=total,
             processed=len(results),
             successful=successful,
-            failed=failed,
+            failed=len(results) - successful,
             results=results
         )
         
@@ -601,6 +528,7 @@ async def process_mbr_kunye_web_batch_excel(
     openai_api_key: Optional[str] = Form(None),
     yayin_column: str = Form("A"),
     link_column: str = Form("B"),
+    force_refresh: bool = Form(False),
 ):
     """
     Processes batch and returns results as downloadable Excel file.
@@ -616,77 +544,19 @@ async def process_mbr_kunye_web_batch_excel(
     total = 0
     
     try:
-        # Read Excel file
+        # Read the link and publication columns (rows sharing a link are kept)
         contents = await file.read()
-        df = pd.read_excel(BytesIO(contents))
-        
-        # Get column indices
-        yayin_col_idx = ord(yayin_column.upper()) - 65 if yayin_column.isalpha() else 0
-        link_col_idx = ord(link_column.upper()) - 65 if link_column.isalpha() else 1
-        
-        total = len(df)
+        sheet = await asyncio.to_thread(read_sheet, contents, link_column, [yayin_column], dedupe=False)
+        total = sheet.total
         print(f"Processing {total} rows for Excel output...")
         
-        for idx, row in df.iterrows():
-            try:
-                yayin_adi = str(row.iloc[yayin_col_idx]).strip()
-                link = str(row.iloc[link_col_idx]).strip()
-                
-                if pd.isna(row.iloc[yayin_col_idx]) or not yayin_adi:
-                    continue
-                if pd.isna(row.iloc[link_col_idx]) or not link:
-                    continue
-            except:
-                continue
-            
-            row_result = BatchKunyeWebResult(
-                row=idx + 2,
-                yayin_adi=yayin_adi,
-                link=link,
-                status="processing"
-            )
-            
-            try:
-                # Fetch and process
-                html_text = await fetch_page_content_with_playwright(link)
-                
-                if not html_text:
-                    row_result.status = "failed"
-                    row_result.error = "Web sayfası alınamadı"
-                    results.append(row_result)
-                    continue
-                
-                # OpenAI extraction
-                client = openai.OpenAI(api_key=openai_api_key)
-                prompt = create_kunye_prompt(html_text)
-                
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": "Sen yapılandırılmış veri çıkarımı yapan bir asistansın. Sadece geçerli JSON döndür."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.1,
-                    max_tokens=2000,
-                    response_format={"type": "json_object"}
-                )
-                
-                extracted_data = json.loads(response.choices[0].message.content)
-                row_result.status = "success"
-                row_result.data = KunyeResult(**extracted_data)
-                results.append(row_result)
-                
-                # Rate limit
-                if idx < total - 1:
-                    time.sleep(0.5)
-                
-            except Exception as e:
-                print(f"[ERROR] Error processing {yayin_adi}: {e}")
-                row_result.status = "failed"
-                row_result.error = str(e)
-                results.append(row_result)
+        async with aclosing(crawl_kunye_sheet(sheet, yayin_column, openai_api_key, force_refresh)) as events:
+            async for kind, payload in events:
+                if kind == "result":
+                    results.append(payload)
         
         # Convert to Excel
+        results.sort(key=lambda r: r.row)
         excel_bytes = results_to_excel(results)
         
         # Return as downloadable file
@@ -0,0 +1,177 @@
+"""
+Disk cache of fetched künye pages and their extractions.
+
+Künye pages change rarely, but every batch run fetched (and often rendered)
+all of them again and sent each one to OpenAI. The cleaned text of every
+page is now stored in a SQLite file (WAL mode) on a mounted volume, keyed by
+the normalized URL, together with the page's ETag / Last-Modified headers and
+a hash of the text:
+  - younger than PAGE_CACHE_TTL seconds: served from the cache
+  - older: revalidated with a conditional GET; a 304 renews the entry
+  - changed or without validators: fetched again
+
+Extraction results are stored by text hash and prompt fingerprint, so a
+page whose text did not change (even if it had to be fetched again, or is
+linked under another URL) does not go to OpenAI again.
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+PAGE_CACHE_ENABLED = os.getenv("PAGE_CACHE_ENABLED", "1") == "1"
+PAGE_CACHE_PATH = os.getenv("PAGE_CACHE_PATH", "/data/page-cache/pages.sqlite3")
+PAGE_CACHE_TTL = float(os.getenv("PAGE_CACHE_TTL", str(7 * 24 * 3600)))
+# Entries not renewed for this long are deleted at startup
+PAGE_CACHE_MAX_AGE = float(os.getenv("PAGE_CACHE_MAX_AGE", str(90 * 24 * 3600)))
+
+TRACKING_PARAMS = ("utm_", "fbclid", "gclid")
+
+
+def normalize_url(url: str) -> str:
+    """
+    Cache key of a URL: scheme added if missing, scheme/host lower-cased,
+    default port, fragment, tracking parameters and trailing slash dropped,
+    query parameters sorted.
+    """
+    url = url.strip()
+    if "://" not in url:
+        url = f"http://{url}"
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if port and (scheme, port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{port}"
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(TRACKING_PARAMS)
+    ))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class PageCache:
+    def __init__(self, path: str = PAGE_CACHE_PATH, ttl: float = PAGE_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                url_key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                text TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                tier TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS extractions (
+                content_hash TEXT NOT NULL,
+                prompt_key TEXT NOT NULL,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (content_hash, prompt_key)
+            );
+            """
+        )
+        self._conn.commit()
+
+    def get_page(self, url: str) -> Optional[Dict[str, Any]]:
+        """Cached page of a URL with a 'fresh' flag (younger than the TTL), or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, content_hash, tier, etag, last_modified, fetched_at FROM pages WHERE url_key = ?",
+                (normalize_url(url),),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "text": row[0],
+            "content_hash": row[1],
+            "tier": row[2],
+            "etag": row[3],
+            "last_modified": row[4],
+            "fetched_at": row[5],
+            "fresh": time.time() - row[5] < self.ttl,
+        }
+
+    def put_page(self, url: str, text: str, tier: str, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (url_key, url, text, content_hash, tier, etag, last_modified, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (normalize_url(url), url, text, text_hash(text), tier, etag, last_modified, time.time()),
+            )
+            self._conn.commit()
+
+    def renew_page(self, url: str):
+        """Marks a cached page as fetched now (after a 304 revalidation)."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE pages SET fetched_at = ? WHERE url_key = ?", (time.time(), normalize_url(url))
+            )
+            self._conn.commit()
+
+    def get_extraction(self, content_hash: str, prompt_key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM extractions WHERE content_hash = ? AND prompt_key = ?", (content_hash, prompt_key)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_extraction(self, content_hash: str, prompt_key: str, data: Dict[str, Any]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions (content_hash, prompt_key, data, created_at) VALUES (?, ?, ?, ?)",
+                (content_hash, prompt_key, json.dumps(data, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+
+    def prune(self, max_age: float = PAGE_CACHE_MAX_AGE) -> int:
+        """Deletes pages not renewed for max_age seconds and extractions no page refers to."""
+        cutoff = time.time() - max_age
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM pages WHERE fetched_at < ?", (cutoff,)).rowcount
+            self._conn.execute(
+                "DELETE FROM extractions WHERE created_at < ? AND content_hash NOT IN (SELECT content_hash FROM pages)",
+                (cutoff,),
+            )
+            self._conn.commit()
+        return deleted
+
+
+def create_page_cache() -> Optional[PageCache]:
+    """
+    Returns the configured cache, or None when caching is disabled or the
+    cache file cannot be opened (every page is then fetched and extracted).
+    """
+    if not PAGE_CACHE_ENABLED:
+        return None
+    try:
+        return PageCache()
+    except Exception as e:
+        print(f"[ERROR] Error opening page cache at {PAGE_CACHE_PATH}: {e}")
+        return None
+
+
+page_cache = create_page_cache()
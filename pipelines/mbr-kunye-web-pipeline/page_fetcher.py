@@ -0,0 +1,276 @@
+"""
+Two-tier fetching of künye pages.
+
+Most künye pages are server-rendered, yet every page used to be rendered in
+headless Chromium. fetch_page_content() now first tries a plain GET through
+the shared keep-alive HTTP client and extracts the text with lxml. Only when
+that fails, returns too little text or looks like a JavaScript shell /
+bot check, the page is rendered with Playwright (browser pool).
+
+The tier that worked is remembered per domain for FETCH_TIER_TTL seconds,
+so later rows of a JS-only site go straight to the browser and rows of a
+static site never touch it. Fetched pages go through the page cache
+(page_cache, when it is available), so unchanged pages are not fetched again
+within its TTL.
+"""
+import os
+import re
+import time
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+import lxml.html
+from lxml import etree
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+from browser_pool import browser_pool
+from crawler import domain_of
+from http_client import get_client
+from page_cache import page_cache, text_hash
+from page_loading import wait_for_content
+
+# Static pages with less visible text than this are rendered in the browser instead
+STATIC_MIN_TEXT = int(os.getenv("STATIC_MIN_TEXT", "300"))
+STATIC_TIMEOUT = float(os.getenv("STATIC_TIMEOUT", "15"))
+FETCH_TIER_TTL = float(os.getenv("FETCH_TIER_TTL", "86400"))
+# Rendered pages are used once their body has this much text and the DOM has loaded
+BROWSER_MIN_TEXT = int(os.getenv("BROWSER_MIN_TEXT", "200"))
+
+# Text that shows the künye itself has rendered (JavaScript regex; İ/I spelled out, JS cannot case-fold them)
+KUNYE_MARKERS = "künye|imtiyaz|İmtiyaz|İMTİYAZ|yayın yönetmeni|YAYIN YÖNETMENİ|yazı işleri|YAZI İŞLERİ"
+
+# Pages that need JavaScript or show a bot check instead of content
+JS_GATE_PATTERN = re.compile(
+    r"enable javascript|javascript (is )?(required|disabled)|javascript'?i? ?etkinleştir"
+    r"|please turn on javascript|checking your browser|just a moment\.\.\.|cf-browser-verification"
+    r"|<div id=\"(root|app|__next|__nuxt)\">\s*</div>",
+    re.IGNORECASE,
+)
+
+TIER_STATIC = "static"
+TIER_BROWSER = "browser"
+TIER_CACHE = "cache"
+
+# domain -> (tier, time it was recorded)
+_domain_tiers: Dict[str, Tuple[str, float]] = {}
+
+
+def html_to_text(html, encoding: Optional[str] = None) -> str:
+    """
+    Visible text of an HTML document (str or bytes), one text block per line.
+    For bytes, `encoding` (e.g. the Content-Type charset) overrides the
+    document's own <meta charset> / XML declaration.
+    """
+    parser = None
+    if encoding:
+        try:
+            parser = lxml.html.HTMLParser(encoding=encoding)
+        except LookupError:
+            pass  # Unknown charset name: let lxml detect it
+    try:
+        doc = lxml.html.fromstring(html, parser=parser)
+    except (ValueError, etree.ParserError):
+        return ""
+    for element in doc.xpath("//script | //style | //noscript | //template"):
+        element.drop_tree()
+    lines = [text.strip() for text in doc.itertext()]
+    return "\n".join(line for line in lines if line)
+
+
+def looks_js_gated(html: str, text: str) -> bool:
+    """True if a statically fetched page probably needs the browser."""
+    return len(text) < STATIC_MIN_TEXT or bool(JS_GATE_PATTERN.search(html[:20000]))
+
+
+def domain_tier(url: str) -> Optional[str]:
+    entry = _domain_tiers.get(domain_of(url))
+    if entry is None or time.time() - entry[1] > FETCH_TIER_TTL:
+        return None
+    return entry[0]
+
+
+def remember_tier(url: str, tier: str):
+    _domain_tiers[domain_of(url)] = (tier, time.time())
+
+
+@dataclass
+class FetchedPage:
+    text: str
+    tier: str  # TIER_STATIC, TIER_BROWSER or TIER_CACHE
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @property
+    def content_hash(self) -> str:
+        return text_hash(self.text)
+
+    @property
+    def from_cache(self) -> bool:
+        return self.tier == TIER_CACHE
+
+
+async def fetch_page_content_static(url: str) -> Optional[FetchedPage]:
+    """
+    GETs a page without a browser and extracts its text.
+
+    Returns:
+        The page, or None if the request failed or the page needs the browser
+    """
+    try:
+        response = await get_client().get(url, timeout=STATIC_TIMEOUT)
+    except httpx.HTTPError as e:
+        print(f"[DEBUG] Static fetch failed for {url}: {type(e).__name__}")
+        return None
+    return await page_from_response(url, response)
+
+
+async def page_from_response(url: str, response: httpx.Response) -> Optional[FetchedPage]:
+    """Text of a static response, or None if it is unusable or the page needs the browser."""
+    if response.status_code >= 400 or "html" not in response.headers.get("content-type", "html"):
+        print(f"[DEBUG] Static fetch unusable for {url}: HTTP {response.status_code}, {response.headers.get('content-type')}")
+        return None
+
+    # Parse the bytes: lxml rejects a decoded str that starts with an <?xml encoding=...?> declaration.
+    # The header charset wins; without one lxml reads the <meta charset> itself.
+    charset = response.encoding if response.charset_encoding else None  # httpx drops unknown charset names
+    text = await asyncio.to_thread(html_to_text, response.content, charset)
+    head = response.content[:20000].decode(charset or "utf-8", "ignore")
+    if looks_js_gated(head, text):
+        print(f"[DEBUG] Static page of {url} looks JS-gated ({len(text)} chars)")
+        return None
+    return FetchedPage(text, TIER_STATIC, response.headers.get("etag"), response.headers.get("last-modified"))
+
+
+async def fetch_page_content_with_playwright(url: str) -> Optional[FetchedPage]:
+    """
+    Fetches web page content using Playwright for JavaScript rendering support.
+    Extracts visible text from the page after JavaScript execution.
+    The page is opened in a warm context borrowed from the browser pool.
+
+    Args:
+        url: Web page URL
+
+    Returns:
+        The page or None if fetch fails
+    """
+    try:
+        print(f"[DEBUG] Fetching page with Playwright: {url}")
+
+        async with browser_pool.page() as page:
+            try:
+                # Navigate to page with timeout
+                response = await page.goto(url, wait_until='domcontentloaded', timeout=30000)
+
+                # Wait for the künye text instead of network idle; go on with what is there on timeout
+                if not await wait_for_content(page, min_chars=BROWSER_MIN_TEXT, markers=KUNYE_MARKERS):
+                    print(f"[WARNING] Content wait timed out for {url}, using the page as loaded")
+
+                # Get page content
+                html_content = await page.content()
+                headers = response.headers if response is not None else {}
+            except PlaywrightTimeoutError:
+                print(f"[ERROR] Timeout loading page: {url}")
+                return None
+            except Exception as e:
+                print(f"[ERROR] Error during page interaction: {e}")
+                return None
+
+        clean_text = await asyncio.to_thread(html_to_text, html_content)
+
+        if len(clean_text) < 50:
+            print(f"[WARNING] Extracted text too short: {len(clean_text)} chars")
+            return None
+
+        print(f"[DEBUG] Successfully extracted {len(clean_text)} characters from {url}")
+        return FetchedPage(clean_text, TIER_BROWSER, headers.get("etag"), headers.get("last-modified"))
+
+    except Exception as e:
+        print(f"[ERROR] Playwright error for {url}: {e}")
+        return None
+
+
+async def revalidate(url: str, etag: Optional[str], last_modified: Optional[str]) -> Optional[httpx.Response]:
+    """
+    Conditional GET for a cached page. Returns the response (304 when the
+    page did not change), or None without validators or on a failed request.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    if not headers:
+        return None
+    try:
+        return await get_client().get(url, headers=headers, timeout=STATIC_TIMEOUT)
+    except httpx.HTTPError:
+        return None
+
+
+async def cached_entry(url: str) -> Optional[Dict[str, Any]]:
+    """The page cache entry of a URL, fresh or not; None without an entry or without a cache."""
+    if page_cache is None:
+        return None
+    return await asyncio.to_thread(page_cache.get_page, url)
+
+
+def fresh_page(cached: Optional[Dict[str, Any]]) -> Optional[FetchedPage]:
+    """The page of a cache entry if it is still fresh (no network access needed)."""
+    if cached and cached["fresh"]:
+        return FetchedPage(cached["text"], TIER_CACHE, cached["etag"], cached["last_modified"])
+    return None
+
+
+async def fetch_page_content(url: str, force_refresh: bool = False) -> Optional[FetchedPage]:
+    """
+    Fetches the visible text of a page: from the page cache while it is fresh
+    or revalidates, otherwise statically when that works for the domain, and
+    with Playwright as the last resort. force_refresh skips the cache.
+
+    Returns:
+        The page or None if both tiers fail
+    """
+    cached = None if force_refresh else await cached_entry(url)
+    page = fresh_page(cached)
+    if page:
+        print(f"[DEBUG] Page cache hit: {url}")
+        return page
+    return await refresh_page(url, cached)
+
+
+async def refresh_page(url: str, cached: Optional[Dict[str, Any]]) -> Optional[FetchedPage]:
+    """
+    Fetches a page that has no fresh cache entry: a stale entry (from
+    cached_entry) is revalidated first, then the page is fetched statically
+    or with Playwright, and the result is cached.
+
+    Returns:
+        The page or None if both tiers fail
+    """
+    page = None
+    if cached:
+        response = await revalidate(url, cached["etag"], cached["last_modified"])
+        if response is not None and response.status_code == 304:
+            await asyncio.to_thread(page_cache.renew_page, url)
+            print(f"[DEBUG] Page cache revalidated: {url}")
+            return FetchedPage(cached["text"], TIER_CACHE, cached["etag"], cached["last_modified"])
+        if response is not None and cached["tier"] == TIER_STATIC:
+            # Changed static page: the revalidation response already holds the new version
+            page = await page_from_response(url, response)
+
+    if page is None and domain_tier(url) != TIER_BROWSER:
+        page = await fetch_page_content_static(url)
+        if page:
+            remember_tier(url, TIER_STATIC)
+            print(f"[DEBUG] Static fetch: {len(page.text)} characters from {url}")
+
+    if page is None:
+        page = await fetch_page_content_with_playwright(url)
+        if page:
+            remember_tier(url, TIER_BROWSER)
+
+    if page and page_cache is not None:
+        await asyncio.to_thread(page_cache.put_page, url, page.text, page.tier, page.etag, page.last_modified)
+    return page
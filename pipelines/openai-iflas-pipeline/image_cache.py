@@ -0,0 +1,268 @@
+"""
+On-disk cache of clip images keyed by GNO.
+
+Every batch run used to download each clip from imgsrv.medyatakip.com again.
+Images are now stored as files next to a SQLite index that keeps their ETag /
+Last-Modified validators. A cached image younger than
+IMAGE_CACHE_REVALIDATE_AFTER seconds is served without any request; an older
+one is revalidated with a conditional GET, so an unchanged clip costs a 304
+instead of a full download. The cache is trimmed least-recently-used first once
+its total size exceeds the configured cap.
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import asyncio
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from http_client import fetch, verify_image
+
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "1") == "1"
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "/data/image-cache")
+IMAGE_CACHE_MAX_MB = int(os.getenv("IMAGE_CACHE_MAX_MB", "2048"))
+# Cached images older than this (seconds) are revalidated with the server before use
+IMAGE_CACHE_REVALIDATE_AFTER = int(os.getenv("IMAGE_CACHE_REVALIDATE_AFTER", "86400"))
+
+# After an eviction pass the cache is trimmed down to this fraction of the cap,
+# so a full cache does not evict on every single insert
+EVICTION_TARGET_RATIO = 0.9
+
+
+def clip_image_url(clip_id: str) -> str:
+    return f"https://imgsrv.medyatakip.com/store/clip?gno={clip_id}"
+
+
+@dataclass
+class CachedImage:
+    gno: str
+    data: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    validated_at: float
+
+
+class ImageCache:
+    def __init__(self, directory: str = IMAGE_CACHE_DIR, max_bytes: int = IMAGE_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS images (
+                gno TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                size INTEGER NOT NULL,
+                validated_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_images_last_access ON images(last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()[0]
+
+    def _file_path(self, gno: str) -> str:
+        digest = hashlib.sha1(gno.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, gno: str) -> Optional[CachedImage]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, validated_at FROM images WHERE gno = ?", (gno,)
+            ).fetchone()
+            if row is None:
+                return None
+            try:
+                with open(self._file_path(gno), "rb") as f:
+                    data = f.read()
+            except OSError:
+                # File went missing (e.g. volume cleaned by hand); forget the entry
+                self._remove(gno)
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE images SET last_access = ? WHERE gno = ?", (time.time(), gno))
+            self._conn.commit()
+            return CachedImage(gno, data, row[0], row[1], row[2])
+
+    def put(self, gno: str, data: bytes, etag: Optional[str], last_modified: Optional[str]):
+        size = len(data)
+        if size > self.max_bytes:
+            return
+
+        path = self._file_path(gno)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so a crash never leaves a truncated image behind
+        temp_path = f"{path}.tmp{threading.get_ident()}"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM images WHERE gno = ?", (gno,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO images (gno, etag, last_modified, size, validated_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (gno, etag, last_modified, size, now, now),
+            )
+            self._total_bytes += size - (previous[0] if previous else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def mark_validated(self, gno: str):
+        with self._lock:
+            self._conn.execute("UPDATE images SET validated_at = ? WHERE gno = ?", (time.time(), gno))
+            self._conn.commit()
+
+    def _remove(self, gno: str):
+        """Caller must hold the lock."""
+        row = self._conn.execute("SELECT size FROM images WHERE gno = ?", (gno,)).fetchone()
+        if row is None:
+            return
+        self._conn.execute("DELETE FROM images WHERE gno = ?", (gno,))
+        self._total_bytes -= row[0]
+        try:
+            os.remove(self._file_path(gno))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """
+        Drops least-recently-used images until the cache is under the target size.
+        Caller must hold the lock.
+        """
+        target = int(self.max_bytes * EVICTION_TARGET_RATIO)
+        cursor = self._conn.execute("SELECT gno, size FROM images ORDER BY last_access ASC")
+        doomed = []
+        for gno, size in cursor:
+            if self._total_bytes <= target:
+                break
+            doomed.append(gno)
+            self._total_bytes -= size
+        for gno in doomed:
+            self._conn.execute("DELETE FROM images WHERE gno = ?", (gno,))
+            try:
+                os.remove(self._file_path(gno))
+            except OSError:
+                pass
+        self.evictions += len(doomed)
+        print(f"[DEBUG] Image cache evicted {len(doomed)} images")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        lookups = self.hits + self.revalidated + self.misses
+        return {
+            "enabled": True,
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.revalidated) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "size_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class RunCacheStats:
+    """Cache outcome counters for one batch run, reported in its 'complete' event."""
+
+    def __init__(self):
+        self.hits = 0  # Served from disk without a request
+        self.revalidated = 0  # Server answered 304 Not Modified
+        self.misses = 0  # Downloaded in full
+        self.stale = 0  # Download failed, older cached copy used
+
+    def to_dict(self) -> dict:
+        lookups = self.hits + self.revalidated + self.misses + self.stale
+        return {
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+        }
+
+
+def create_image_cache() -> Optional[ImageCache]:
+    """
+    Returns the configured cache, or None when caching is disabled or the
+    cache directory cannot be opened (downloads then go straight to the server).
+    """
+    if not IMAGE_CACHE_ENABLED:
+        return None
+    try:
+        return ImageCache()
+    except Exception as e:
+        print(f"[ERROR] Error opening image cache at {IMAGE_CACHE_DIR}: {e}")
+        return None
+
+
+image_cache = create_image_cache()
+
+
+async def download_clip_image(clip_id: str, run_stats: Optional[RunCacheStats] = None) -> Optional[bytes]:
+    """
+    Returns the image of a clip, from the disk cache when possible.
+    Returns None if it can neither be downloaded nor found in the cache.
+    """
+    run_stats = run_stats or RunCacheStats()
+    image_url = clip_image_url(clip_id)
+    cached = await asyncio.to_thread(image_cache.get, clip_id) if image_cache else None
+
+    if cached and time.time() - cached.validated_at < IMAGE_CACHE_REVALIDATE_AFTER:
+        image_cache.hits += 1
+        run_stats.hits += 1
+        return cached.data
+
+    headers = {}
+    if cached and cached.etag:
+        headers["If-None-Match"] = cached.etag
+    if cached and cached.last_modified:
+        headers["If-Modified-Since"] = cached.last_modified
+
+    try:
+        print(f"[DEBUG] Downloading image from: {image_url}")
+        response = await fetch(image_url, headers=headers)
+
+        if response.status_code == 304 and cached:
+            await asyncio.to_thread(image_cache.mark_validated, clip_id)
+            image_cache.revalidated += 1
+            run_stats.revalidated += 1
+            return cached.data
+
+        response.raise_for_status()
+        data = verify_image(response)
+    except Exception as e:
+        print(f"[ERROR] Error downloading image from {image_url}: {e}")
+        data = None
+
+    if data is None:
+        if cached:
+            print(f"[WARNING] Using cached image for {clip_id} after failed download")
+            run_stats.stale += 1
+            return cached.data
+        return None
+
+    if image_cache:
+        await asyncio.to_thread(
+            image_cache.put, clip_id, data, response.headers.get("etag"), response.headers.get("last-modified")
+        )
+        image_cache.misses += 1
+    run_stats.misses += 1
+    return data
@@ -8,11 +8,13 @@ import openai
 import os
 import base64
 import json
-from io import BytesIO
-import pandas as pd
 from bs4 import BeautifulSoup
-from PIL import Image
-import time
+import asyncio
+from rate_limiter import create_chat_completion
+from http_client import close_client
+from image_cache import RunCacheStats, download_clip_image, image_cache
+from run_store import new_lease_owner, new_run_id, run_store
+from excel_ingest import read_sheet
 
 app = FastAPI(title="MTM İflas OCR Pipeline", version="1.0.0")
 
@@ -146,9 +148,24 @@ Senin görevin, bu metni analiz etmek, mantıksal çıkarımlar yaparak eksik ve
   "kaynak": "string veya null"
 }}"""
 
+@app.on_event("startup")
+async def prune_run_store():
+    if run_store is None:
+        return
+    pruned = await asyncio.to_thread(run_store.prune)
+    if pruned:
+        print(f"[DEBUG] Pruned {pruned} old runs from the run store")
+
+@app.on_event("shutdown")
+async def shutdown_http_client():
+    await close_client()
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "image_cache": image_cache.stats() if image_cache else {"enabled": False},
+    }
 
 @app.post("/api/v1/pipelines/iflas-ocr", response_model=List[IflasResult])
 async def process_iflas_notice(
@@ -205,7 +222,8 @@ async def process_iflas_notice(
             
             prompt = create_extraction_prompt(ocr_text)
             
-            response = client.chat.completions.create(
+            response = await create_chat_completion(
+                client,
                 model="gpt-4o-mini",  # Cost-effective model
                 messages=[
                     {"role": "system", "content": "Sen yapılandırılmış veri çıkarımı yapan bir asistansın. Sadece geçerli JSON döndür."},
@@ -261,45 +279,6 @@ def extract_image_url_from_medyatakip(clip_id: str) -> Optional[str]:
         return None
 
 
-def download_image(image_url: str) -> Optional[bytes]:
-    """
-    Downloads image from URL and returns bytes.
-    
-    Args:
-        image_url: URL of the image
-    
-    Returns:
-        Image bytes or None if download fails
-    """
-    try:
-        print(f"[DEBUG] Downloading image from: {image_url}")
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(image_url, headers=headers, timeout=30)
-        response.raise_for_status()
-        
-        content_type = response.headers.get('content-type', '')
-        print(f"[DEBUG] Download successful. Content-Type: {content_type}, Size: {len(response.content)} bytes")
-        
-        # Verify it's an image
-        try:
-            img = Image.open(BytesIO(response.content))
-            img.verify()
-            print(f"[DEBUG] Image verification successful. Format: {img.format}")
-        except Exception as e:
-            print(f"[WARNING] Image verification failed: {e}. Content might not be a valid image.")
-            # We might still want to return content if it's just a verification issue but looks like image
-            if 'image' not in content_type:
-                return None
-        
-        return response.content
-        
-    except Exception as e:
-        print(f"[ERROR] Error downloading image from {image_url}: {e}")
-        return None
-
-
 class BatchIflasResult(BaseModel):
     """Result model for batch processing"""
     row: int
@@ -317,6 +296,16 @@ class BatchProcessingSummary(BaseModel):
     successful: int
     failed: int
     results: List[BatchIflasResult]
+    image_cache: Optional[Dict[str, Any]] = None  # Disk image cache hits/misses for this run
+    run_id: Optional[str] = None  # Checkpoint ID for resuming an interrupted run
+
+
+BATCH_PIPELINE = "iflas-ocr-batch"
+
+
+def require_run_store():
+    if run_store is None:
+        raise HTTPException(status_code=503, detail="Run deposu kullanılamıyor")
 
 
 @app.post("/api/v1/pipelines/iflas-ocr-batch", response_model=BatchProcessingSummary)
@@ -324,7 +313,8 @@ async def process_iflas_batch_from_excel(
     file: UploadFile = File(...),
     openai_api_key: Optional[str] = Form(None),
     id_column: str = Form("A"),  # Excel column containing clip IDs
-    max_concurrent: int = Form(5)  # Max concurrent processing
+    max_concurrent: int = Form(5),  # Max concurrent processing
+    run_id: Optional[str] = Form(None)  # Checkpoint ID; generated if not given
 ):
     """
     Processes multiple bankruptcy/foreclosure notices from Excel file containing medyatakip.com clip IDs.
@@ -339,6 +329,10 @@ async def process_iflas_batch_from_excel(
        - Performs OCR using DeepSeek
        - Extracts structured data using OpenAI GPT-4
     4. Returns summary and results
+    
+    Every finished row is checkpointed under a run ID (the optional run_id
+    form field lets the client choose it), so a run interrupted by a dropped
+    connection can be continued with the resume endpoint.
     """
     
     # Validate API key
@@ -348,40 +342,109 @@ async def process_iflas_batch_from_excel(
             detail="OpenAI API Key gerekli. Lütfen API key'inizi girin."
         )
     
+    contents = await file.read()
+    run_id = run_id or new_run_id()
+    owner = new_lease_owner()
+    if run_store is not None:
+        created = await asyncio.to_thread(
+            run_store.create_run, run_id, BATCH_PIPELINE, contents, {"id_column": id_column}, owner
+        )
+        if not created:
+            raise HTTPException(status_code=409, detail="Bu run ID zaten kullanılmış. Devam etmek için resume kullanın.")
+    print(f"Batch run ID: {run_id}")
+    
+    return await run_iflas_batch(run_id, contents, openai_api_key, id_column, {}, owner)
+
+
+@app.post("/api/v1/pipelines/iflas-ocr-batch/{run_id}/resume", response_model=BatchProcessingSummary)
+async def resume_iflas_batch(
+    run_id: str,
+    openai_api_key: Optional[str] = Form(None),
+    retry_failed: bool = Form(False)
+):
+    """
+    Continues an interrupted batch run: rows that already have a checkpoint
+    are skipped (failed rows are processed again if retry_failed is set).
+    """
+    if not openai_api_key or not openai_api_key.strip():
+        raise HTTPException(
+            status_code=400,
+            detail="OpenAI API Key gerekli. Lütfen API key'inizi girin."
+        )
+    
+    require_run_store()
+    
+    run = await asyncio.to_thread(run_store.get_run, run_id)
+    if run is None or run["pipeline"] != BATCH_PIPELINE:
+        raise HTTPException(status_code=404, detail="Run ID bulunamadı")
+    owner = new_lease_owner()
+    if not await asyncio.to_thread(run_store.claim_run, run_id, owner):
+        raise HTTPException(status_code=409, detail="Bu run hâlâ işleniyor")
+    
+    contents = await asyncio.to_thread(run_store.get_source, run_id)
+    finished = await asyncio.to_thread(run_store.finished_rows, run_id)
+    if retry_failed:
+        finished = {row: result for row, result in finished.items() if result["status"] == "success"}
+    
+    return await run_iflas_batch(run_id, contents, openai_api_key, run["settings"]["id_column"], finished, owner)
+
+
+@app.get("/api/v1/pipelines/iflas-ocr-batch/runs")
+async def list_batch_runs(limit: int = 50):
+    """
+    Lists recent batch runs (newest first) with their checkpointed row counts
+    """
+    require_run_store()
+    return await asyncio.to_thread(run_store.list_runs, BATCH_PIPELINE, limit)
+
+
+async def run_iflas_batch(
+    run_id: str,
+    contents: bytes,
+    openai_api_key: str,
+    id_column: str,
+    finished: Dict[int, Dict[str, Any]],
+    owner: str
+) -> BatchProcessingSummary:
+    """
+    Processes the rows of an uploaded Excel file, skipping rows in `finished`
+    (their checkpointed results are included in the summary). The run's
+    lease held by `owner` is released when processing stops.
+    """
     results = []
     total = 0
     successful = 0
     failed = 0
+    image_cache_stats = RunCacheStats()
     
-    try:
-        # Read Excel file
-        contents = await file.read()
-        df = pd.read_excel(BytesIO(contents))
-        
-        # Get column index (A=0, B=1, etc.)
-        col_idx = ord(id_column.upper()) - ord('A')
-        
-        if col_idx >= len(df.columns):
-            raise HTTPException(
-                status_code=400,
-                detail=f"Kolon {id_column} Excel dosyasında bulunamadı."
+    async def record(row_result: BatchIflasResult):
+        results.append(row_result)
+        if run_store is not None:
+            await asyncio.to_thread(
+                run_store.save_row, run_id, row_result.row, row_result.clip_id, row_result.status, row_result.dict()
             )
+    
+    try:
+        # Read the clip ID column (and "Yayın Adı"/"Sayfa" for kaynak, if the sheet has them)
+        sheet = await asyncio.to_thread(
+            read_sheet, contents, id_column, optional_columns=["Yayın Adı", "Sayfa"]
+        )
+        total = len(sheet.rows)
         
-        # Check if "Yayın Adı" and "Sayfa" columns exist
-        yayin_adi_exists = "Yayın Adı" in df.columns
-        sayfa_exists = "Sayfa" in df.columns
-        
-        print(f"Excel columns: {df.columns.tolist()}")
-        print(f"Yayın Adı column exists: {yayin_adi_exists}, Sayfa column exists: {sayfa_exists}")
-        
-        # Get clip IDs from column
-        clip_ids = df.iloc[:, col_idx].dropna().astype(str).tolist()
-        total = len(clip_ids)
-        
-        print(f"Processing {total} clip IDs from Excel...")
+        print(f"Processing {total} clip IDs from Excel ({sheet.duplicates} duplicates skipped)...")
         
         # Process each clip ID
-        for idx, clip_id in enumerate(clip_ids, start=1):
+        for idx, sheet_row in enumerate(sheet.rows, start=1):
+            clip_id = sheet_row.id
+            if idx in finished:
+                # Done before the run was interrupted
+                results.append(BatchIflasResult(**finished[idx]))
+                if finished[idx]["status"] == "success":
+                    successful += 1
+                else:
+                    failed += 1
+                continue
+            
             row_result = BatchIflasResult(
                 row=idx,
                 clip_id=clip_id,
@@ -397,18 +460,18 @@ async def process_iflas_batch_from_excel(
                     row_result.status = "failed"
                     row_result.error = "Sayfadaki görsele ulaşılamadı"
                     failed += 1
-                    results.append(row_result)
+                    await record(row_result)
                     continue
                 
-                # Step 2: Download image
+                # Step 2: Download image (or take it from the disk cache)
                 print(f"[{idx}/{total}] Downloading image from {image_url}...")
-                image_bytes = download_image(image_url)
+                image_bytes = await download_clip_image(clip_id, image_cache_stats)
                 
                 if not image_bytes:
                     row_result.status = "failed"
                     row_result.error = "Görsel indirilemedi"
                     failed += 1
-                    results.append(row_result)
+                    await record(row_result)
                     continue
                 
                 # Step 3: Perform OCR
@@ -422,7 +485,7 @@ async def process_iflas_batch_from_excel(
                         row_result.status = "failed"
                         row_result.error = f"OCR başarısız (HTTP {ocr_response.status_code})"
                         failed += 1
-                        results.append(row_result)
+                        await record(row_result)
                         continue
                         
                 except requests.exceptions.ConnectionError:
@@ -431,7 +494,7 @@ async def process_iflas_batch_from_excel(
                     row_result.status = "failed"
                     row_result.error = error_msg
                     failed += 1
-                    results.append(row_result)
+                    await record(row_result)
                     continue
                 except Exception as e:
                     error_msg = f"OCR hatası: {str(e)}"
@@ -439,7 +502,7 @@ async def process_iflas_batch_from_excel(
                     row_result.status = "failed"
                     row_result.error = error_msg
                     failed += 1
-                    results.append(row_result)
+                    await record(row_result)
                     continue
                 
                 ocr_data = ocr_response.json()
@@ -455,7 +518,7 @@ async def process_iflas_batch_from_excel(
                     row_result.error = "OCR metni çok kısa veya boş"
                     row_result.raw_ocr_text = ocr_text  # Save even if short
                     failed += 1
-                    results.append(row_result)
+                    await record(row_result)
                     continue
                 
                 # Store raw OCR text in result (birebir görsel yükleme ile aynı)
@@ -467,7 +530,8 @@ async def process_iflas_batch_from_excel(
                 
                 prompt = create_extraction_prompt(ocr_text)
                 
-                response = client.chat.completions.create(
+                response = await create_chat_completion(
+                    client,
                     model="gpt-4o-mini",
                     messages=[
                         {"role": "system", "content": "Sen yapılandırılmış veri çıkarımı yapan bir asistansın. Sadece geçerli JSON döndür."},
@@ -486,19 +550,8 @@ async def process_iflas_batch_from_excel(
                 # Get Yayın Adı and Sayfa from Excel for this row
                 kaynak_value = None
                 try:
-                    excel_row_idx = idx - 1  # idx is 1-indexed, df is 0-indexed
-                    yayin_adi = ""
-                    sayfa = ""
-                    
-                    if yayin_adi_exists and excel_row_idx < len(df):
-                        yayin_adi_val = df.loc[excel_row_idx, "Yayın Adı"]
-                        if pd.notna(yayin_adi_val):
-                            yayin_adi = str(yayin_adi_val).strip()
-                    
-                    if sayfa_exists and excel_row_idx < len(df):
-                        sayfa_val = df.loc[excel_row_idx, "Sayfa"]
-                        if pd.notna(sayfa_val):
-                            sayfa = str(sayfa_val).strip()
+                    yayin_adi = sheet_row.values["Yayın Adı"] or ""
+                    sayfa = sheet_row.values["Sayfa"] or ""
                     
                     # Combine Yayın Adı and Sayfa
                     if yayin_adi and sayfa:
@@ -524,29 +577,29 @@ async def process_iflas_batch_from_excel(
                 row_result.status = "success"
                 row_result.data = extracted_data
                 successful += 1
-                results.append(row_result)
+                await record(row_result)
                 
                 print(f"[{idx}/{total}] ✓ Success")
                 
-                # Rate limiting: small delay between requests
-                if idx < total:
-                    time.sleep(0.5)
-                
             except Exception as e:
                 print(f"[ERROR] Error processing clip {clip_id}: {type(e).__name__}: {e}")
                 row_result.status = "failed"
                 row_result.error = str(e)
                 failed += 1
-                results.append(row_result)
+                await record(row_result)
         
         print(f"Batch processing complete: {successful} successful, {failed} failed")
+        if run_store is not None:
+            await asyncio.to_thread(run_store.set_status, run_id, "completed")
         
         return BatchProcessingSummary(
             total=total,
             processed=len(results),
             successful=successful,
             failed=failed,
-            results=results
+            results=results,
+            image_cache=image_cache_stats.to_dict(),
+            run_id=run_id
         )
         
     except Exception as e:
@@ -555,6 +608,9 @@ async def process_iflas_batch_from_excel(
             status_code=400,
             detail=f"Excel dosyası okunamadı: {str(e)}"
         )
+    finally:
+        if run_store is not None:
+            await asyncio.to_thread(run_store.release_run, run_id, owner)
 
 
 if __name__ == "__main__":
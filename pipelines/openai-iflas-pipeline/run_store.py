@@ -0,0 +1,219 @@
+"""
+Checkpoints of Excel batch runs.
+
+Results of a batch run used to live only in the request handler, so a dropped
+connection lost every finished row. Each run now gets a run ID; the uploaded
+Excel file and every finished row are written to a SQLite file (WAL mode) on
+a mounted volume as they complete. A resume endpoint reads the file back and
+processes only the rows that have no checkpoint yet.
+
+A run being processed holds a lease (owner column) in the store, so with
+several uvicorn workers a run is never processed twice at the same time; the
+lease is renewed by every checkpoint and expires after RUN_LEASE_TTL seconds
+without one (the runner died). Runs not updated for RUN_STORE_MAX_AGE seconds
+are deleted, uploaded file included, at startup.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+RUN_STORE_PATH = os.getenv("RUN_STORE_PATH", "/data/runs/runs.sqlite3")
+# A runner that checkpointed no row for this long is considered dead and its run can be resumed
+RUN_LEASE_TTL = float(os.getenv("RUN_LEASE_TTL", "600"))
+RUN_STORE_MAX_AGE = float(os.getenv("RUN_STORE_MAX_AGE", str(30 * 24 * 3600)))
+
+
+def new_run_id() -> str:
+    return f"run_{uuid.uuid4().hex}"
+
+
+def new_lease_owner() -> str:
+    return uuid.uuid4().hex
+
+
+class RunStore:
+    def __init__(self, path: str = RUN_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                pipeline TEXT NOT NULL,
+                status TEXT NOT NULL,
+                settings TEXT NOT NULL,
+                source BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                owner TEXT,
+                lease_expires_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_runs_pipeline ON runs(pipeline, created_at);
+            CREATE INDEX IF NOT EXISTS idx_runs_updated_at ON runs(updated_at);
+
+            CREATE TABLE IF NOT EXISTS run_rows (
+                run_id TEXT NOT NULL,
+                row INTEGER NOT NULL,
+                clip_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT NOT NULL,
+                PRIMARY KEY (run_id, row)
+            );
+            """
+        )
+        self._conn.commit()
+
+    def create_run(self, run_id: str, pipeline: str, source: bytes, settings: Dict[str, Any], owner: str) -> bool:
+        """Stores a new run with its uploaded file, leased to owner; False if the run ID is already taken."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO runs "
+                "(run_id, pipeline, status, settings, source, created_at, updated_at, owner, lease_expires_at) "
+                "VALUES (?, ?, 'running', ?, ?, ?, ?, ?, ?)",
+                (run_id, pipeline, json.dumps(settings), source, now, now, owner, now + RUN_LEASE_TTL),
+            )
+            self._conn.commit()
+            return cursor.rowcount == 1
+
+    def claim_run(self, run_id: str, owner: str) -> bool:
+        """
+        Takes the lease of a run for a resume and marks it running; False while
+        another runner holds an unexpired lease.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE runs SET owner = ?, lease_expires_at = ?, status = 'running', updated_at = ? "
+                "WHERE run_id = ? AND (owner IS NULL OR lease_expires_at < ?)",
+                (owner, now + RUN_LEASE_TTL, now, run_id, now),
+            )
+            self._conn.commit()
+            return cursor.rowcount == 1
+
+    def release_run(self, run_id: str, owner: str):
+        """Gives up the lease once the runner has stopped (finished or interrupted)."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE runs SET owner = NULL, lease_expires_at = NULL WHERE run_id = ? AND owner = ?",
+                (run_id, owner),
+            )
+            self._conn.commit()
+
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """Run metadata and row counts (without the uploaded file), or None if unknown."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT run_id, pipeline, status, settings, created_at, updated_at FROM runs WHERE run_id = ?",
+                (run_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            counts = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM run_rows WHERE run_id = ? GROUP BY status", (run_id,)
+            ).fetchall())
+        return {
+            "run_id": row[0],
+            "pipeline": row[1],
+            "status": row[2],
+            "settings": json.loads(row[3]),
+            "created_at": row[4],
+            "updated_at": row[5],
+            "successful": counts.get("success", 0),
+            "failed": counts.get("failed", 0),
+        }
+
+    def get_source(self, run_id: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute("SELECT source FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        return row[0] if row else None
+
+    def save_row(self, run_id: str, row: int, clip_id: str, status: str, result: Dict[str, Any]):
+        """Checkpoints one finished row (overwriting an earlier attempt of the same row)."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO run_rows (run_id, row, clip_id, status, result) VALUES (?, ?, ?, ?, ?)",
+                (run_id, row, clip_id, status, json.dumps(result, ensure_ascii=False)),
+            )
+            # A checkpoint shows the runner is alive: renew its lease
+            self._conn.execute(
+                "UPDATE runs SET updated_at = ?, lease_expires_at = CASE WHEN owner IS NULL THEN NULL ELSE ? END "
+                "WHERE run_id = ?",
+                (time.time(), time.time() + RUN_LEASE_TTL, run_id),
+            )
+            self._conn.commit()
+
+    def finished_rows(self, run_id: str) -> Dict[int, Dict[str, Any]]:
+        """Checkpointed results of a run by row number."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row, result FROM run_rows WHERE run_id = ? ORDER BY row", (run_id,)
+            ).fetchall()
+        return {row: json.loads(result) for row, result in rows}
+
+    def set_status(self, run_id: str, status: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE runs SET status = ?, updated_at = ? WHERE run_id = ?", (status, time.time(), run_id)
+            )
+            self._conn.commit()
+
+    def list_runs(self, pipeline: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent runs of a pipeline first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT r.run_id, r.status, r.created_at, r.updated_at, "
+                "SUM(CASE WHEN w.status = 'success' THEN 1 ELSE 0 END), "
+                "SUM(CASE WHEN w.status = 'failed' THEN 1 ELSE 0 END) "
+                "FROM runs r LEFT JOIN run_rows w ON w.run_id = r.run_id "
+                "WHERE r.pipeline = ? GROUP BY r.run_id ORDER BY r.created_at DESC LIMIT ?",
+                (pipeline, limit),
+            ).fetchall()
+        return [
+            {
+                "run_id": r[0],
+                "status": r[1],
+                "created_at": r[2],
+                "updated_at": r[3],
+                "successful": r[4] or 0,
+                "failed": r[5] or 0,
+            }
+            for r in rows
+        ]
+
+    def prune(self, max_age: float = RUN_STORE_MAX_AGE) -> int:
+        """Deletes runs (with their file and checkpoints) not updated for max_age seconds and not leased."""
+        now = time.time()
+        with self._lock:
+            stale = "SELECT run_id FROM runs WHERE updated_at < ? AND (owner IS NULL OR lease_expires_at < ?)"
+            self._conn.execute(f"DELETE FROM run_rows WHERE run_id IN ({stale})", (now - max_age, now))
+            deleted = self._conn.execute(
+                "DELETE FROM runs WHERE updated_at < ? AND (owner IS NULL OR lease_expires_at < ?)",
+                (now - max_age, now),
+            ).rowcount
+            self._conn.commit()
+        return deleted
+
+
+def create_run_store() -> Optional[RunStore]:
+    """
+    Returns the run store, or None when its database cannot be opened (runs
+    then go without checkpoints and cannot be resumed).
+    """
+    try:
+        return RunStore()
+    except Exception as e:
+        print(f"[ERROR] Error opening run store at {RUN_STORE_PATH}: {e}")
+        return None
+
+
+run_store = create_run_store()